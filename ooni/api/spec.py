@@ -130,7 +130,7 @@ def get_reporters(net_test_loader):
     Returns:
         a list of reporter instances
     """
-    test_details = net_test_loader.testDetails
+    test_details = net_test_loader.setupTestDetails()
     reporters = []
     yaml_reporter = YAMLReporter(test_details, config.reports_directory)
     reporters.append(yaml_reporter)
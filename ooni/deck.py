@@ -3,6 +3,8 @@
 from ooni.nettest import NetTestLoader
 from ooni.settings import config
 from ooni.utils import log
+from ooni.utils.hashcache import fileHash
+from ooni.reporter import reportFormats
 from ooni import errors as e
 
 from twisted.internet import reactor, defer
@@ -11,7 +13,6 @@ import os
 import re
 import yaml
 import json
-from hashlib import sha256
 
 class InputFile(object):
     def __init__(self, input_hash):
@@ -62,9 +63,7 @@ class InputFile(object):
 
     def verify(self):
         digest = os.path.basename(self.cached_file)
-        with open(self.cached_file) as f:
-            file_hash = sha256(f.read())
-            assert file_hash.hexdigest() == digest
+        assert fileHash(self.cached_file) == digest
 
 def nettest_to_path(path):
     """
@@ -104,9 +103,8 @@ class Deck(InputFile):
         return self.cached_file + '.desc'
 
     def loadDeck(self, deckFile):
+        self.deckHash = fileHash(deckFile)
         with open(deckFile) as f:
-            self.deckHash = sha256(f.read())
-            f.seek(0)
             test_deck = yaml.safe_load(f)
 
         for test in test_deck:
@@ -118,11 +116,32 @@ class Deck(InputFile):
                 continue
             net_test_loader = NetTestLoader(test['options']['subargs'],
                     test_file=nettest_path)
+            if 'weight' in test['options']:
+                net_test_loader.weight = self.parseWeight(test['options']['weight'])
+            if test['options'].get('reportformat'):
+                net_test_loader.reportFormat = \
+                    self.parseReportFormat(test['options']['reportformat'])
             self.insert(net_test_loader)
             #XXX: If the deck specifies the collector, we use the specified collector
             # And it should also specify the test helper address to use
             # net_test_loader.collector = test['options']['collector']
 
+    def parseWeight(self, weight):
+        """ The weight of a NetTest must be a positive number """
+        try:
+            weight = float(weight)
+        except (TypeError, ValueError):
+            raise e.InvalidOption("weight")
+        if weight <= 0:
+            raise e.InvalidOption("weight")
+        return weight
+
+    def parseReportFormat(self, report_format):
+        """ The report format must be one of reporter.reportFormats """
+        if report_format not in reportFormats:
+            raise e.InvalidOption("reportformat")
+        return report_format
+
     def insert(self, net_test_loader):
         """ Add a NetTestLoader to this test deck """
         try:
@@ -141,6 +160,7 @@ class Deck(InputFile):
     def setup(self):
         """ fetch and verify inputs for all NetTests in the deck """
         for net_test_loader in self.netTestLoaders:
+            yield net_test_loader.hashInputFiles()
             log.msg("Fetching required net test inputs...")
             yield self.fetchAndVerifyNetTestInput(net_test_loader)
 
@@ -170,7 +190,7 @@ class Deck(InputFile):
         response = yield oonibclient.lookupTestHelpers(required_test_helpers)
 
         for net_test_loader in self.netTestLoaders:
-            log.msg("Setting collector and test helpers for %s" % net_test_loader.testDetails['test_name'])
+            log.msg("Setting collector and test helpers for %s" % net_test_loader.testName)
 
             # Only set the collector if the no collector has been specified
             # from the command line or via the test deck.
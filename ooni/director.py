@@ -5,8 +5,8 @@ import re
 
 from ooni import geoip
 from ooni.managers import ReportEntryManager, MeasurementManager
-from ooni.reporter import Report
-from ooni.utils import log, pushFilenameStack
+from ooni.reporter import Report, getSerializerPool
+from ooni.utils import log, pushFilenameStack, dnscache
 from ooni.utils.net import randomFreePort
 from ooni.nettest import NetTest, getNetTestInformation
 from ooni.settings import config
@@ -71,9 +71,12 @@ class Director(object):
 
         self.reportEntryManager = ReportEntryManager()
         self.reportEntryManager.director = self
-        # Link the TaskManager's by least available slots.
+        # Link the TaskManager's by least available slots. The
+        # measurementManager also stops starting new measurements while the
+        # reportEntryManager has too many entries waiting to be written.
         self.measurementManager.child = self.reportEntryManager
-        # Notify the parent when tasks complete # XXX deadlock!?
+        # Notify the parent when tasks complete, or when the backlog of report
+        # entries has drained, so that it can fill its slots again.
         self.reportEntryManager.parent = self.measurementManager
 
         self.successfulMeasurements = 0
@@ -165,6 +168,18 @@ class Director(object):
 
         return self.failedMeasurements / self.totalMeasurementRuntime
 
+    @property
+    def reportSerializationQueueDepth(self):
+        """
+        How many report entries are waiting to be serialized (or are being
+        serialized) in the serializer pool.
+        """
+        serializer_pool = getSerializerPool()
+        if serializer_pool is None:
+            return 0
+
+        return serializer_pool.queueDepth
+
     def measurementTimedOut(self, measurement):
         """
         This gets called every time a measurement times out independenty from
@@ -205,6 +220,14 @@ class Director(object):
 
     def netTestDone(self, net_test):
         self.activeNetTests.remove(net_test)
+        caching_resolver = dnscache.getCachingResolver()
+        if caching_resolver:
+            log.debug("DNS cache: %d hits, %d misses, %d coalesced lookups" %
+                      (caching_resolver.hits, caching_resolver.misses,
+                       caching_resolver.coalesced))
+        if getSerializerPool():
+            log.debug("%d report entries waiting to be serialized" %
+                      self.reportSerializationQueueDepth)
         if len(self.activeNetTests) == 0:
             self.allTestsDone.callback(None)
             self.allTestsDone = defer.Deferred()
@@ -219,10 +242,10 @@ class Director(object):
                 an instance of :class:ooni.nettest.NetTestLoader
         """
 
-        if config.privacy.includepcap:
-            if not config.reports.pcap:
-                config.reports.pcap = config.generatePcapFilename(net_test_loader.testDetails)
-            self.startSniffing()
+        self.startPcap(net_test_loader)
+
+        if config.advanced.dns_cache:
+            dnscache.installCachingResolver()
 
         report = Report(reporters, self.reportEntryManager)
 
@@ -232,15 +255,50 @@ class Director(object):
         yield net_test.report.open()
 
         yield net_test.initializeInputProcessor()
-        self.measurementManager.schedule(net_test.generateMeasurements())
+        self.measurementManager.schedule(net_test.generateMeasurements(),
+                                        net_test_loader.weight)
 
         self.activeNetTests.append(net_test)
 
         yield net_test.done
+        yield net_test.writeTestSummary()
+        if net_test_loader.journal:
+            net_test_loader.journal.close()
         yield report.close()
 
         self.netTestDone(net_test)
 
+    @defer.inlineCallbacks
+    def startShardedNetTest(self, net_test_loader, reporters, workers):
+        """
+        Like startNetTest, but the measurements are performed by workers
+        processes, each one of them running its own Director on a shard of the
+        inputs. The report entries of all the workers are written to reporters
+        by this process.
+
+        Args:
+            net_test_loader:
+                an instance of :class:ooni.nettest.NetTestLoader
+
+            workers:
+                the number of worker processes to run
+        """
+        from ooni.workers import runShardedNetTest
+
+        self.startPcap(net_test_loader)
+
+        self.activeNetTests.append(net_test_loader)
+        yield runShardedNetTest(net_test_loader, reporters,
+                                self.reportEntryManager, workers)
+
+        self.netTestDone(net_test_loader)
+
+    def startPcap(self, net_test_loader):
+        if config.privacy.includepcap:
+            if not config.reports.pcap:
+                config.reports.pcap = config.generatePcapFilename(net_test_loader.testDetails)
+            self.startSniffing()
+
     def startSniffing(self):
         """ Start sniffing with Scapy. Exits if required privileges (root) are not
         available.
@@ -159,6 +159,9 @@ class ProbeIPUnknown(Exception):
 class GeoIPDataFilesNotFound(Exception):
     pass
 
+class GeoIPNotAvailable(GeoIPDataFilesNotFound):
+    pass
+
 class NoMoreReporters(Exception):
     pass
 
@@ -204,6 +207,9 @@ class NoPostProcessor(Exception):
 class InvalidOption(Exception):
     pass
 
+class MalformedWorkerEntry(Exception):
+    pass
+
 def get_error(error_key):
     if error_key == 'test-helpers-key-missing':
         return CouldNotFindTestHelper
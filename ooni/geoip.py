@@ -11,40 +11,139 @@ from ooni.settings import config
 from ooni import errors
 
 try:
-    from pygeoip import GeoIP
+    from pygeoip import GeoIP, MMAP_CACHE
 except ImportError:
+    MMAP_CACHE = None
     try:
         import GeoIP as CGeoIP
         def GeoIP(database_path, *args, **kwargs):
-            return CGeoIP.open(database_path)
+            return CGeoIP.open(database_path, CGeoIP.GEOIP_MEMORY_CACHE)
     except ImportError:
+        GeoIP = None
         log.err("Unable to import pygeoip. We will not be able to run geo IP related measurements")
 
-class GeoIPDataFilesNotFound(Exception):
-    pass
+GeoIPDataFilesNotFound = errors.GeoIPDataFilesNotFound
+GeoIPNotAvailable = errors.GeoIPNotAvailable
 
-def IPToLocation(ipaddr):
-    city_file = os.path.join(config.advanced.geoip_data_dir, 'GeoLiteCity.dat')
-    country_file = os.path.join(config.advanced.geoip_data_dir, 'GeoIP.dat')
-    asn_file = os.path.join(config.advanced.geoip_data_dir, 'GeoIPASNum.dat')
+class GeoIPDatabases(object):
+    """
+    The GeoIP city, country and ASN databases found in data_dir.
 
-    location = {'city': None, 'countrycode': None, 'asn': None}
-    try:
-        city_dat = GeoIP(city_file)
-        location['city'] = city_dat.record_by_addr(ipaddr)['city']
+    Every database is opened the first time it is needed and then kept open
+    (memory mapped when using pygeoip), so that lookups do not read the
+    database files again.
+    """
+    databaseFiles = {
+        'city': 'GeoLiteCity.dat',
+        'country': 'GeoIP.dat',
+        'asn': 'GeoIPASNum.dat'
+    }
 
-        country_dat = GeoIP(country_file)
-        location['countrycode'] = country_dat.country_code_by_addr(ipaddr)
+    def __init__(self, data_dir):
+        self.dataDir = data_dir
+        self._databases = {}
 
-        asn_dat = GeoIP(asn_file)
-        location['asn'] = asn_dat.org_by_addr(ipaddr).split(' ')[0]
+    def database(self, name):
+        try:
+            return self._databases[name]
+        except KeyError:
+            pass
+        if GeoIP is None:
+            raise GeoIPNotAvailable
+        path = os.path.join(self.dataDir, self.databaseFiles[name])
+        try:
+            database = GeoIP(path, MMAP_CACHE)
+        except IOError:
+            log.err("Could not find GeoIP data files. Go into data/ "
+                    "and run make geoip")
+            raise GeoIPDataFilesNotFound
+        self._databases[name] = database
+        return database
+
+    def lookup(self, ipaddr, fields=('city', 'countrycode', 'asn')):
+        """
+        Returns a dict with the city, the country code and the ASN of ipaddr
+        (or only the ones in fields). The values that are not known are None.
+        """
+        location = dict.fromkeys(fields)
+        if 'city' in fields:
+            record = self.database('city').record_by_addr(ipaddr)
+            if record:
+                location['city'] = record['city']
+        if 'countrycode' in fields:
+            location['countrycode'] = \
+                self.database('country').country_code_by_addr(ipaddr) or None
+        if 'asn' in fields:
+            org = self.database('asn').org_by_addr(ipaddr)
+            if org:
+                location['asn'] = org.split(' ')[0]
+        return location
+
+    def lookup_many(self, ips, fields=('city', 'countrycode', 'asn')):
+        """
+        Looks up all the addresses in ips, once each. The values of an
+        address whose lookup fails are all None.
 
-    except IOError:
-        log.err("Could not find GeoIP data files. Go into data/ "
-                "and run make geoip")
-        raise GeoIPDataFilesNotFound
+        Raises:
+            GeoIPDataFilesNotFound if the databases are not available.
 
-    return location
+        Returns:
+            a dict of address to the location returned by lookup.
+        """
+        locations = {}
+        for ipaddr in ips:
+            if ipaddr in locations:
+                continue
+            try:
+                locations[ipaddr] = self.lookup(ipaddr, fields)
+            except GeoIPDataFilesNotFound:
+                raise
+            except Exception as exc:
+                log.err("Could not lookup the location of %s: %s" %
+                        (ipaddr, exc))
+                locations[ipaddr] = dict.fromkeys(fields)
+        return locations
+
+_geoIPDatabases = {}
+
+def getGeoIP():
+    """
+    Returns the GeoIP databases of the geoip_data_dir, shared by the whole
+    process.
+    """
+    data_dir = config.advanced.geoip_data_dir
+    if data_dir not in _geoIPDatabases:
+        _geoIPDatabases[data_dir] = GeoIPDatabases(data_dir)
+    return _geoIPDatabases[data_dir]
+
+def IPToLocation(ipaddr):
+    return getGeoIP().lookup(ipaddr)
+
+def annotateAddresses(entries, key='address'):
+    """
+    Adds the ASN and the country code of the address in entries[i][key] to
+    every entry, as far as the privacy settings allow it.
+
+    The values are None when GeoIP is not available or the lookup of an
+    address fails, so that the entries are always reported.
+    """
+    fields = []
+    if config.privacy.includeasn:
+        fields.append('asn')
+    if config.privacy.includecountry:
+        fields.append('countrycode')
+    if not entries or not fields:
+        return
+    unknown = dict.fromkeys(fields)
+    locations = {}
+    if GeoIP is not None:
+        try:
+            locations = getGeoIP().lookup_many(
+                [entry[key] for entry in entries], fields)
+        except GeoIPDataFilesNotFound:
+            pass
+    for entry in entries:
+        entry.update(locations.get(entry[key], unknown))
 
 class HTTPGeoIPLookupper(object):
     url = None
@@ -55,10 +154,8 @@ class HTTPGeoIPLookupper(object):
         self.agent = self._agent(reactor)
 
     def _response(self, response):
-        content_length = response.headers.getRawHeaders('content-length')
-
         finished = defer.Deferred()
-        response.deliverBody(BodyReceiver(finished, content_length))
+        response.deliverBody(BodyReceiver(finished))
         finished.addCallback(self.parseResponse)
         return finished
 
@@ -0,0 +1,129 @@
+import os
+import glob
+from hashlib import sha1
+
+from twisted.internet import reactor
+
+from ooni.utils import log
+from ooni.settings import config
+
+def inputHash(test_input):
+    """
+    Returns a short digest of test_input, used to check that the input at a
+    given index has not changed between a run and its resumption.
+    """
+    return sha1(repr(test_input)).hexdigest()[:16]
+
+class Journal(object):
+    """
+    An append-only log of the report entries that have been written for a
+    NetTest, used to resume an interrupted run.
+
+    Every line records the test case, the index and the hash of the input and
+    the test methods of one report entry. Lines are kept in memory and are
+    written and synced to disk at most once every syncInterval seconds (or
+    syncEntries entries), so that journaling costs almost nothing per
+    measurement. before_sync is called before the lines are written, so that
+    the report entries they refer to can be written to disk first (they may
+    be buffered by the reporter).
+    """
+    syncInterval = 1.0
+    syncEntries = 100
+
+    def __init__(self, path, before_sync=None, clock=reactor):
+        if config.advanced.journal_sync_interval:
+            self.syncInterval = config.advanced.journal_sync_interval
+        if config.advanced.journal_sync_entries:
+            self.syncEntries = config.advanced.journal_sync_entries
+        self.path = path
+        self.beforeSync = before_sync
+        self.clock = clock
+        # Maps the name of a test case to a dict of input index to input hash
+        self.done = {}
+        self._stream = None
+        self._lines = []
+        self._syncCall = None
+
+    def load(self):
+        """
+        Reads the entries of an existing journal. A truncated last line, left
+        over by a crash, is ignored.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    test_name, index, digest, _ = line.split(' ')
+                    index = int(index)
+                except ValueError:
+                    continue
+                self.done.setdefault(test_name, {})[index] = digest
+        log.msg("Resuming from %s: %d report entries already written" %
+                (self.path, sum(map(len, self.done.values()))))
+
+    def isDone(self, test_name, index, test_input):
+        """
+        Returns True if the report entry for the input at index has already
+        been written.
+        """
+        try:
+            digest = self.done[test_name][index]
+        except KeyError:
+            return False
+        if digest != inputHash(test_input):
+            log.err("Input %d of %s differs from the one in the journal, "
+                    "measuring it again" % (index, test_name))
+            return False
+        return True
+
+    def record(self, test_name, index, test_input, test_methods):
+        """
+        Records that the report entry for the input at index has been written.
+        """
+        self._lines.append("%s %d %s %s\n" % (test_name, index,
+                                               inputHash(test_input),
+                                               ','.join(test_methods)))
+        if len(self._lines) >= self.syncEntries:
+            self.sync()
+        elif not self._syncCall:
+            self._syncCall = self.clock.callLater(self.syncInterval, self.sync)
+
+    def sync(self):
+        if self._syncCall and self._syncCall.active():
+            self._syncCall.cancel()
+        self._syncCall = None
+        if not self._lines:
+            return
+        if self.beforeSync:
+            self.beforeSync()
+        if not self._stream:
+            self._stream = open(self.path, 'a')
+        self._stream.write(''.join(self._lines))
+        self._stream.flush()
+        os.fsync(self._stream.fileno())
+        self._lines = []
+
+    def close(self):
+        self.sync()
+        if self._stream:
+            self._stream.close()
+            self._stream = None
+
+def journalPath(report_path):
+    return report_path + '.journal'
+
+def findResumableReport(test_name, report_destination='.',
+                        extension='yamloo'):
+    """
+    Returns the filename of the most recent report of test_name with the
+    given extension in report_destination that has a journal, or None if
+    there is none.
+    """
+    pattern = os.path.join(report_destination,
+                           "report-%s-*.%s" % (test_name, extension))
+    reports = [path for path in glob.glob(pattern)
+               if os.path.exists(journalPath(path))]
+    if not reports:
+        return None
+    return os.path.basename(max(reports, key=os.path.getmtime))
@@ -1,8 +1,11 @@
-import itertools
+import random
+from collections import deque
 
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 from ooni.utils import log
 from ooni.settings import config
+from ooni.ratelimiting import rateLimiters, isTimeout
+from ooni.ratelimiting import DestinationRateLimiter, ThrottledTasks
 
 def makeIterable(item):
     """
@@ -15,19 +18,94 @@ def makeIterable(item):
         iterable = iter([item])
     return iterable
 
+class PendingTasks(object):
+    """
+    The tasks of one of the iterators scheduled on a :class:TaskManager.
+
+    The TaskManager serves its PendingTasks in deficit round-robin order: every
+    time a PendingTasks comes up in the round it is credited with weight tasks
+    and it runs tasks until its credit is used up. Weights need not be integers,
+    a weight of 0.5 for example means one task every other round.
+    """
+    __slots__ = ('iterator', 'weight', 'deficit')
+
+    def __init__(self, iterator, weight=1):
+        self.iterator = iterator
+        self.weight = weight
+        self.deficit = 0
+
+class RetryPolicy(object):
+    """
+    Decides how long a failed task should wait before being retried.
+
+    The n-th retry of a task waits base_delay * multiplier ** (n - 1)
+    seconds, up to max_delay. When jitter is set a random fraction (up to
+    jitter) of the delay is removed, so that tasks that have failed at the
+    same time (for example because the network went down) are not all
+    retried at the same time.
+    """
+    def __init__(self, base_delay=1, multiplier=2, max_delay=60, jitter=0.5):
+        self.baseDelay = base_delay
+        self.multiplier = multiplier
+        self.maxDelay = max_delay
+        self.jitter = jitter
+
+    def delay(self, task):
+        """
+        Returns the number of seconds to wait before retrying the task.
+        """
+        if not self.baseDelay:
+            return 0
+        exponent = max(task.failures - 1, 0)
+        delay = min(self.baseDelay * self.multiplier ** exponent,
+                    self.maxDelay)
+        return delay * (1 - self.jitter * random.random())
+
 class TaskManager(object):
     retries = 2
     concurrency = 10
+    # An instance of :class:ooni.ratelimiting.RateLimiter. When set it decides
+    # how many tasks should be running concurrently instead of concurrency.
+    rateLimiter = None
+    # An instance of :class:RetryPolicy. When not set failed tasks are retried
+    # immediately.
+    retryPolicy = None
+    # An instance of :class:ooni.ratelimiting.DestinationRateLimiter. When set
+    # tasks whose destinationKey has no tokens left are put aside and tasks
+    # for other destinations are run in their place.
+    destinationRateLimiter = None
+    # The maximum number of throttled tasks to put aside before we stop
+    # looking for runnable tasks in the pending ones.
+    maxThrottledTasks = 1000
+    # So that we can test the callLater calls
+    clock = reactor
+    # When True the parent of a LinkedTaskManager should not start new tasks,
+    # because they would produce work that this manager cannot keep up with.
+    backlogFull = False
 
     def __init__(self):
-        self._tasks = iter(())
-        self._active_tasks = []
+        # The PendingTasks that have been scheduled, consumed in deficit
+        # round-robin order.
+        self._pending = deque()
+        # The tasks that have failed and are waiting to be re-run. These take
+        # precedence over the pending ones.
+        self._retries = deque()
+        self._active_tasks = set()
+        # The tasks that are waiting for their retry delay to expire.
+        self._delayed_tasks = set()
+        self._fillingSlots = False
+        self._throttled = None
+        self._wakeUpCall = None
         self.failures = 0
 
     def _failed(self, failure, task):
         """
-        The has failed to complete, we append it to the end of the task chain
-        to be re-run once all the currently scheduled tasks have run.
+        The task has failed to complete, once the delay given by the retry
+        policy has passed we append it to the retry queue so that it is re-run
+        before the tasks that are still pending.
+
+        The done deferred of the task is not fired until it has either
+        succeeded or has failed for the last time.
         """
         log.err("Task %s has failed %s times" % (task, task.failures))
         log.exception(failure)
@@ -35,9 +113,23 @@ class TaskManager(object):
         self._active_tasks.remove(task)
         self.failures = self.failures + 1
 
+        if self.rateLimiter:
+            if isTimeout(failure):
+                self.rateLimiter.timedOut(task)
+            else:
+                self.rateLimiter.failed(task, failure)
+
         if task.failures <= self.retries:
-            log.debug("Rescheduling...")
-            self._tasks = itertools.chain(makeIterable(task), self._tasks)
+            delay = 0
+            if self.retryPolicy:
+                delay = self.retryPolicy.delay(task)
+            if delay > 0:
+                log.debug("Rescheduling in %.2f seconds..." % delay)
+                self._delayed_tasks.add(task)
+                self.clock.callLater(delay, self._retry, task)
+            else:
+                log.debug("Rescheduling...")
+                self._retries.append(task)
 
         else:
             # This fires the errback when the task is done but has failed.
@@ -48,24 +140,113 @@ class TaskManager(object):
 
         self.failed(failure, task)
 
+    def _retry(self, task):
+        """
+        Called once the retry delay of a failed task has expired.
+        """
+        self._delayed_tasks.discard(task)
+        self._retries.append(task)
+        self._fillSlots()
+
+    def _nextQueuedTask(self):
+        """
+        Returns the next retried or pending task, or None if there are none.
+        """
+        if self._retries:
+            return self._retries.popleft()
+
+        pending = self._pending
+        while pending:
+            head = pending[0]
+            if head.deficit < 1:
+                # The head has used up its credit for this round, move on to
+                # the next one.
+                pending.rotate(-1)
+                pending[0].deficit += pending[0].weight
+                continue
+            try:
+                task = head.iterator.next()
+            except StopIteration:
+                pending.popleft()
+                if pending:
+                    pending[0].deficit += pending[0].weight
+                continue
+            head.deficit -= 1
+            return task
+        return None
+
+    def _nextTask(self):
+        """
+        Returns the next task to be run or None if there are no more tasks
+        ready to be run.
+
+        When a destinationRateLimiter is set, tasks whose destination has been
+        throttled are put aside and run as soon as their destination has
+        tokens again. In the meantime we look for tasks for other destinations
+        among the queued ones.
+        """
+        if not self.destinationRateLimiter:
+            return self._nextQueuedTask()
+
+        if self._throttled is None:
+            self._throttled = ThrottledTasks(self.destinationRateLimiter)
+
+        task = self._throttled.pop()
+        if task is not None:
+            return task
+
+        while len(self._throttled) < self.maxThrottledTasks:
+            task = self._nextQueuedTask()
+            if task is None:
+                break
+            key = getattr(task, 'destinationKey', None)
+            if self.destinationRateLimiter.acquire(key):
+                return task
+            self._throttled.park(key, task)
+
+        self._scheduleWakeUp()
+        return None
+
+    def _scheduleWakeUp(self):
+        """
+        Makes sure we fill the slots again once one of the throttled
+        destinations has tokens available.
+        """
+        wait = self._throttled.wait()
+        if wait is None:
+            return
+        if self._wakeUpCall and self._wakeUpCall.active():
+            return
+        self._wakeUpCall = self.clock.callLater(wait, self._fillSlots)
+
     def _fillSlots(self):
         """
         Called on test completion and schedules measurements to be run for the
         available slots.
+
+        Tasks that complete synchronously will call this method again from
+        within _run. In that case we return immediately and let the outer
+        loop pick up the freed slot, so that the stack does not grow with the
+        number of tasks.
         """
-        for _ in range(self.availableSlots):
-            try:
-                task = self._tasks.next()
+        if self._fillingSlots:
+            return
+        self._fillingSlots = True
+        try:
+            while self.availableSlots > 0:
+                task = self._nextTask()
+                if task is None:
+                    break
                 self._run(task)
-            except StopIteration:
-                break
+        finally:
+            self._fillingSlots = False
 
     def _run(self, task):
         """
-        This gets called to add a task to the list of currently active and
+        This gets called to add a task to the set of currently active and
         running tasks.
         """
-        self._active_tasks.append(task)
+        self._active_tasks.add(task)
 
         d = task.start()
         d.addCallback(self._succeeded, task)
@@ -77,6 +258,9 @@ class TaskManager(object):
         """
         self._active_tasks.remove(task)
 
+        if self.rateLimiter:
+            self.rateLimiter.completed(task)
+
         self._fillSlots()
 
         # Fires the done deferred when the task has completed
@@ -87,23 +271,40 @@ class TaskManager(object):
     def failedMeasurements(self):
         return self.failures
 
+    @property
+    def currentConcurrency(self):
+        """
+        Returns the number of tasks that should be running at the same time.
+        """
+        if self.rateLimiter:
+            return self.rateLimiter.concurrency
+        return self.concurrency
+
     @property
     def availableSlots(self):
         """
         Returns the number of available slots for running tests.
         """
-        return self.concurrency - len(self._active_tasks)
+        return self.currentConcurrency - len(self._active_tasks)
 
-    def schedule(self, task_or_task_iterator):
+    def schedule(self, task_or_task_iterator, weight=1):
         """
         Takes as argument a single task or a task iterable and appends it to the task
         generator queue.
+
+        The tasks of the iterables that have been scheduled are interleaved,
+        with weight being the number of tasks of this iterable to run for every
+        task of an iterable of weight 1.
         """
         log.debug("Starting this task %s" % repr(task_or_task_iterator))
 
-        iterable = makeIterable(task_or_task_iterator)
-
-        self._tasks = itertools.chain(self._tasks, iterable)
+        if weight <= 0:
+            raise ValueError("The weight must be positive, not %s" % weight)
+        pending_tasks = PendingTasks(makeIterable(task_or_task_iterator),
+                                     weight)
+        if not self._pending:
+            pending_tasks.deficit = weight
+        self._pending.append(pending_tasks)
         self._fillSlots()
 
     def start(self):
@@ -137,8 +338,10 @@ class LinkedTaskManager(TaskManager):
 
     @property
     def availableSlots(self):
-        mySlots = self.concurrency - len(self._active_tasks)
+        mySlots = self.currentConcurrency - len(self._active_tasks)
         if self.child:
+            if self.child.backlogFull:
+                return 0
             s = self.child.availableSlots
             return min(s, mySlots)
         return mySlots
@@ -170,8 +373,34 @@ class MeasurementManager(LinkedTaskManager):
             self.retries = config.advanced.measurement_retries
         if config.advanced.measurement_concurrency:
             self.concurrency = config.advanced.measurement_concurrency
+        if config.advanced.measurement_retry_delay:
+            self.retryPolicy = RetryPolicy(
+                base_delay=config.advanced.measurement_retry_delay,
+                max_delay=config.advanced.measurement_retry_max_delay or 60)
+        if config.advanced.measurement_destination_rate:
+            self.destinationRateLimiter = DestinationRateLimiter(
+                rate=config.advanced.measurement_destination_rate,
+                burst=config.advanced.measurement_destination_burst or 1,
+                clock=self.clock)
+        rate_limiter = config.advanced.measurement_concurrency_control
+        if rate_limiter and rate_limiter != 'static':
+            self.rateLimiter = self.createRateLimiter(rate_limiter)
         super(MeasurementManager, self).__init__()
 
+    def createRateLimiter(self, name):
+        try:
+            rate_limiter = rateLimiters[name]
+        except KeyError:
+            log.err("Unknown measurement_concurrency_control %s. "
+                    "Using a static concurrency of %d" % (name, self.concurrency))
+            return None
+        kw = {'concurrency': self.concurrency}
+        if config.advanced.measurement_max_concurrency:
+            kw['max_concurrency'] = config.advanced.measurement_max_concurrency
+        if config.advanced.measurement_timeout:
+            kw['timeout'] = config.advanced.measurement_timeout
+        return rate_limiter(**kw)
+
     def succeeded(self, result, measurement):
         log.debug("Successfully performed measurement %s" % measurement)
         log.debug(result)
@@ -180,12 +409,78 @@ class MeasurementManager(LinkedTaskManager):
         pass
 
 class ReportEntryManager(LinkedTaskManager):
+    """
+    Writes the report entries to the reporters.
+
+    It also keeps track of the report entries that have been handed to it but
+    that have not yet been written to all the reporters (the backlog). While
+    the backlog exceeds maxBacklogEntries entries or maxBacklogBytes bytes the
+    parent MeasurementManager does not start new measurements, so that a slow
+    reporter cannot make finished reports pile up in memory.
+    """
+    maxBacklogEntries = None
+    maxBacklogBytes = None
+
     def __init__(self):
         if config.advanced.reporting_retries:
             self.retries = config.advanced.reporting_retries
         if config.advanced.reporting_concurrency:
             self.concurrency = config.advanced.reporting_concurrency
+        if config.advanced.reporting_retry_delay:
+            self.retryPolicy = RetryPolicy(
+                base_delay=config.advanced.reporting_retry_delay,
+                max_delay=config.advanced.reporting_retry_max_delay or 300)
+        if config.advanced.reporting_max_backlog_entries:
+            self.maxBacklogEntries = config.advanced.reporting_max_backlog_entries
+        if config.advanced.reporting_max_backlog_bytes:
+            self.maxBacklogBytes = config.advanced.reporting_max_backlog_bytes
         super(ReportEntryManager, self).__init__()
+        self.backlogEntries = 0
+        self.backlogBytes = 0
+        self._drainWaiters = []
+
+    @property
+    def backlogFull(self):
+        if self.maxBacklogEntries and \
+                self.backlogEntries >= self.maxBacklogEntries:
+            return True
+        if self.maxBacklogBytes and \
+                self.backlogBytes >= self.maxBacklogBytes:
+            return True
+        return False
+
+    def whenBacklogDrained(self):
+        """
+        Returns a deferred that fires once the backlog is not full.
+        """
+        if not self.backlogFull:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self._drainWaiters.append(d)
+        return d
+
+    def entryQueued(self, size):
+        """
+        Called when a report entry of size bytes is waiting to be written.
+        """
+        self.backlogEntries += 1
+        self.backlogBytes += size
+
+    def entryDone(self, size):
+        """
+        Called when a report entry of size bytes has been written to all the
+        reporters (or has permanently failed to be written).
+        """
+        was_full = self.backlogFull
+        self.backlogEntries -= 1
+        self.backlogBytes -= size
+        if was_full and not self.backlogFull:
+            waiters, self._drainWaiters = self._drainWaiters, []
+            for d in waiters:
+                d.callback(None)
+            if self.parent:
+                log.debug("Report backlog drained, resuming measurements")
+                self.parent._fillSlots()
 
     def succeeded(self, result, task):
         log.debug("Successfully performed report %s" % task)
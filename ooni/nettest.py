@@ -1,7 +1,7 @@
 import os
 import re
 import time
-from hashlib import sha256
+import itertools
 
 from twisted.internet import defer, reactor
 from twisted.trial.runner import filenameToModule
@@ -9,7 +9,10 @@ from twisted.python import usage, reflect
 
 from ooni import geoip
 from ooni.tasks import Measurement
-from ooni.utils import log, checkForRoot
+from ooni.ratelimiting import keyExtractors
+from ooni.utils.dedup import InputDeduplicator, inputNormalizers
+from ooni.utils.hashcache import fileHash, getHashCache
+from ooni.utils import log, checkForRoot, dnscache
 from ooni import otime
 from ooni.settings import config
 
@@ -170,14 +173,42 @@ def getNetTestInformation(net_test_file):
     }
     return information
 
+class TestDetails(dict):
+    """
+    The details of a test, as they are written at the beginning of its
+    reports. They can not be modified once they have been computed.
+    """
+    def _readOnly(self, *args, **kw):
+        raise TypeError("The test details can not be modified")
+
+    __setitem__ = __delitem__ = _readOnly
+    clear = pop = popitem = setdefault = update = _readOnly
+
+    def __reduce__(self):
+        # Copies are made from a dict, not by setting the items one by one
+        return (TestDetails, (dict(self),))
+
 class NetTestLoader(object):
     method_prefix = 'test'
     collector = None
+    # A tuple of (index, count) that, when set, restricts the inputs of the
+    # NetTest to the ones whose position modulo count is equal to index.
+    shard = None
+    # The share of the measurement slots this NetTest gets when it runs
+    # alongside other NetTests, relative to a NetTest of weight 1.
+    weight = 1
+    # The format of the report ('yaml' or 'json') when it is set by the deck
+    reportFormat = None
+    # An instance of :class:ooni.journal.Journal recording the report entries
+    # that have been written, and the ones to skip when resuming a run.
+    journal = None
 
     def __init__(self, options, test_file=None, test_string=None):
         self.onionInputRegex =  re.compile("(httpo://[a-z0-9]{16}\.onion)/input/([a-z0-9]{64})$")
         self.options = options
+        self.testFile = test_file
         self.testCases, test_cases = None, None
+        self._testDetails = None
 
         if test_file:
             test_cases = loadNetTestFile(test_file)
@@ -225,17 +256,58 @@ class NetTestLoader(object):
                     input_file['hash'] = m.group(2)
                 else:
                     input_file['filename'] = filename
-                    with open(filename) as f:
-                        h = sha256()
-                        for l in f:
-                            h.update(l)
-                    input_file['hash'] = h.hexdigest()
+                    input_file['hash'] = fileHash(filename)
                 input_files.append(input_file)
 
         return input_files
 
+    def hashInputFiles(self):
+        """
+        Hashes the local input files that are not in the hash cache in
+        threads, so that reading inputFiles does not block.
+        """
+        filenames = []
+        for test_class, test_methods in self.testCases or []:
+            if test_class.inputFile:
+                filename = test_class.localOptions[test_class.inputFile[0]]
+                if filename and not self.onionInputRegex.match(filename):
+                    filenames.append(filename)
+        return getHashCache().hashInThreads(filenames)
+
+    def setupTestDetails(self, test_details=None):
+        """
+        Computes the details of the test and freezes them for the rest of the
+        run, so that the geoip lookup and the hashing of the inputs are done
+        once and all the reporters get the same start_time.
+
+        This must be called once the options and the inputs of the test have
+        been set up (by checkOptions and the deck), since the details include
+        the hashes of the input files.
+
+        Args:
+            test_details (dict): the details to use instead of computing
+                them, like the ones a worker process gets from its parent.
+
+        Returns:
+            the :class:TestDetails of the test
+        """
+        if self._testDetails is None:
+            if test_details is None:
+                test_details = self.getTestDetails()
+            self._testDetails = TestDetails(test_details)
+        return self._testDetails
+
     @property
     def testDetails(self):
+        """
+        The details of the test. Before setupTestDetails has been called they
+        are computed again every time they are accessed.
+        """
+        if self._testDetails is None:
+            return TestDetails(self.getTestDetails())
+        return self._testDetails
+
+    def getTestDetails(self):
         from ooni import __version__ as software_version
 
         client_geodata = {}
@@ -491,6 +563,13 @@ class NetTest(object):
         """
         self.report = report
         self.testCases = net_test_loader.testCases
+        self.shard = net_test_loader.shard
+        self.journal = net_test_loader.journal
+        # The deduplicators of the inputs of the test classes, when the
+        # input_dedup option is enabled
+        self.deduplicators = []
+        # The test details are frozen once the NetTest starts
+        self.testDetails = net_test_loader.setupTestDetails()
 
         # This will fire when all the measurements have been completed and
         # all the reports are done. Done means that they have either completed
@@ -514,6 +593,14 @@ class NetTest(object):
 
         return report_results
 
+    def journaled(self, result, test_name, index, test_input, test_methods):
+        """
+        Records in the journal that the report entry for the input at index
+        has been written.
+        """
+        self.journal.record(test_name, index, test_input, test_methods)
+        return result
+
     def makeMeasurement(self, test_class, test_method, test_input=None):
         """
         Creates a new instance of :class:ooni.tasks.Measurement and add's it's
@@ -531,7 +618,8 @@ class NetTest(object):
                 NetTestCase
 
         """
-        measurement = Measurement(test_class, test_method, test_input)
+        measurement = Measurement(test_class, test_method, test_input,
+                                  self.getKeyExtractor(test_class))
         measurement.netTest = self
 
         if self.director:
@@ -541,12 +629,82 @@ class NetTest(object):
                     measurement)
         return measurement
 
+    def getKeyExtractor(self, test_class):
+        """
+        Returns the function used to obtain the destination key of the
+        measurements of test_class. This can be overridden for all the tests
+        via the measurement_destination_key configuration option.
+        """
+        key = config.advanced.measurement_destination_key or \
+            test_class.rateLimitKey
+        if not key:
+            return None
+        try:
+            return keyExtractors[key]
+        except KeyError:
+            log.err("Unknown destination key %s" % key)
+            return None
+
+    def getInputDeduplicator(self, test_class):
+        try:
+            normalize = inputNormalizers[test_class.inputDedupKey]
+        except KeyError:
+            log.err("Unknown input dedup key %s" % test_class.inputDedupKey)
+            normalize = None
+        return InputDeduplicator(normalize,
+            expected_inputs=config.advanced.input_dedup_expected or 1000000,
+            error_rate=config.advanced.input_dedup_error_rate or 0.0001)
+
+    def deduplicateInputs(self, test_class):
+        """
+        Filters the duplicate inputs out of the inputs of test_class, as they
+        are generated. The duplicates are counted by the deduplicator, see
+        :attr:duplicateInputs.
+        """
+        deduplicator = self.getInputDeduplicator(test_class)
+        self.deduplicators.append(deduplicator)
+        test_class.inputs = deduplicator.filter(test_class.inputs)
+
+    @property
+    def duplicateInputs(self):
+        """
+        The number of duplicate inputs that have been skipped so far.
+        """
+        return sum(deduplicator.duplicates
+                   for deduplicator in self.deduplicators)
+
+    def writeTestSummary(self):
+        """
+        Writes the details of the test that are only known once all the
+        inputs have been processed (the number of duplicate inputs) in a
+        test_summary document at the end of the report.
+        """
+        if not self.deduplicators or not self.report:
+            return defer.succeed(None)
+        # Every shard deduplicates the whole input stream, so the first one
+        # reports the duplicates of all of them
+        if self.shard and self.shard[0] != 0:
+            return defer.succeed(None)
+        log.msg("Skipped %d duplicate inputs" % self.duplicateInputs)
+        d = self.report.write({'test_summary': {
+            'duplicate_inputs': self.duplicateInputs}})
+        d.addErrback(log.exception)
+        return d
+
     @defer.inlineCallbacks
     def initializeInputProcessor(self):
         for test_class, _ in self.testCases:
+            yield defer.maybeDeferred(test_class._setUpClass)
+            yield defer.maybeDeferred(test_class.setUpClass)
             test_class.inputs = yield defer.maybeDeferred(test_class().getInputProcessor)
             if not test_class.inputs:
                 test_class.inputs = [None]
+            elif config.advanced.input_dedup:
+                self.deduplicateInputs(test_class)
+            if self.shard:
+                index, count = self.shard
+                test_class.inputs = itertools.islice(test_class.inputs,
+                                                     index, None, count)
 
     def generateMeasurements(self):
         """
@@ -555,8 +713,12 @@ class NetTest(object):
         """
 
         for test_class, test_methods in self.testCases:
+            test_name = test_class.__name__
             # load the input processor as late as possible
-            for input in test_class.inputs:
+            for index, input in enumerate(test_class.inputs):
+                if self.journal and \
+                        self.journal.isDone(test_name, index, input):
+                    continue
                 klass = test_class()
                 measurements = []
                 for method in test_methods:
@@ -579,6 +741,9 @@ class NetTest(object):
                         return report
                     post.addErrback(noPostProcessor, klass.report)
                     post.addCallback(self.report.write)
+                    if self.journal:
+                        post.addCallback(self.journaled, test_name, index,
+                                         input, test_methods)
 
                 if self.report and self.director:
                     #ghetto hax to keep NetTestState counts are accurate
@@ -628,10 +793,27 @@ class NetTestCase(object):
 
     * requiresRoot: set to True if the test must be run as root.
 
+    * rateLimitKey: the name of the function in
+      :data:ooni.ratelimiting.keyExtractors ('host', 'resolver', 'subnet' or
+      'asn') used to group the measurements by destination when per
+      destination rate limiting is enabled.
+
+    * inputDedupKey: the name of the function in
+      :data:ooni.utils.dedup.inputNormalizers ('exact', 'url' or 'host') used
+      to decide which inputs are duplicates of each other when input
+      de-duplication is enabled. Defaults to 'exact'.
+
+    * bypassDNSCache: set to True if the hostnames looked up by the test
+      with getHostByName must not be resolved by the caching resolver (see
+      the dns_cache option), like in the tests that measure DNS.
+
     * usageOptions: a subclass of twisted.python.usage.Options for processing of command line arguments
 
     * localOptions: contains the parsed command line arguments.
 
+    * setUpClass: a classmethod run once per NetTest, for the setup that does
+      not depend on the input. setUp is run once per input.
+
     Quirks:
     Every class that is prefixed with test *must* return a twisted.internet.defer.Deferred.
     """
@@ -656,8 +838,31 @@ class NetTestCase(object):
     requiredTestHelpers = {}
     requiredOptions = []
     requiresRoot = False
+    rateLimitKey = None
+    inputDedupKey = 'exact'
+    bypassDNSCache = False
 
     localOptions = {}
+
+    @classmethod
+    def _setUpClass(cls):
+        """
+        This is the internal class setup method to be overwritten by templates.
+        """
+        pass
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Place here the setup logic that does not depend on the input. It is
+        run once per NetTest, before any measurement is created, and may
+        return a deferred.
+
+        Store what it computes as attributes of cls: they are then shared
+        by the instances of every input, which must not modify them.
+        """
+        pass
+
     def _setUp(self):
         """
         This is the internal setup method to be overwritten by templates.
@@ -670,6 +875,13 @@ class NetTestCase(object):
         """
         pass
 
+    def getHostByName(self, name):
+        """
+        Resolves name with the system resolver. The caching resolver is
+        skipped if bypassDNSCache is set.
+        """
+        return dnscache.getResolver(self.bypassDNSCache).getHostByName(name)
+
     def postProcessor(self, measurements):
         """
         Subclass this to do post processing tasks that are to occur once all
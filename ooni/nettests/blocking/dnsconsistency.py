@@ -22,7 +22,7 @@ from twisted.internet import defer
 
 from ooni.templates import dnst
 
-from ooni import nettest
+from ooni import nettest, geoip
 from ooni.utils import log
 
 class UsageOptions(usage.Options):
@@ -38,7 +38,7 @@ class DNSConsistencyTest(dnst.DNSTest):
 
     name = "DNS Consistency"
     description = "DNS censorship detection test"
-    version = "0.6"
+    version = "0.7"
     authors = "Arturo Filastò, Isis Lovecruft"
     requirements = None
 
@@ -49,23 +49,27 @@ class DNSConsistencyTest(dnst.DNSTest):
 
     usageOptions = UsageOptions
     requiredOptions = ['backend', 'file']
-
-    def setUp(self):
-        if (not self.localOptions['testresolvers'] and \
-                not self.localOptions['testresolver']):
+    rateLimitKey = 'resolver'
+    inputDedupKey = 'host'
+    test_resolvers_from_file = False
+
+    @classmethod
+    def setUpClass(cls):
+        if (not cls.localOptions['testresolvers'] and \
+                not cls.localOptions['testresolver']):
             raise usage.UsageError("You did not specify a testresolver")
 
-        elif self.localOptions['testresolvers']:
-            test_resolvers_file = self.localOptions['testresolvers']
+        elif cls.localOptions['testresolvers']:
+            test_resolvers_file = cls.localOptions['testresolvers']
 
-        elif self.localOptions['testresolver']:
-            self.test_resolvers = [self.localOptions['testresolver']]
+        elif cls.localOptions['testresolver']:
+            cls.test_resolvers = [cls.localOptions['testresolver']]
+            cls.test_resolvers_from_file = False
 
         try:
             with open(test_resolvers_file) as f:
-                self.test_resolvers = [x.split('#')[0].strip() for x in f.readlines()]
-                self.report['test_resolvers'] = self.test_resolvers
-            f.close()
+                cls.test_resolvers = [x.split('#')[0].strip() for x in f.readlines()]
+                cls.test_resolvers_from_file = True
 
         except IOError, e:
             log.exception(e)
@@ -74,9 +78,12 @@ class DNSConsistencyTest(dnst.DNSTest):
         except NameError:
             log.debug("No test resolver file configured")
 
-        dns_ip, dns_port = self.localOptions['backend'].split(':')
-        self.control_dns_server = (str(dns_ip), int(dns_port))
+        dns_ip, dns_port = cls.localOptions['backend'].split(':')
+        cls.control_dns_server = (str(dns_ip), int(dns_port))
 
+    def setUp(self):
+        if self.test_resolvers_from_file:
+            self.report['test_resolvers'] = self.test_resolvers
         self.report['control_resolver'] = "%s:%d" % self.control_dns_server
 
     @defer.inlineCallbacks
@@ -161,6 +168,19 @@ class DNSConsistencyTest(dnst.DNSTest):
                     log.msg("tampering: true")
                     self.report['tampering'][test_resolver] = True
 
+    def postProcessor(self, measurements):
+        """
+        Adds the ASN and country code of every address in the answers.
+        """
+        queries = [query for query in self.report['queries']
+                   if query.get('addrs')]
+        for query in queries:
+            query['addrs_geoip'] = [{'address': addr}
+                                    for addr in query['addrs']]
+        geoip.annotateAddresses([entry for query in queries
+                                 for entry in query['addrs_geoip']])
+        return self.report
+
     def inputProcessor(self, filename=None):
         """
         This inputProcessor extracts domain names from urls
@@ -4,11 +4,14 @@
 # :licence: see LICENSE
 
 import random
+from hashlib import sha256
 from twisted.internet import defer
 from twisted.python import usage, failure
 
 from ooni.utils import log
-from ooni.utils.net import userAgents
+from ooni.utils.net import userAgents, simhashDistance
+from ooni.utils.trueheaders import TrueHeaders
+from ooni.utils.controlcache import getControlCache, controlKey
 from ooni.templates import httpt
 from ooni.errors import failureToString, handleAllFailures
 
@@ -26,13 +29,26 @@ class HTTPRequestsTest(httpt.HTTPTest):
 
     We check to see if the response headers match and if the response body
     lengths match.
+
+    Only the headers and the length and digests of the bodies of the two
+    responses are kept for comparing them, as they are computed while the
+    bodies are received. At most maxBodySize bytes of every body are kept
+    in the report, so the memory used for every input does not depend on
+    the size of the pages.
+
+    When the control_cache option is enabled these control results are
+    cached across runs, and the control request is only performed when
+    there is no recent enough result for the URL in the cache.
     """
     name = "HTTP Requests Test"
     author = "Arturo Filastò"
-    version = "0.2.3"
+    version = "0.2.6"
 
     usageOptions = UsageOptions
 
+    reportBodyDigests = True
+    maxBodySize = 1024 * 1024
+
     inputFile = ['file', 'f', None,
             'List of URLS to perform GET and POST requests to']
 
@@ -41,6 +57,12 @@ class HTTPRequestsTest(httpt.HTTPTest):
     control_body_length = None
     experiment_body_length = None
 
+    controlCache = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.controlCache = getControlCache()
+
     def setUp(self):
         """
         Check for inputs.
@@ -55,7 +77,15 @@ class HTTPRequestsTest(httpt.HTTPTest):
         self.factor = self.localOptions['factor']
         self.report['control_failure'] = None
         self.report['experiment_failure'] = None
-        self.headers = {'User-Agent': [random.choice(userAgents)]}
+        if self.controlCache:
+            # Always use the same user agent for a URL, so that its control
+            # result can be found in the cache.
+            index = ord(sha256(self.url).digest()[0]) % len(userAgents)
+            user_agent = userAgents[index]
+        else:
+            user_agent = random.choice(userAgents)
+        self.headers = {'User-Agent': [user_agent]}
+        self.report['control_cached'] = False
 
     def compare_body_lengths(self, body_length_a, body_length_b):
 
@@ -80,6 +110,12 @@ class HTTPRequestsTest(httpt.HTTPTest):
             log.msg("censorship could be happening")
             self.report['body_length_match'] = False
 
+    def compare_bodies(self, digests_a, digests_b):
+        self.report['body_sha256_match'] = \
+            digests_a['sha256'] == digests_b['sha256']
+        self.report['body_simhash_distance'] = \
+            simhashDistance(digests_a['simhash'], digests_b['simhash'])
+
     def compare_headers(self, headers_a, headers_b):
         diff = headers_a.getDiff(headers_b)
         if diff:
@@ -91,15 +127,63 @@ class HTTPRequestsTest(httpt.HTTPTest):
             self.report['headers_diff'] = diff
             self.report['headers_match'] = True
 
+    def summarizeResponse(self, response):
+        """
+        Returns what we need of response for comparing it, so that the
+        response and its body are not kept until the other request is done.
+        """
+        if not response:
+            return None
+        return {'code': response.code,
+                'headers': response.headers,
+                'body_digests': response.bodyDigests}
+
+    def cacheControl(self, summary):
+        if summary:
+            self.controlCache.set(controlKey(self.url, self.headers), {
+                'code': summary['code'],
+                'headers': list(summary['headers'].getAllRawHeaders()),
+                'body_digests': summary['body_digests']
+            })
+        return summary
+
+    def getCachedControl(self):
+        """
+        Returns the cached control result for self.url, or None if there is
+        none.
+        """
+        cached = self.controlCache.get(controlKey(self.url, self.headers))
+        if not cached:
+            return None
+        control, age = cached
+        log.msg("Using the control result for %s cached %d seconds ago" %
+                (self.url, age))
+        self.report['control_cached'] = True
+        self.report['control_age'] = age
+        return {'code': control['code'],
+                'headers': TrueHeaders(dict(control['headers'])),
+                'body_digests': control['body_digests']}
+
     def test_get_experiment(self):
         log.msg("Performing GET request to %s" % self.url)
-        return  self.doRequest(self.url, method="GET",
+        d = self.doRequest(self.url, method="GET",
                 use_tor=False, headers=self.headers)
+        d.addCallback(self.summarizeResponse)
+        return d
 
     def test_get_control(self):
+        if self.controlCache:
+            control = self.getCachedControl()
+            if control:
+                return defer.succeed(control)
+
         log.msg("Performing GET request to %s over Tor" % self.url)
-        return self.doRequest(self.url, method="GET",
+        d = self.doRequest(self.url, method="GET",
                 use_tor=True, headers=self.headers)
+        d.addCallback(self.summarizeResponse)
+        if self.controlCache:
+            d.addCallback(self.cacheControl)
+        return d
 
     def postProcessor(self, measurements):
         experiment = control = None
@@ -116,8 +200,10 @@ class HTTPRequestsTest(httpt.HTTPTest):
                     control = measurement.result
 
         if experiment and control:
-            self.compare_body_lengths(len(control.body),
-                    len(experiment.body))
-            self.compare_headers(control.headers,
-                    experiment.headers)
+            self.compare_body_lengths(control['body_digests']['length'],
+                    experiment['body_digests']['length'])
+            self.compare_bodies(control['body_digests'],
+                    experiment['body_digests'])
+            self.compare_headers(control['headers'],
+                    experiment['headers'])
         return self.report
@@ -21,6 +21,7 @@ class TCPConnectTest(nettest.NetTestCase):
             'File containing the IP:PORT combinations to be tested, one per line']
 
     requiredOptions = ['file']
+    rateLimitKey = 'host'
     def test_connect(self):
         """
         This test performs a TCP connection to the remote host on the specified port.
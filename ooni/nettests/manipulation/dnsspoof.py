@@ -32,14 +32,15 @@ class DNSSpoof(scapyt.ScapyTest):
     requiredTestHelpers = {'backend': 'dns'}
     requiredOptions = ['hostname', 'resolver']
 
-    def setUp(self):
-        self.resolverAddr, self.resolverPort = self.localOptions['resolver'].split(':')
-        self.resolverPort = int(self.resolverPort)
+    @classmethod
+    def setUpClass(cls):
+        cls.resolverAddr, cls.resolverPort = cls.localOptions['resolver'].split(':')
+        cls.resolverPort = int(cls.resolverPort)
 
-        self.controlResolverAddr, self.controlResolverPort = self.localOptions['backend'].split(':')
-        self.controlResolverPort = int(self.controlResolverPort)
+        cls.controlResolverAddr, cls.controlResolverPort = cls.localOptions['backend'].split(':')
+        cls.controlResolverPort = int(cls.controlResolverPort)
 
-        self.hostname = self.localOptions['hostname']
+        cls.hostname = cls.localOptions['hostname']
 
     def postProcessor(self, report):
         """
@@ -28,9 +28,10 @@ class HTTPInvalidRequestLine(tcpt.TCPTest):
     requiredTestHelpers = {'backend': 'tcp-echo'}
     requiredOptions = ['backend']
 
-    def setUp(self):
-        self.port = int(self.localOptions['backendport'])
-        self.address = self.localOptions['backend']
+    @classmethod
+    def setUpClass(cls):
+        cls.port = int(cls.localOptions['backendport'])
+        cls.address = cls.localOptions['backend']
 
     def check_for_manipulation(self, response, payload):
         log.debug("Checking if %s == %s" % (response, payload))
@@ -10,6 +10,7 @@ from ooni.templates import scapyt
 
 from scapy.all import *
 
+from ooni import geoip
 from ooni.utils import log
 
 class UsageOptions(usage.Options):
@@ -23,7 +24,7 @@ class UsageOptions(usage.Options):
 class TracerouteTest(scapyt.BaseScapyTest):
     name = "Multi Protocol Traceroute Test"
     author = "Arturo Filastò"
-    version = "0.2"
+    version = "0.3"
 
     requiredTestHelpers = {'backend': 'traceroute'}
     usageOptions = UsageOptions
@@ -65,6 +66,8 @@ class TracerouteTest(scapyt.BaseScapyTest):
                 }
                 log.debug("%s: %s" % (port, report))
                 self.report['test_tcp_traceroute']['hops_'+str(port)].append(report)
+            geoip.annotateAddresses(
+                self.report['test_tcp_traceroute']['hops_'+str(port)])
 
         dl = []
         max_ttl, timeout = self.max_ttl_and_timeout()
@@ -95,6 +98,8 @@ class TracerouteTest(scapyt.BaseScapyTest):
                 }
                 log.debug("%s: %s" % (port, report))
                 self.report['test_udp_traceroute']['hops_'+str(port)].append(report)
+            geoip.annotateAddresses(
+                self.report['test_udp_traceroute']['hops_'+str(port)])
         dl = []
         max_ttl, timeout = self.max_ttl_and_timeout()
         for port in self.dst_ports:
@@ -123,6 +128,7 @@ class TracerouteTest(scapyt.BaseScapyTest):
                 }
                 log.debug("%s" % (report))
                 self.report['test_icmp_traceroute']['hops'].append(report)
+            geoip.annotateAddresses(self.report['test_icmp_traceroute']['hops'])
         dl = []
         max_ttl, timeout = self.max_ttl_and_timeout()
         packets = IP(dst=self.localOptions['backend'],
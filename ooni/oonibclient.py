@@ -103,7 +103,7 @@ class OONIBClient(object):
                     log.err("Got this backend error message %s" % response)
                     raise e.get_error(response['error'])
                 return response
-            return BodyReceiver(finished, content_length, process_response)
+            return BodyReceiver(finished, body_processor=process_response)
 
         return self._request(method, urn, genReceiver, bodyProducer)
 
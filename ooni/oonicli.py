@@ -15,8 +15,10 @@ from ooni import errors
 from ooni.settings import config
 from ooni.director import Director
 from ooni.deck import Deck, nettest_to_path
-from ooni.reporter import YAMLReporter, OONIBReporter
+from ooni.reporter import YAMLReporter, JSONLReporter, OONIBReporter
+from ooni.reporter import reportFormats
 from ooni.nettest import NetTestLoader
+from ooni.journal import Journal, journalPath, findResumableReport
 
 from ooni.utils import log, checkForRoot
 
@@ -29,7 +31,7 @@ class Options(usage.Options):
                 " files listed on the command line")
 
     optFlags = [["help", "h"],
-                ["resume", "r"],
+                ["resume", "r", "Resume the last interrupted run of the test"],
                 ["no-collector", "n"],
                 ["list", "s"],
                 ]
@@ -43,7 +45,12 @@ class Options(usage.Options):
                          "Address of the bouncer for test helpers. default: httpo://nkvphnp3p6agi5qq.onion"],
                      ["logfile", "l", None, "log file name"],
                      ["pcapfile", "O", None, "pcap file name"],
-                     ["parallelism", "p", "10", "input parallelism"],
+                     ["parallelism", "p", None,
+                         "input parallelism. default: measurement_concurrency from ooniprobe.conf"],
+                     ["reportformat", "F", None,
+                         "Format of the report: yaml or json (JSON Lines). default: report_format from ooniprobe.conf or yaml"],
+                     ["workers", "w", None,
+                         "Number of worker processes to split the inputs of every test between"],
                      ["configfile", "f", None,
                          "Specify a path to the ooniprobe configuration file"],
                      ["datadir", "d", None,
@@ -112,6 +119,28 @@ def runWithDirector():
     config.set_paths()
     config.read_config_file()
 
+    if global_options['parallelism']:
+        try:
+            parallelism = int(global_options['parallelism'])
+        except ValueError:
+            log.err("Invalid parallelism %s" % global_options['parallelism'])
+            sys.exit(2)
+        config.advanced.measurement_concurrency = parallelism
+
+    workers = 1
+    if global_options['workers']:
+        try:
+            workers = int(global_options['workers'])
+            assert workers > 0
+        except (ValueError, AssertionError):
+            log.err("Invalid number of workers %s" % global_options['workers'])
+            sys.exit(2)
+
+    if global_options['reportformat'] and \
+            global_options['reportformat'] not in reportFormats:
+        log.err("Invalid report format %s" % global_options['reportformat'])
+        sys.exit(2)
+
     log.start(global_options['logfile'])
     
     if config.privacy.includepcap:
@@ -234,20 +263,67 @@ def runWithDirector():
                     and (not (config.tor_state or config.tor.socks_port)):
                 raise errors.TorNotRunning
 
-            test_details = net_test_loader.testDetails
-            yaml_reporter = YAMLReporter(test_details)
-            reporters = [yaml_reporter]
+            test_details = net_test_loader.setupTestDetails()
+            sharded = workers > 1 and net_test_loader.testFile
+            resume = global_options['resume']
+            if resume and sharded:
+                log.err("Resuming is not supported with --workers, "
+                        "starting a new report")
+                resume = False
+
+            report_format = global_options['reportformat'] or \
+                net_test_loader.reportFormat or \
+                config.advanced.report_format or 'yaml'
+            if report_format not in reportFormats:
+                log.err("Invalid report format %s, reporting in YAML" %
+                        report_format)
+                report_format = 'yaml'
+            if report_format == 'json' and sharded:
+                log.err("JSON Lines reports are not supported with "
+                        "--workers, reporting in YAML")
+                report_format = 'yaml'
+            if report_format == 'json':
+                reporter_class = JSONLReporter
+            else:
+                reporter_class = YAMLReporter
+
+            report_filename = None
+            if len(deck.netTestLoaders) == 1:
+                report_filename = global_options['reportfile']
+            if resume and not report_filename:
+                report_filename = findResumableReport(test_details['test_name'],
+                    extension=reporter_class.reportExtension)
+                if not report_filename:
+                    log.msg("No report of %s to resume, starting a new one" %
+                            test_details['test_name'])
+            file_reporter = reporter_class(test_details,
+                                           report_filename=report_filename,
+                                           resume=resume)
+            reporters = [file_reporter]
+
+            if not sharded:
+                net_test_loader.journal = Journal(
+                    journalPath(file_reporter.report_path),
+                    before_sync=file_reporter.sync)
+                if file_reporter.resume:
+                    net_test_loader.journal.load()
 
             if collector:
                 log.msg("Reporting using collector: %s" % collector)
                 try:
-                    oonib_reporter = OONIBReporter(test_details, collector)
+                    oonib_reporter = OONIBReporter(test_details, collector,
+                                                   report_format)
                     reporters.append(oonib_reporter)
                 except errors.InvalidOONIBCollectorAddress, e:
                     raise e
 
-            log.debug("adding callback for startNetTest")
-            director.startNetTest(net_test_loader, reporters)
+            if sharded:
+                log.debug("adding callback for startShardedNetTest")
+                director.startShardedNetTest(net_test_loader, reporters,
+                                             workers)
+            else:
+                log.debug("adding callback for startNetTest")
+                director.startNetTest(net_test_loader, reporters)
 
         director.allTestsDone.addBoth(shutdown)
 
@@ -1,3 +1,11 @@
+import re
+from collections import deque, OrderedDict
+
+from twisted.internet import defer, reactor
+
+from ooni.tasks import TaskTimedOut
+from ooni.utils import log
+
 class RateLimiter(object):
     """
     The abstract class that imposes limits over how measurements are scheduled,
@@ -32,7 +40,7 @@ class RateLimiter(object):
     def completed(self, measurement):
         raise NotImplemented
 
-    def failed(self, measurement):
+    def failed(self, measurement, failure):
         raise NotImplemented
 
 class StaticRateLimiter(RateLimiter):
@@ -60,9 +68,378 @@ class StaticRateLimiter(RateLimiter):
     def failed(self, measurement, failure):
         pass
 
+def isTimeout(failure):
+    """
+    Returns True if the failure is the result of a task that has timed out.
+
+    A timed out task has its running deferred cancelled, so the failure that
+    reaches the TaskManager is a CancelledError and not a TaskTimedOut.
+    """
+    return bool(failure.check(TaskTimedOut, defer.CancelledError))
+
 class TimeoutRateLimiter(RateLimiter):
-    pass
+    """
+    An additive increase, multiplicative decrease (AIMD) controller for the
+    number of concurrent measurements.
+
+    While the measurements in the sliding window complete in less than
+    latency_factor * timeout and the failure ratio stays below
+    max_failure_ratio the concurrency grows by increase for every
+    `concurrency` completed measurements.
+    Once max_timeouts measurements of the window have timed out (or the
+    failure ratio is exceeded) the concurrency is multiplied by
+    decrease_factor. After a decrease we wait for the measurements that were
+    in flight to drain before decreasing again, so that a single burst of
+    timeouts does not collapse the concurrency down to min_concurrency.
+    """
+    def __init__(self, concurrency=10, min_concurrency=1,
+                 max_concurrency=100, timeout=30, max_timeout=5*60,
+                 increase=1.0, decrease_factor=0.5, window=20,
+                 max_timeouts=2, max_failure_ratio=0.3, latency_factor=0.5):
+        self.minConcurrency = min_concurrency
+        self.maxConcurrency = max(max_concurrency, min_concurrency)
+        self._concurrency = float(self._bound(concurrency))
+        self._timeout = timeout
+        self._maxTimeout = max_timeout
+
+        self.increase = increase
+        self.decreaseFactor = decrease_factor
+        self.maxTimeouts = max_timeouts
+        self.maxFailureRatio = max_failure_ratio
+        self.latencyFactor = latency_factor
+
+        # Contains tuples of (outcome, runtime) where outcome is one of
+        # 'completed', 'failed' or 'timedout'
+        self.window = deque(maxlen=window)
+        self._sinceDecrease = 0
+
+    def _bound(self, value):
+        return max(self.minConcurrency, min(self.maxConcurrency, value))
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @property
+    def maxTimeout(self):
+        return self._maxTimeout
+
+    @property
+    def concurrency(self):
+        return int(self._concurrency)
+
+    def _record(self, outcome, measurement):
+        self.window.append((outcome, getattr(measurement, 'runtime', 0)))
+        self._sinceDecrease += 1
+
+    def _count(self, outcome):
+        return len([o for o, _ in self.window if o == outcome])
+
+    @property
+    def failureRatio(self):
+        if not self.window:
+            return 0
+        return float(len(self.window) - self._count('completed')) / \
+            len(self.window)
+
+    @property
+    def averageLatency(self):
+        runtimes = [r for o, r in self.window if o == 'completed']
+        if not runtimes:
+            return 0
+        return sum(runtimes) / len(runtimes)
+
+    def healthy(self):
+        """
+        Returns True if the measurements of the current window allow us to
+        grow the concurrency.
+        """
+        if self._count('timedout') > 0:
+            return False
+        if self.failureRatio > self.maxFailureRatio:
+            return False
+        return self.averageLatency < self.latencyFactor * self.timeout
+
+    def grow(self):
+        self._concurrency = self._bound(self._concurrency +
+                                        self.increase / self._concurrency)
+
+    def shrink(self):
+        """
+        Multiplicatively decreases the concurrency, at most once every time
+        the measurements that were in flight at the last decrease have
+        completed.
+        """
+        if self._sinceDecrease < self.concurrency:
+            return
+        self._concurrency = self._bound(self._concurrency *
+                                        self.decreaseFactor)
+        self._sinceDecrease = 0
+        self.window.clear()
+
+    def completed(self, measurement):
+        self._record('completed', measurement)
+        if self.healthy():
+            self.grow()
+
+    def failed(self, measurement, failure):
+        self._record('failed', measurement)
+        if self.failureRatio > self.maxFailureRatio and \
+                len(self.window) == self.window.maxlen:
+            self.shrink()
+
+    def timedOut(self, measurement):
+        self._record('timedout', measurement)
+        if self._count('timedout') >= self.maxTimeouts:
+            self.shrink()
+
+class BandwidthRateLimiter(TimeoutRateLimiter):
+    """
+    A variant of the TimeoutRateLimiter that also treats latency inflation as
+    a sign of congestion.
+
+    We keep track of the lowest average latency seen so far (the baseline)
+    and stop growing the concurrency once the average latency of the window
+    exceeds latency_inflation times the baseline. If it keeps growing past
+    twice that value the uplink is saturated and we back off before the
+    measurements start timing out.
+    """
+    def __init__(self, latency_inflation=2.0, **kw):
+        self.latencyInflation = latency_inflation
+        self.baselineLatency = None
+        super(BandwidthRateLimiter, self).__init__(**kw)
+
+    def _updateBaseline(self):
+        if len(self.window) < self.window.maxlen:
+            return
+        latency = self.averageLatency
+        if latency and (self.baselineLatency is None or
+                        latency < self.baselineLatency):
+            self.baselineLatency = latency
+
+    def congested(self):
+        if not self.baselineLatency:
+            return False
+        return self.averageLatency > \
+            2 * self.latencyInflation * self.baselineLatency
+
+    def healthy(self):
+        if not super(BandwidthRateLimiter, self).healthy():
+            return False
+        if not self.baselineLatency:
+            return True
+        return self.averageLatency <= \
+            self.latencyInflation * self.baselineLatency
+
+    def completed(self, measurement):
+        self._record('completed', measurement)
+        self._updateBaseline()
+        if self.congested():
+            self.shrink()
+        elif self.healthy():
+            self.grow()
+
+rateLimiters = {
+    'timeout': TimeoutRateLimiter,
+    'bandwidth': BandwidthRateLimiter
+}
+
+class TokenBucket(object):
+    """
+    A token bucket that is refilled with rate tokens per second and that can
+    hold up to burst tokens.
+    """
+    def __init__(self, rate, burst, clock=reactor):
+        self.rate = float(rate)
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.lastUpdate = clock.seconds()
+
+    def _refill(self):
+        now = self.clock.seconds()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.lastUpdate) * self.rate)
+        self.lastUpdate = now
+
+    def available(self):
+        self._refill()
+        return self.tokens >= 1
+
+    def consume(self):
+        """
+        Returns True and removes a token from the bucket if one is available.
+        """
+        if not self.available():
+            return False
+        self.tokens -= 1
+        return True
+
+    def wait(self):
+        """
+        Returns the number of seconds until a token will be available.
+        """
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class DestinationRateLimiter(object):
+    """
+    Keeps one :class:TokenBucket per destination key, so that no single
+    destination receives more than rate measurements per second (with bursts
+    of up to burst measurements).
+
+    The keys are obtained from the tasks via their destinationKey attribute.
+    A key can also be a tuple of keys, in which case the task is admitted only
+    if all of them have a token available.
+    """
+    def __init__(self, rate, burst=1, clock=reactor):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.clock = clock
+        self.buckets = {}
+
+    def _keys(self, key):
+        if isinstance(key, tuple):
+            return key
+        return (key,)
+
+    def _bucket(self, key):
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(self.rate, self.burst, self.clock)
+        return self.buckets[key]
+
+    def available(self, key):
+        if key is None:
+            return True
+        for k in self._keys(key):
+            if not self._bucket(k).available():
+                return False
+        return True
+
+    def acquire(self, key):
+        """
+        Returns True and consumes a token for every key if the task with the
+        given destination key can run now.
+        """
+        if not self.available(key):
+            return False
+        if key is not None:
+            for k in self._keys(key):
+                self._bucket(k).consume()
+        return True
+
+    def wait(self, key):
+        if key is None:
+            return 0
+        return max(self._bucket(k).wait() for k in self._keys(key))
+
+class ThrottledTasks(object):
+    """
+    Holds the tasks whose destination has no tokens left, grouped by
+    destination key and in the order they were scheduled.
+    """
+    def __init__(self, destination_rate_limiter):
+        self.destinationRateLimiter = destination_rate_limiter
+        self._queues = OrderedDict()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def park(self, key, task):
+        self._queues.setdefault(key, deque()).append(task)
+        self._size += 1
+
+    def pop(self):
+        """
+        Returns the oldest throttled task whose destination can now be
+        contacted, or None if all of them are still throttled.
+        """
+        for key, queue in self._queues.iteritems():
+            if self.destinationRateLimiter.acquire(key):
+                task = queue.popleft()
+                if not queue:
+                    del self._queues[key]
+                self._size -= 1
+                return task
+        return None
+
+    def wait(self):
+        """
+        Returns the number of seconds until one of the throttled tasks can be
+        run.
+        """
+        if not self._queues:
+            return None
+        return min(self.destinationRateLimiter.wait(key)
+                   for key in self._queues)
+
+def inputHost(test_input):
+    """
+    Extracts the hostname from an URL, a host:port pair or a hostname.
+    """
+    if not isinstance(test_input, basestring):
+        return None
+    host = test_input.strip().split('//')[-1].split('/')[0]
+    host = host.split('@')[-1]
+    if host.count(':') == 1:
+        host = host.split(':')[0]
+    return host.lower() or None
 
-class BandwidthRateLimiter(RateLimiter):
-    pass
+_ipv4Regexp = re.compile("^(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})$")
+
+def hostKey(measurement):
+    """
+    Rate limit measurements by the host they are contacting.
+    """
+    return inputHost(measurement.testInstance.input)
+
+def resolverKey(measurement):
+    """
+    Rate limit measurements by the DNS resolvers they are querying.
+    """
+    test_instance = measurement.testInstance
+    resolvers = getattr(test_instance, 'test_resolvers', None)
+    if resolvers:
+        return tuple(resolvers)
+    resolver = getattr(test_instance, 'resolver', None)
+    if resolver:
+        return str(resolver)
+    return hostKey(measurement)
+
+def subnetKey(measurement):
+    """
+    Rate limit measurements by the /24 of the IP address they are contacting.
+    Inputs that are not IPv4 addresses are rate limited by host.
+    """
+    host = hostKey(measurement)
+    if host and _ipv4Regexp.match(host):
+        return '.'.join(host.split('.')[:3]) + '.0/24'
+    return host
+
+_asnCache = {}
+def asnKey(measurement):
+    """
+    Rate limit measurements by the ASN of the IP address they are contacting.
+    Inputs that are not IPv4 addresses are rate limited by host.
+    """
+    from ooni import geoip
+    host = hostKey(measurement)
+    if not host or not _ipv4Regexp.match(host):
+        return host
+    if host not in _asnCache:
+        try:
+            _asnCache[host] = geoip.IPToLocation(host)['asn'] or host
+        except Exception:
+            log.debug("Could not lookup the ASN of %s" % host)
+            _asnCache[host] = host
+    return _asnCache[host]
 
+keyExtractors = {
+    'host': hostKey,
+    'resolver': resolverKey,
+    'subnet': subnetKey,
+    'asn': asnKey
+}
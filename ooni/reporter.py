@@ -1,5 +1,6 @@
 import traceback
 import itertools
+import hashlib
 import logging
 import time
 import yaml
@@ -7,14 +8,21 @@ import json
 import sys
 import os
 import re
+import base64
 
 from yaml.representer import *
 from yaml.emitter import *
+from yaml.events import *
 from yaml.serializer import *
 from yaml.resolver import *
+if yaml.__with_libyaml__:
+    from yaml.cyaml import CEmitter
+else:
+    CEmitter = None
 from twisted.python.util import untilConcludes
 from twisted.trial import reporter
-from twisted.internet import defer, reactor
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
 from twisted.internet.error import ConnectionRefusedError
 from twisted.python.failure import Failure
 from twisted.internet.endpoints import TCP4ClientEndpoint
@@ -53,6 +61,41 @@ def createPacketReport(packet_list):
             'summary': str(packet.summary())})
     return report
 
+def entrySize(entry):
+    """
+    Returns a rough estimate of the number of bytes held by a report entry,
+    by summing the lengths of all the strings it contains.
+    """
+    size = 0
+    stack = [entry]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, basestring):
+            size += len(item)
+        elif isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set)):
+            stack.extend(item)
+        elif isinstance(item, Measurement):
+            stack.append(item.testInstance.report)
+        else:
+            size += 8
+    return size
+
+def complexString(data):
+    """
+    Returns the representation of the complex number data in the reports.
+    """
+    if data.imag == 0.0:
+        return u'%r' % data.real
+    elif data.real == 0.0:
+        return u'%rj' % data.imag
+    elif data.imag > 0:
+        return u'%r+%rj' % (data.real, data.imag)
+    else:
+        return u'%r%rj' % (data.real, data.imag)
+
 class OSafeRepresenter(SafeRepresenter):
     """
     This is a custom YAML representer that allows us to represent reports
@@ -74,20 +117,97 @@ class OSafeRepresenter(SafeRepresenter):
         return SafeRepresenter.represent_data(self, data)
 
     def represent_complex(self, data):
-        if data.imag == 0.0:
-            data = u'%r' % data.real
-        elif data.real == 0.0:
-            data = u'%rj' % data.imag
-        elif data.imag > 0:
-            data = u'%r+%rj' % (data.real, data.imag)
-        else:
-            data = u'%r%rj' % (data.real, data.imag)
-        return self.represent_scalar(u'tag:yaml.org,2002:python/complex', data)
+        # Explicitly single quoted, as libyaml would otherwise emit it plain
+        return self.represent_scalar(u'tag:yaml.org,2002:python/complex',
+                                     complexString(data), style="'")
 
 OSafeRepresenter.add_representer(complex,
                                  OSafeRepresenter.represent_complex)
+# Subclasses of dict, such as the test details
+OSafeRepresenter.add_multi_representer(dict,
+                                       SafeRepresenter.represent_dict)
 
-class OSafeDumper(Emitter, Serializer, OSafeRepresenter, Resolver):
+class OEmitter(Emitter):
+    """
+    An Emitter that chooses simple keys and folds double quoted scalars like
+    libyaml does, so that :class:OSafeDumper and :class:OSafeCDumper
+    produce the same output.
+    """
+    def check_simple_key(self):
+        length = 0
+        if isinstance(self.event, NodeEvent) and self.event.anchor is not None:
+            if self.prepared_anchor is None:
+                self.prepared_anchor = self.prepare_anchor(self.event.anchor)
+            length += len(self.prepared_anchor)
+        if isinstance(self.event, ScalarEvent):
+            if self.analysis is None:
+                self.analysis = self.analyze_scalar(self.event.value)
+            # libyaml also counts carriage returns as line breaks
+            if self.analysis.multiline or u'\r' in self.event.value:
+                return False
+            # libyaml only counts the tags that are written, and the length
+            # of the scalar in UTF-8
+            if self.event.tag is not None and not any(self.event.implicit):
+                if self.prepared_tag is None:
+                    self.prepared_tag = self.prepare_tag(self.event.tag)
+                length += len(self.prepared_tag)
+            length += len(self.event.value.encode('utf-8'))
+        elif isinstance(self.event, CollectionStartEvent):
+            if not (self.check_empty_sequence() or self.check_empty_mapping()):
+                return False
+            if self.event.tag is not None and not self.event.implicit:
+                if self.prepared_tag is None:
+                    self.prepared_tag = self.prepare_tag(self.event.tag)
+                length += len(self.prepared_tag)
+        elif not isinstance(self.event, AliasEvent):
+            return False
+        return length <= 128
+
+    def write_double_quoted(self, text, split=True):
+        self.write_indicator(u'"', True)
+        chunks = []
+        spaces = False
+        for index, ch in enumerate(text):
+            if ch in u'"\\\x85\u2028\u2029\uFEFF' \
+                    or not (u'\x20' <= ch <= u'\x7E'
+                        or (self.allow_unicode
+                            and (u'\xA0' <= ch <= u'\uD7FF'
+                                or u'\uE000' <= ch <= u'\uFFFD'))):
+                if ch in self.ESCAPE_REPLACEMENTS:
+                    data = u'\\'+self.ESCAPE_REPLACEMENTS[ch]
+                elif ch <= u'\xFF':
+                    data = u'\\x%02X' % ord(ch)
+                elif ch <= u'\uFFFF':
+                    data = u'\\u%04X' % ord(ch)
+                else:
+                    data = u'\\U%08X' % ord(ch)
+                spaces = False
+            elif ch == u' ':
+                # Lines are only broken at the first space past the width
+                if split and not spaces and self.column > self.best_width \
+                        and 0 < index < len(text)-1:
+                    self._writeChunks(chunks)
+                    self.write_indent()
+                    data = u'\\' if text[index+1] == u' ' else u''
+                else:
+                    data = ch
+                spaces = True
+            else:
+                data = ch
+                spaces = False
+            chunks.append(data)
+            self.column += len(data)
+        self._writeChunks(chunks)
+        self.write_indicator(u'"', False)
+
+    def _writeChunks(self, chunks):
+        data = u''.join(chunks)
+        del chunks[:]
+        if self.encoding:
+            data = data.encode(self.encoding)
+        self.stream.write(data)
+
+class OSafeDumper(OEmitter, Serializer, OSafeRepresenter, Resolver):
     """
     This is a modification of the YAML Safe Dumper to use our own Safe
     Representer that supports complex numbers.
@@ -98,7 +218,7 @@ class OSafeDumper(Emitter, Serializer, OSafeRepresenter, Resolver):
             allow_unicode=None, line_break=None,
             encoding=None, explicit_start=None, explicit_end=None,
             version=None, tags=None):
-        Emitter.__init__(self, stream, canonical=canonical,
+        OEmitter.__init__(self, stream, canonical=canonical,
                 indent=indent, width=width,
                 allow_unicode=allow_unicode, line_break=line_break)
         Serializer.__init__(self, encoding=encoding,
@@ -108,16 +228,307 @@ class OSafeDumper(Emitter, Serializer, OSafeRepresenter, Resolver):
                 default_flow_style=default_flow_style)
         Resolver.__init__(self)
 
+if CEmitter:
+    class OSafeCDumper(CEmitter, OSafeRepresenter, Resolver):
+        """
+        Like :class:OSafeDumper, but the YAML is emitted by libyaml, which
+        is much faster and produces the same output.
+        """
+        def __init__(self, stream,
+                default_style=None, default_flow_style=None,
+                canonical=None, indent=None, width=None,
+                allow_unicode=None, line_break=None,
+                encoding=None, explicit_start=None, explicit_end=None,
+                version=None, tags=None):
+            CEmitter.__init__(self, stream, canonical=canonical,
+                    indent=indent, width=width, encoding=encoding,
+                    allow_unicode=allow_unicode, line_break=line_break,
+                    explicit_start=explicit_start, explicit_end=explicit_end,
+                    version=version, tags=tags)
+            OSafeRepresenter.__init__(self, default_style=default_style,
+                    default_flow_style=default_flow_style)
+            Resolver.__init__(self)
+else:
+    OSafeCDumper = None
+
 class NoTestIDSpecified(Exception):
     pass
 
 def safe_dump(data, stream=None, **kw):
     """
     Safely dump to a yaml file the specified data.
+
+    libyaml is used to emit the YAML when PyYAML has been built with it.
+    """
+    return yaml.dump_all([data], stream, Dumper=OSafeCDumper or OSafeDumper,
+                         **kw)
+
+class BodyStore(object):
+    """
+    Keeps track of the HTTP response bodies that have been written to a
+    report, so that every distinct body is written only once.
+
+    The bodies of the responses of an entry are replaced by a body_ref key
+    holding the sha256 digest of the body. The first time a body is seen it
+    is written in a stored_bodies document just before the entry. Bodies
+    shorter than minBodySize are left in the entries.
+    """
+    minBodySize = 128
+
+    def __init__(self):
+        self.seen = set()
+
+    def extract(self, entry):
+        """
+        Returns the stored_bodies document to write before entry (or None if
+        there are no new bodies) and a copy of entry that references the
+        bodies.
+        """
+        if not isinstance(entry.get('requests'), list):
+            return None, entry
+
+        bodies = {}
+        requests = []
+        for request_response in entry['requests']:
+            try:
+                body = request_response['response']['body']
+            except (KeyError, TypeError):
+                requests.append(request_response)
+                continue
+            if not isinstance(body, basestring) or \
+                    len(body) < self.minBodySize:
+                requests.append(request_response)
+                continue
+            if isinstance(body, unicode):
+                digest = hashlib.sha256(body.encode('utf-8')).hexdigest()
+            else:
+                digest = hashlib.sha256(body).hexdigest()
+            if digest not in self.seen:
+                self.seen.add(digest)
+                bodies[digest] = body
+            response = dict(request_response['response'])
+            del response['body']
+            response['body_ref'] = digest
+            request_response = dict(request_response)
+            request_response['response'] = response
+            requests.append(request_response)
+
+        entry = dict(entry)
+        entry['requests'] = requests
+        if bodies:
+            return {'stored_bodies': bodies}, entry
+        return None, entry
+
+def jsonSafe(data):
+    """
+    Returns a copy of data that can be serialized to JSON.
+
+    Scapy packets are represented like in the YAML reports, strings that are
+    not valid UTF-8 (such as binary response bodies) as a dict with the
+    base64 encoding of the string as data and 'base64' as format, complex
+    numbers as strings and sets and tuples as lists.
+    """
+    if isinstance(data, str):
+        try:
+            data.decode('utf-8')
+        except UnicodeDecodeError:
+            return {'format': 'base64', 'data': base64.b64encode(data)}
+        return data
+    elif isinstance(data, dict):
+        safe_data = {}
+        for key, value in data.items():
+            if not isinstance(key, basestring):
+                key = str(key)
+            safe_data[jsonSafe(key)] = jsonSafe(value)
+        return safe_data
+    elif isinstance(data, Packet):
+        return jsonSafe(createPacketReport(data))
+    elif isinstance(data, (list, tuple, set, frozenset)):
+        return [jsonSafe(item) for item in data]
+    elif isinstance(data, complex):
+        return complexString(data)
+    return data
+
+def entryDocuments(entry, body_store=None):
+    """
+    Returns the documents to write to the report for entry.
+
+    If body_store is given, the response bodies of the entry are replaced by
+    references and the bodies that were not written before are returned in
+    a document preceding the one of the entry.
+    """
+    if isinstance(entry, Measurement):
+        entry = entry.testInstance.report
+    if body_store and isinstance(entry, dict):
+        bodies, entry = body_store.extract(entry)
+        if bodies:
+            return [bodies, entry]
+    return [entry]
+
+def serializeDocuments(documents, format='yaml'):
+    """
+    Returns the serialization of documents in format ('yaml' or 'json').
+
+    YAML documents are separated by the end and start markers of a document,
+    but the first one has no start marker and the last no end marker. JSON
+    documents are written one per line, without the final newline.
+    """
+    if format == 'json':
+        return '\n'.join(json.dumps(jsonSafe(document))
+                         for document in documents)
+    return '...\n---\n'.join(safe_dump(document) for document in documents)
+
+def serializeFormats(documents, formats):
+    """
+    Returns a dict of the serializations of documents in every one of
+    formats, keyed by format.
+    """
+    return dict((report_format, serializeDocuments(documents, report_format))
+                for report_format in formats)
+
+def plainData(data):
+    """
+    Returns a copy of data in which the scapy packets have been replaced by
+    their representation in the reports, so that it can be serialized in
+    another thread while the reactor keeps using data.
+    """
+    if isinstance(data, Packet):
+        return plainData(createPacketReport(data))
+    elif isinstance(data, dict):
+        return dict((plainData(key), plainData(value))
+                    for key, value in data.items())
+    elif isinstance(data, (list, tuple, set, frozenset)):
+        return type(data)(plainData(item) for item in data)
+    return data
+
+class SerializerPool(object):
+    """
+    Serializes report entries in a pool of at most threads threads, so that
+    serializing big entries does not keep the reactor busy and delay the
+    measurements in progress.
+
+    queueDepth is the number of entries that are waiting to be serialized
+    or are being serialized.
+    """
+    def __init__(self, threads, reactor=reactor):
+        self.reactor = reactor
+        self.threadpool = ThreadPool(0, threads, name='ooni-serializer')
+        self.queueDepth = 0
+        self.threadpool.start()
+        reactor.addSystemEventTrigger('during', 'shutdown',
+                                      self.threadpool.stop)
+
+    def serialize(self, documents, formats):
+        """
+        Returns a deferred firing with the result of
+        serializeFormats(documents, formats).
+
+        documents must not be used by the reactor while they are serialized,
+        see :func:plainData.
+        """
+        self.queueDepth += 1
+        d = threads.deferToThreadPool(self.reactor, self.threadpool,
+                                      serializeFormats, documents, formats)
+        @d.addBoth
+        def done(result):
+            self.queueDepth -= 1
+            return result
+        return d
+
+_serializerPool = None
+
+def getSerializerPool():
+    """
+    Returns the serializer pool shared by all the reports, or None if the
+    report_serialization_threads option is not set.
+    """
+    global _serializerPool
+    if not config.advanced.report_serialization_threads:
+        return None
+    if _serializerPool is None:
+        _serializerPool = SerializerPool(
+            config.advanced.report_serialization_threads)
+    return _serializerPool
+
+def serializeEntry(entry, body_store=None, format='yaml'):
+    """
+    Returns the serialization of a report entry in format, see
+    :func:entryDocuments and :func:serializeDocuments.
+    """
+    if isinstance(entry, Failure):
+        return entry.value
+    elif isinstance(entry, str):
+        # The entry has already been serialized (for example by a worker
+        # process)
+        return entry
+    return serializeDocuments(entryDocuments(entry, body_store), format)
+
+def rehydrateEntries(documents, bodies=None):
+    """
+    Takes the documents of a report and yields its entries (starting with
+    the header), with the response bodies that were written only once put
+    back in place of their references.
+
+    The entries that reference a body must follow the document that stores
+    it, unless bodies already maps the digests of all the stored bodies to
+    them.
+    """
+    if bodies is None:
+        bodies = {}
+    for document in documents:
+        if isinstance(document, dict) and 'stored_bodies' in document:
+            bodies.update(document['stored_bodies'])
+            continue
+        if isinstance(document, dict) and \
+                isinstance(document.get('requests'), list):
+            for request_response in document['requests']:
+                try:
+                    response = request_response['response']
+                    digest = response.pop('body_ref')
+                except (KeyError, TypeError, AttributeError):
+                    continue
+                response['body'] = bodies[digest]
+        yield document
+
+def loadDocuments(report_path):
     """
-    return yaml.dump_all([data], stream, Dumper=OSafeDumper, **kw)
+    Yields the documents of the YAML or JSON Lines (if report_path ends with
+    .jsonl) report stored in report_path.
+    """
+    with open(report_path) as f:
+        if report_path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            for document in yaml.safe_load_all(f):
+                yield document
+
+def readReport(report_path):
+    """
+    Yields the entries of the report stored in report_path, see
+    :func:rehydrateEntries.
+
+    The report is read twice, since the entries written to a collector may
+    reach it before the entry that stores their body.
+    """
+    bodies = {}
+    for document in loadDocuments(report_path):
+        if isinstance(document, dict) and 'stored_bodies' in document:
+            bodies.update(document['stored_bodies'])
+    for entry in rehydrateEntries(loadDocuments(report_path), bodies):
+        yield entry
+
+reportFormats = ('yaml', 'json')
 
 class OReporter(object):
+    # Set to the format ('yaml' or 'json') of the serialized entries that
+    # writeReportEntry accepts, as returned by serializeEntry. The report
+    # then serializes every entry only once per format for all the
+    # reporters. If it is None writeReportEntry is called with the
+    # measurement.
+    serializationFormat = None
+
     def __init__(self, test_details):
         self.testDetails = test_details
 
@@ -164,26 +575,110 @@ class YAMLReporter(OReporter):
     report_destination:
         the destination directory of the report
 
+    report_filename:
+        the filename of the report. By default it is made of the test name
+        and the current time.
+
+    resume:
+        if True and the report already exists, entries are appended to it
+        instead of starting a new report. An incomplete last entry, left over
+        by a crash, is removed first.
+
+    The report entries are buffered and written to the report every
+    flushEntries entries, flushInterval seconds after the first buffered
+    entry (if set) and when the report is closed. Every entry is written
+    whole, so the report never ends with half an entry. If fsyncOnFlush is
+    set the report is also synced to disk every time it is written.
     """
-    def __init__(self, test_details, report_destination='.'):
+    serializationFormat = 'yaml'
+    reportExtension = 'yamloo'
+
+    flushEntries = 1
+    flushInterval = None
+    fsyncOnFlush = False
+
+    def __init__(self, test_details, report_destination='.',
+                 report_filename=None, resume=False, clock=reactor):
+        if config.advanced.report_flush_entries:
+            self.flushEntries = config.advanced.report_flush_entries
+        if config.advanced.report_flush_interval:
+            self.flushInterval = config.advanced.report_flush_interval
+        if config.advanced.report_fsync:
+            self.fsyncOnFlush = True
+        self.clock = clock
+        self._stream = None
+        self._buffer = []
+        self._bufferedEntries = 0
+        self._flushCall = None
+
         self.reportDestination = report_destination
 
         if not os.path.isdir(report_destination):
             raise InvalidDestination
 
-        report_filename = "report-" + \
-                test_details['test_name'] + "-" + \
-                otime.timestamp() + ".yamloo"
+        if not report_filename:
+            report_filename = "report-" + \
+                    test_details['test_name'] + "-" + \
+                    otime.timestamp() + "." + self.reportExtension
 
         report_path = os.path.join(self.reportDestination, report_filename)
 
-        if os.path.exists(report_path):
+        self.resume = resume and os.path.exists(report_path)
+        if self.resume:
+            self.resume = self.truncateIncompleteEntries(report_path)
+        if os.path.exists(report_path) and not self.resume:
             log.msg("Report already exists with filename %s" % report_path)
             pushFilenameStack(report_path)
 
         self.report_path = report_path
         OReporter.__init__(self, test_details)
 
+    def completeLength(self, content):
+        """
+        Returns the length of the part of content, the content of a report,
+        that ends with its last complete and valid entry, or 0 if it has
+        none.
+        """
+        documents = []
+        start = None
+        offset = 0
+        for line in content.split('\n')[:-1]:
+            if line == '---':
+                start = offset
+            offset += len(line) + 1
+            if line == '...' and start is not None:
+                documents.append((start, offset))
+                start = None
+        for start, end in reversed(documents):
+            try:
+                yaml.safe_load(content[start:end])
+            except yaml.YAMLError:
+                continue
+            return end
+        return 0
+
+    def truncateIncompleteEntries(self, report_path):
+        """
+        Truncates the report at report_path after its last complete entry, so
+        that the entries appended when resuming do not follow a truncated one.
+
+        Returns:
+            False if the report has no complete entry and must be started
+            again, True otherwise.
+        """
+        with open(report_path, 'r+') as f:
+            content = f.read()
+            length = self.completeLength(content)
+            if not length:
+                log.err("Report %s has no complete entry, not resuming it" %
+                        report_path)
+                return False
+            if length < len(content):
+                log.err("Removing the incomplete last entry of %s" %
+                        report_path)
+                f.truncate(length)
+        return True
+
     def _writeln(self, line):
         self._write("%s\n" % line)
 
@@ -195,29 +690,54 @@ class YAMLReporter(OReporter):
         s = str(format_string)
         assert isinstance(s, type(''))
         if args:
-            self._stream.write(s % args)
+            self._buffer.append(s % args)
         else:
-            self._stream.write(s)
-        untilConcludes(self._stream.flush)
+            self._buffer.append(s)
 
     def writeReportEntry(self, entry):
         log.debug("Writing report with YAML reporter")
-        self._write('---\n')
-        if isinstance(entry, Measurement):
-            self._write(safe_dump(entry.testInstance.report))
-        elif isinstance(entry, Failure):
-            self._write(entry.value)
-        elif isinstance(entry, dict):
-            self._write(safe_dump(entry))
-        self._write('...\n')
+        self._write('---\n%s...\n', serializeEntry(entry))
+        self._entryBuffered()
+
+    def _entryBuffered(self):
+        self._bufferedEntries += 1
+        if self._bufferedEntries >= self.flushEntries:
+            self.flush()
+        elif self.flushInterval and not self._flushCall:
+            self._flushCall = self.clock.callLater(self.flushInterval,
+                                                   self.flush)
+
+    def flush(self):
+        """
+        Writes the buffered report entries to the report.
+        """
+        if self._flushCall and self._flushCall.active():
+            self._flushCall.cancel()
+        self._flushCall = None
+        if not self._buffer or not self._stream or self._stream.closed:
+            return
+        self._stream.write(''.join(self._buffer))
+        untilConcludes(self._stream.flush)
+        if self.fsyncOnFlush:
+            os.fsync(self._stream.fileno())
+        self._buffer = []
+        self._bufferedEntries = 0
 
     def createReport(self):
         """
         Writes the report header and fire callbacks on self.created
         """
+        if self.resume:
+            log.msg("Resuming report %s" % self.report_path)
+            self._stream = open(self.report_path, 'a')
+            return
+
         log.debug("Creating %s" % self.report_path)
         self._stream = open(self.report_path, 'w+')
+        self.writeHeader()
+        self.flush()
 
+    def writeHeader(self):
         self._writeln("###########################################")
 
         self._writeln("# OONI Probe Report for %s (%s)" % (self.testDetails['test_name'],
@@ -227,9 +747,53 @@ class YAMLReporter(OReporter):
 
         self.writeReportEntry(self.testDetails)
 
+    def sync(self):
+        """
+        Makes sure the entries written so far are on disk.
+        """
+        if self._stream and not self._stream.closed:
+            self.flush()
+            untilConcludes(self._stream.flush)
+            os.fsync(self._stream.fileno())
+
     def finish(self):
+        self.flush()
         self._stream.close()
 
+class JSONLReporter(YAMLReporter):
+    """
+    Writes the report in the JSON Lines format: the first line holds the
+    test details and every following line a report entry, serialized as a
+    JSON object (see :func:jsonSafe).
+
+    The report file is handled like by :class:YAMLReporter.
+    """
+    serializationFormat = 'json'
+    reportExtension = 'jsonl'
+
+    def completeLength(self, content):
+        end = len(content)
+        while end:
+            start = content.rfind('\n', 0, end - 1) + 1
+            line = content[start:end]
+            if line.endswith('\n'):
+                try:
+                    json.loads(line)
+                except ValueError:
+                    pass
+                else:
+                    return end
+            end = start
+        return 0
+
+    def writeReportEntry(self, entry):
+        log.debug("Writing report with JSONL reporter")
+        self._write('%s\n', serializeEntry(entry, format='json'))
+        self._entryBuffered()
+
+    def writeHeader(self):
+        self.writeReportEntry(self.testDetails)
+
 def collector_supported(collector_address):
     if collector_address.startswith('httpo') \
             and (not (config.tor_state or config.tor.socks_port)):
@@ -237,9 +801,20 @@ def collector_supported(collector_address):
     return True
 
 class OONIBReporter(OReporter):
-    def __init__(self, test_details, collector_address):
+    """
+    Reports to an oonib collector.
+
+    The report entries are uploaded as YAML documents, unless report_format
+    is 'json' and the collector lists 'json' in the supported_formats of its
+    response to the creation of the report. They are then uploaded in the
+    JSON Lines format.
+    """
+    serializationFormat = 'yaml'
+
+    def __init__(self, test_details, collector_address, report_format='yaml'):
         self.collectorAddress = collector_address
         self.validateCollectorAddress()
+        self.reportFormat = report_format
 
         self.reportID = None
 
@@ -257,19 +832,19 @@ class OONIBReporter(OReporter):
     @defer.inlineCallbacks
     def writeReportEntry(self, entry):
         log.debug("Writing report with OONIB reporter")
-        content = '---\n'
-        if isinstance(entry, Measurement):
-            content += safe_dump(entry.testInstance.report)
-        elif isinstance(entry, Failure):
-            content += entry.value
-        elif isinstance(entry, dict):
-            content += safe_dump(entry)
-        content += '...\n'
+        if self.serializationFormat == 'json':
+            content = serializeEntry(entry, format='json') + '\n'
+        else:
+            content = '---\n'
+            content += serializeEntry(entry)
+            content += '...\n'
 
         url = self.collectorAddress + '/report'
 
         request = {'report_id': self.reportID,
                 'content': content}
+        if self.serializationFormat == 'json':
+            request['format'] = 'json'
 
         log.debug("Updating report with id %s (%s)" % (self.reportID, url))
         request_json = json.dumps(request)
@@ -376,6 +951,12 @@ class OONIBReporter(OReporter):
 
         self.reportID = parsed_response['report_id']
         self.backendVersion = parsed_response['backend_version']
+        if self.reportFormat == 'json':
+            if 'json' in parsed_response.get('supported_formats', []):
+                self.serializationFormat = 'json'
+            else:
+                log.msg("The collector does not support JSON reports, "
+                        "reporting in YAML")
         log.debug("Created report with id %s" % parsed_response['report_id'])
 
     @defer.inlineCallbacks
@@ -407,6 +988,14 @@ class Report(object):
         self.done = defer.Deferred()
         self.reportEntryManager = reportEntryManager
 
+        # Set when the report_body_dedup option is enabled
+        self.bodyStore = None
+        if config.advanced.report_body_dedup:
+            self.bodyStore = BodyStore()
+        self.serializerPool = getSerializerPool()
+        # Fires once the last entry written has been handed to the reporters
+        self._lastWrite = defer.succeed(None)
+
         self._reporters_openned = 0
         self._reporters_written = 0
         self._reporters_closed = 0
@@ -449,6 +1038,11 @@ class Report(object):
         Will return a deferred that will fire once the report for the specified
         measurement have been written to all the reporters.
 
+        The entry is serialized once per format for all the reporters that
+        accept serialized entries (in the serializer pool if there is one).
+        The entries are handed to the reporters in the order they are
+        written, even if they are serialized out of order.
+
         Args:
 
             measurement:
@@ -460,6 +1054,64 @@ class Report(object):
         """
 
         all_written = defer.Deferred()
+
+        entry_size = entrySize(measurement)
+        self.reportEntryManager.entryQueued(entry_size)
+        @all_written.addBoth
+        def entry_done(result):
+            self.reportEntryManager.entryDone(entry_size)
+            return result
+
+        d = defer.maybeDeferred(self.serialize, measurement)
+        @d.addErrback
+        def serialization_failed(failure):
+            log.err("Failed to serialize the report entry")
+            log.exception(failure)
+            return {}
+
+        previous, self._lastWrite = self._lastWrite, defer.Deferred()
+        written = self._lastWrite
+        d = defer.gatherResults([d, previous])
+        @d.addCallback
+        def serialized(results):
+            try:
+                self.writeEntries(measurement, results[0], all_written)
+            except Exception:
+                # Fire all_written, so that the entry leaves the backlog
+                if not all_written.called:
+                    all_written.errback()
+                raise
+            finally:
+                written.callback(None)
+        d.addErrback(log.exception)
+
+        return all_written
+
+    def serialize(self, measurement):
+        """
+        Returns a deferred firing with a dict of the serializations of
+        measurement, keyed by format, in the formats of the reporters.
+        """
+        formats = set(getattr(reporter, 'serializationFormat', None)
+                      for reporter in self.reporters)
+        formats.discard(None)
+        if isinstance(measurement, str):
+            # Entries serialized by worker processes are YAML documents
+            return defer.succeed({'yaml': measurement})
+        elif not formats or isinstance(measurement, Failure):
+            return defer.succeed({})
+
+        documents = entryDocuments(measurement, self.bodyStore)
+        if self.serializerPool:
+            return self.serializerPool.serialize(plainData(documents),
+                                                 formats)
+        return defer.maybeDeferred(serializeFormats, documents, formats)
+
+    def writeEntries(self, measurement, serialized, all_written):
+        """
+        Schedules the writing of measurement (or of its serialization in
+        serialized) to every reporter, firing all_written when done.
+        """
         report_tracker = ReportTracker(self.reporters)
 
         for reporter in self.reporters[:]:
@@ -475,21 +1127,21 @@ class Report(object):
                     self.failedWritingReport(failure, reporter)
                 except errors.NoMoreReporters, e:
                     log.err("No More Reporters!")
-                    all_written.errback(defer.fail(e))
+                    all_written.errback(e)
                 else:
                     report_tracker.completed()
                     if report_tracker.finished():
                         all_written.callback(report_tracker)
                 return
 
-            report_entry_task = ReportEntry(reporter, measurement)
+            entry = serialized.get(getattr(reporter, 'serializationFormat',
+                                           None), measurement)
+            report_entry_task = ReportEntry(reporter, entry)
             self.reportEntryManager.schedule(report_entry_task)
 
             report_entry_task.done.addCallback(report_completed)
             report_entry_task.done.addErrback(report_failed)
 
-        return all_written
-
     def failedWritingReport(self, failure, reporter):
         """
         This errback gets called every time we fail to write a report.
@@ -1,6 +1,7 @@
 import time
 
 from ooni.settings import config
+from ooni.utils.timingwheel import getTimingWheel
 from twisted.internet import defer, reactor
 
 class BaseTask(object):
@@ -35,6 +36,7 @@ class BaseTask(object):
         return result
 
     def start(self):
+        self.startTime = time.time()
         self._running = defer.maybeDeferred(self.run)
         self._running.addErrback(self._failed)
         self._running.addCallback(self._succeeded)
@@ -66,6 +68,9 @@ class TaskWithTimeout(BaseTask):
     timeout = 30
     # So that we can test the callLater calls
     clock = reactor
+    # When True the timeout is scheduled on the timing wheel shared by all the
+    # tasks using the same clock, instead of with a callLater of its own.
+    useTimingWheel = False
 
     def _timedOut(self):
         """Internal method for handling timeout failure"""
@@ -87,11 +92,18 @@ class TaskWithTimeout(BaseTask):
         return BaseTask._failed(self, failure)
 
     def start(self):
-        self._timer = self.clock.callLater(self.timeout, self._timedOut)
+        if self.useTimingWheel:
+            self._timer = getTimingWheel(self.clock).callLater(self.timeout,
+                                                               self._timedOut)
+        else:
+            self._timer = self.clock.callLater(self.timeout, self._timedOut)
         return BaseTask.start(self)
 
 class Measurement(TaskWithTimeout):
-    def __init__(self, test_class, test_method, test_input):
+    useTimingWheel = True
+
+    def __init__(self, test_class, test_method, test_input,
+                 key_extractor=None):
         """
         test_class:
             is the class, subclass of NetTestCase, of the test to be run
@@ -103,6 +115,12 @@ class Measurement(TaskWithTimeout):
         test_input:
             is the input to the test
 
+        key_extractor:
+            an optional function that takes as argument the measurement and
+            returns the key of the destination it will be contacting (see
+            :mod:ooni.ratelimiting). Measurements with the same key share the
+            same per destination rate limit.
+
         net_test:
             a reference to the net_test object such measurement belongs to.
         """
@@ -116,6 +134,10 @@ class Measurement(TaskWithTimeout):
 
         self.netTestMethod = getattr(self.testInstance, test_method)
 
+        self.destinationKey = None
+        if key_extractor:
+            self.destinationKey = key_extractor(self)
+
         if config.advanced.measurement_timeout:
             self.timeout = config.advanced.measurement_timeout
         TaskWithTimeout.__init__(self)
@@ -155,6 +177,8 @@ class ReportTracker(object):
         self.report_completed += 1
 
 class ReportEntry(TaskWithTimeout):
+    useTimingWheel = True
+
     def __init__(self, reporter, entry):
         self.reporter = reporter
         self.entry = entry 
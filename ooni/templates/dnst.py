@@ -28,6 +28,7 @@ class DNSTest(NetTestCase):
 
     requiresRoot = False
     queryTimeout = [1]
+    bypassDNSCache = True
 
     def _setUp(self):
         super(DNSTest, self)._setUp()
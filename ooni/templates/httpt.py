@@ -45,18 +45,39 @@ class HTTPTest(NetTestCase):
 
     randomizeUA = False
     followRedirects = False
+    # Set to True to keep the connections alive between the requests to the
+    # same host. The report then says for every request whether it was sent
+    # over a connection that had already been used. The
+    # http_persistent_connections option sets it for all the HTTP tests.
+    persistentConnections = False
+    # The maximum number of bytes of a response body to keep in the report.
+    # Longer bodies are truncated. None keeps all of it.
+    maxBodySize = None
+    # Set to True to report the length, sha256 digest and simhash of every
+    # response body. They are also reported when maxBodySize is set, since
+    # the body in the report may then be truncated.
+    reportBodyDigests = False
+    rateLimitKey = 'host'
+    inputDedupKey = 'url'
 
     baseParameters = [['socksproxy', 's', None,
         'Specify a socks proxy to use for requests (ip:port)']]
 
+    # These are set once per NetTest by _setUpClass
+    agent = None
+    control_agent = None
+    agentType = None
+    socksproxy = None
+
     request = {}
     response = {}
 
     requests = []
     responses = []
 
-    def _setUp(self):
-        super(HTTPTest, self)._setUp()
+    @classmethod
+    def _setUpClass(cls):
+        super(HTTPTest, cls)._setUpClass()
 
         try:
             import OpenSSL
@@ -64,38 +85,49 @@ class HTTPTest(NetTestCase):
             log.err("Warning! pyOpenSSL is not installed. https websites will "
                      "not work")
 
-        self.control_agent = TrueHeadersSOCKS5Agent(reactor,
+        if config.advanced.http_persistent_connections:
+            cls.persistentConnections = True
+        if config.advanced.http_max_body_size:
+            cls.maxBodySize = config.advanced.http_max_body_size
+        persistent = cls.persistentConnections
+        cls.control_agent = TrueHeadersSOCKS5Agent(reactor,
                 proxyEndpoint=TCP4ClientEndpoint(reactor, '127.0.0.1',
-                    config.tor.socks_port))
+                    config.tor.socks_port), persistent=persistent)
 
-        self.report['socksproxy'] = None
+        cls.socksproxy = None
         sockshost, socksport = (None, None)
-        if self.localOptions['socksproxy']:
+        if cls.localOptions['socksproxy']:
             try:
-                sockshost, socksport = self.localOptions['socksproxy'].split(':')
-                self.report['socksproxy'] = self.localOptions['socksproxy']
+                sockshost, socksport = cls.localOptions['socksproxy'].split(':')
+                cls.socksproxy = cls.localOptions['socksproxy']
             except ValueError:
                 raise InvalidSocksProxyOption
             socksport = int(socksport)
-            self.agent = TrueHeadersSOCKS5Agent(reactor,
+            cls.agent = TrueHeadersSOCKS5Agent(reactor,
                 proxyEndpoint=TCP4ClientEndpoint(reactor, sockshost,
-                    socksport))
+                    socksport), persistent=persistent)
         else:
-            self.agent = TrueHeadersAgent(reactor)
+            cls.agent = TrueHeadersAgent(reactor, persistent=persistent)
 
-        self.report['agent'] = 'agent'
+        cls.agentType = 'agent'
 
-        if self.followRedirects:
+        if cls.followRedirects:
             try:
                 from twisted.web.client import RedirectAgent
-                self.control_agent = RedirectAgent(self.control_agent)
-                self.agent = RedirectAgent(self.agent)
-                self.report['agent'] = 'redirect'
+                cls.control_agent = RedirectAgent(cls.control_agent)
+                cls.agent = RedirectAgent(cls.agent)
+                cls.agentType = 'redirect'
             except:
                 log.err("Warning! You are running an old version of twisted"\
                         "(<= 10.1). I will not be able to follow redirects."\
                         "This may make the testing less precise.")
 
+    def _setUp(self):
+        super(HTTPTest, self)._setUp()
+
+        self.report['socksproxy'] = self.socksproxy
+        self.report['agent'] = self.agentType
+
         self.processInputs()
         log.debug("Finished test setup")
 
@@ -106,7 +138,8 @@ class HTTPTest(NetTestCase):
     def processInputs(self):
         pass
 
-    def addToReport(self, request, response=None, response_body=None, failure_string=None):
+    def addToReport(self, request, response=None, response_body=None,
+                    failure_string=None, body_receiver=None):
         """
         Adds to the report the specified request and response.
 
@@ -118,6 +151,10 @@ class HTTPTest(NetTestCase):
                 Note: headers is our modified True Headers version.
 
             failure (instance): An instance of :class:twisted.internet.failure.Failure
+
+            body_receiver (instance): The :class:ooni.utils.net.BodyReceiver
+                that received the response body, used to report its length
+                and digests.
         """
         log.debug("Adding %s to report" % request)
         request_headers = TrueHeaders(request['headers'])
@@ -136,19 +173,37 @@ class HTTPTest(NetTestCase):
                 'body': response_body,
                 'code': response.code
         }
+            if body_receiver and body_receiver.sha256:
+                digests = body_receiver.digests()
+                request_response['response']['body_length'] = \
+                    digests['length']
+                request_response['response']['body_sha256'] = \
+                    digests['sha256']
+                request_response['response']['body_simhash'] = \
+                    digests['simhash']
+                if body_receiver.truncated:
+                    request_response['response']['body_truncated'] = True
+            if self.persistentConnections and \
+                    hasattr(response, 'connectionReused'):
+                request_response['connection_reused'] = \
+                    response.connectionReused
         if failure_string:
             request_response['failure'] = failure_string
 
         self.report['requests'].append(request_response)
 
-    def _processResponseBody(self, response_body, request, response, body_processor):
+    def _processResponseBody(self, response_body, request, response,
+                             body_processor, body_receiver=None):
         log.debug("Processing response body")
-        HTTPTest.addToReport(self, request, response, response_body)
+        HTTPTest.addToReport(self, request, response, response_body,
+                             body_receiver=body_receiver)
         if body_processor:
             body_processor(response_body)
         else:
             self.processResponseBody(response_body)
         response.body = response_body
+        if body_receiver and body_receiver.sha256:
+            response.bodyDigests = body_receiver.digests()
         return response
 
     def processResponseBody(self, body):
@@ -230,15 +285,13 @@ class HTTPTest(NetTestCase):
         else:
             self.processResponseHeaders(response_headers_dict)
 
-        try:
-            content_length = response.headers.getRawHeaders('content-length')
-        except IndexError:
-            content_length = None
-
         finished = defer.Deferred()
-        response.deliverBody(BodyReceiver(finished, content_length))
+        digests = self.reportBodyDigests or self.maxBodySize is not None
+        body_receiver = BodyReceiver(finished, max_size=self.maxBodySize,
+                                     digests=digests)
+        response.deliverBody(body_receiver)
         finished.addCallback(self._processResponseBody, request,
-                response, body_processor)
+                response, body_processor, body_receiver)
         return finished
 
     def doRequest(self, url, method="GET",
@@ -36,23 +36,25 @@ class BaseScapyTest(NetTestCase):
             ['ipid', 'i',
                 'Check if the IPID matches when processing answers']
             ]
+    answerFlags = []
 
-    def _setUp(self):
-        super(BaseScapyTest, self)._setUp()
+    @classmethod
+    def _setUpClass(cls):
+        super(BaseScapyTest, cls)._setUpClass()
 
         if not config.scapyFactory:
             log.debug("Scapy factoring not set, registering it.")
             config.scapyFactory = ScapyFactory(config.advanced.interface)
 
-        self.report['answer_flags'] = []
-        if self.localOptions['ipsrc']:
+        cls.answerFlags = []
+        if cls.localOptions['ipsrc']:
             config.checkIPsrc = 0
         else:
-            self.report['answer_flags'].append('ipsrc')
+            cls.answerFlags.append('ipsrc')
             config.checkIPsrc = 1
 
-        if self.localOptions['ipid']:
-            self.report['answer_flags'].append('ipid')
+        if cls.localOptions['ipid']:
+            cls.answerFlags.append('ipid')
             config.checkIPID = 1
         else:
             config.checkIPID = 0
@@ -62,12 +64,16 @@ class BaseScapyTest(NetTestCase):
         # Perhaps in the future we will want to have more fine grained control
         # over this.
 
-        if self.localOptions['seqack']:
-            self.report['answer_flags'].append('seqack')
+        if cls.localOptions['seqack']:
+            cls.answerFlags.append('seqack')
             config.check_TCPerror_seqack = 1
         else:
             config.check_TCPerror_seqack = 0
 
+    def _setUp(self):
+        super(BaseScapyTest, self)._setUp()
+
+        self.report['answer_flags'] = list(self.answerFlags)
         self.report['sent_packets'] = []
         self.report['answered_packets'] = []
 
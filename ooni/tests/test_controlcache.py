@@ -0,0 +1,72 @@
+import os
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from ooni.utils import controlcache
+from ooni.utils.controlcache import ControlCache, controlKey
+
+class TestControlCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.clock.advance(1000)
+        self.cachePath = self.mktemp()
+        self.controlCache = self.cache()
+        self.result = {'code': 200, 'headers': [['Server', ['nginx']]]}
+
+    def cache(self, max_entries=3):
+        return ControlCache(self.cachePath, ttl=60, max_entries=max_entries,
+                            clock=self.clock)
+
+    def test_key(self):
+        self.assertEqual(controlKey('http://a/', {'User-Agent': ['x']}),
+                         controlKey('http://a/', {'user-agent': ['x']}))
+        self.assertNotEqual(controlKey('http://a/', {'User-Agent': ['x']}),
+                            controlKey('http://a/', {'User-Agent': ['y']}))
+        self.assertNotEqual(controlKey('http://a/', {}),
+                            controlKey('http://b/', {}))
+
+    def test_get_returns_age(self):
+        self.assertEqual(self.controlCache.get('a'), None)
+        self.controlCache.set('a', self.result)
+        self.clock.advance(10)
+        self.assertEqual(self.controlCache.get('a'), (self.result, 10))
+
+    def test_expires(self):
+        self.controlCache.set('a', self.result)
+        self.clock.advance(60)
+        self.assertEqual(self.controlCache.get('a'), None)
+
+    def test_lru_eviction(self):
+        for key in 'abc':
+            self.controlCache.set(key, self.result)
+        self.controlCache.get('a')
+        self.controlCache.set('d', self.result)
+        self.assertEqual(self.controlCache.get('b'), None)
+        for key in 'acd':
+            self.assertNotEqual(self.controlCache.get(key), None)
+
+    def test_persists(self):
+        self.controlCache.set('a', self.result)
+        self.controlCache.set('b', self.result)
+        self.clock.advance(self.controlCache.saveInterval)
+        self.clock.advance(10)
+        cache = self.cache()
+        self.assertEqual(cache.get('a'), (self.result, 10 +
+                                          self.controlCache.saveInterval))
+
+    def test_expired_entries_are_not_loaded(self):
+        self.controlCache.set('a', self.result)
+        self.controlCache.save()
+        self.clock.advance(60)
+        self.assertEqual(len(self.cache().entries), 0)
+
+    def test_unwritable_cache_warns_once(self):
+        warnings = []
+        self.patch(controlcache.log, 'err', warnings.append)
+        self.cachePath = os.path.join(self.mktemp(), 'controls.json')
+        control_cache = self.cache()
+        control_cache.set('a', self.result)
+        control_cache.save()
+        control_cache.save()
+        self.assertEqual(len(warnings), 1)
@@ -0,0 +1,63 @@
+from twisted.trial import unittest
+
+from ooni.utils.dedup import BloomFilter, InputDeduplicator
+from ooni.utils.dedup import normalizeURL, normalizeHost, normalizeExact
+
+class TestBloomFilter(unittest.TestCase):
+    def test_no_false_negatives(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom_filter.add(str(i))
+        for i in range(1000):
+            self.assertIn(str(i), bloom_filter)
+            self.assertTrue(bloom_filter.add(str(i)))
+
+    def test_false_positive_rate(self):
+        bloom_filter = BloomFilter(10000, 0.01)
+        for i in range(10000):
+            bloom_filter.add('in-%d' % i)
+        false_positives = sum(1 for i in range(10000)
+                              if 'out-%d' % i in bloom_filter)
+        self.assertTrue(false_positives < 200)
+
+class TestInputDeduplicator(unittest.TestCase):
+    def test_exact(self):
+        deduplicator = InputDeduplicator()
+        inputs = ['a', 'b', ' a ', 'c', 'b']
+        self.assertEqual(list(deduplicator.filter(inputs)), ['a', 'b', 'c'])
+        self.assertEqual(deduplicator.duplicates, 2)
+        self.assertIsInstance(deduplicator.seen, set)
+
+    def test_switch_to_bloom_filter(self):
+        deduplicator = InputDeduplicator(expected_inputs=100)
+        deduplicator.exactLimit = 10
+        inputs = [str(i) for i in range(50)] * 2
+        self.assertEqual(list(deduplicator.filter(inputs)),
+                         [str(i) for i in range(50)])
+        self.assertEqual(deduplicator.duplicates, 50)
+        self.assertIsInstance(deduplicator.seen, BloomFilter)
+
+    def test_normalize(self):
+        deduplicator = InputDeduplicator(normalizeURL)
+        inputs = ['http://Example.com', 'http://example.com:80/',
+                  'http://example.com/#top', 'https://example.com/']
+        self.assertEqual(list(deduplicator.filter(inputs)),
+                         ['http://Example.com', 'https://example.com/'])
+
+class TestNormalizers(unittest.TestCase):
+    def test_normalize_exact(self):
+        self.assertEqual(normalizeExact(' a\n'), 'a')
+        self.assertEqual(normalizeExact(None), None)
+
+    def test_normalize_url(self):
+        self.assertEqual(normalizeURL('HTTP://Example.COM:80'),
+                         'http://example.com/')
+        self.assertEqual(normalizeURL('https://example.com:443/a?b=c#d'),
+                         'https://example.com/a?b=c')
+        self.assertEqual(normalizeURL('http://example.com:8080/'),
+                         'http://example.com:8080/')
+
+    def test_normalize_host(self):
+        self.assertEqual(normalizeHost('http://Example.com/foo'),
+                         'example.com')
+        self.assertEqual(normalizeHost('example.com'), 'example.com')
@@ -0,0 +1,101 @@
+from twisted.internet import defer, task
+from twisted.internet.defer import inlineCallbacks
+from twisted.names import dns
+from twisted.trial import unittest
+
+from ooni.utils import dnscache
+from ooni.utils.dnscache import CachingResolver
+from ooni.nettest import NetTestCase
+
+class MockNamesResolver(object):
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.lookups = []
+
+    def lookupAddress(self, name, timeout=None):
+        d = defer.Deferred()
+        self.lookups.append((name, d))
+        return d
+
+    def answer(self, index=0, address='10.0.0.1'):
+        name, d = self.lookups[index]
+        record = dns.RRHeader(name, dns.A, ttl=self.ttl,
+                              payload=dns.Record_A(address, self.ttl))
+        d.callback(([record], [], []))
+
+class MockSystemResolver(object):
+    def __init__(self):
+        self.lookups = []
+
+    def getHostByName(self, name, timeout=None):
+        self.lookups.append(name)
+        return defer.succeed('10.0.0.2')
+
+class TestCachingResolver(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.namesResolver = MockNamesResolver()
+        self.systemResolver = MockSystemResolver()
+        self.resolver = CachingResolver(self.systemResolver,
+                                        resolver=self.namesResolver,
+                                        clock=self.clock)
+
+    def test_caches_for_ttl(self):
+        d = self.resolver.getHostByName('example.com')
+        self.namesResolver.answer()
+        self.assertEqual(self.successResultOf(d), '10.0.0.1')
+
+        self.clock.advance(59)
+        d = self.resolver.getHostByName('EXAMPLE.com')
+        self.assertEqual(self.successResultOf(d), '10.0.0.1')
+        self.assertEqual(len(self.namesResolver.lookups), 1)
+        self.assertEqual((self.resolver.hits, self.resolver.misses), (1, 1))
+
+        self.clock.advance(1)
+        self.resolver.getHostByName('example.com')
+        self.assertEqual(len(self.namesResolver.lookups), 2)
+
+    def test_concurrent_lookups_are_coalesced(self):
+        d1 = self.resolver.getHostByName('example.com')
+        d2 = self.resolver.getHostByName('example.com')
+        self.assertEqual(len(self.namesResolver.lookups), 1)
+        self.namesResolver.answer()
+        self.assertEqual(self.successResultOf(d1), '10.0.0.1')
+        self.assertEqual(self.successResultOf(d2), '10.0.0.1')
+        self.assertEqual(self.resolver.coalesced, 1)
+
+    def test_zero_ttl_is_not_cached(self):
+        self.namesResolver.ttl = 0
+        self.resolver.getHostByName('example.com')
+        self.namesResolver.answer()
+        self.resolver.getHostByName('example.com')
+        self.assertEqual(len(self.namesResolver.lookups), 2)
+
+    def test_falls_back_to_system_resolver(self):
+        d = self.resolver.getHostByName('example.com')
+        self.namesResolver.lookups[0][1].errback(Exception("timeout"))
+        self.assertEqual(self.successResultOf(d), '10.0.0.2')
+        self.assertEqual(self.resolver.cache, {})
+
+    def test_bypass(self):
+        self.patch(dnscache, '_cachingResolver', self.resolver)
+        started = defer.Deferred()
+
+        class DNSTestCase(NetTestCase):
+            bypassDNSCache = True
+
+            @inlineCallbacks
+            def test_lookup(self):
+                yield started
+                address = yield self.getHostByName('example.com')
+                defer.returnValue(address)
+
+        d = DNSTestCase().test_lookup()
+        started.callback(None)
+        self.assertEqual(self.successResultOf(d), '10.0.0.2')
+        self.assertEqual(self.namesResolver.lookups, [])
+
+        class MockReactor(object):
+            resolver = self.resolver
+        self.assertIdentical(dnscache.getResolver(reactor=MockReactor),
+                             self.resolver)
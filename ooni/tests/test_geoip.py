@@ -0,0 +1,94 @@
+from twisted.trial import unittest
+
+from ooni import geoip
+from ooni.settings import config
+
+class MockGeoIP(object):
+    def __init__(self):
+        self.lookups = 0
+
+    def record_by_addr(self, ipaddr):
+        self.lookups += 1
+        if ipaddr.startswith('10.'):
+            return None
+        return {'city': 'Rome'}
+
+    def country_code_by_addr(self, ipaddr):
+        self.lookups += 1
+        if ipaddr.startswith('10.'):
+            return ''
+        return 'IT'
+
+    def org_by_addr(self, ipaddr):
+        self.lookups += 1
+        if ipaddr == 'invalid':
+            raise ValueError("Invalid IP address")
+        if ipaddr.startswith('10.'):
+            return None
+        return 'AS1234 Some ISP'
+
+class TestGeoIPDatabases(unittest.TestCase):
+    def setUp(self):
+        self.database = MockGeoIP()
+        self.geoIP = geoip.GeoIPDatabases(self.mktemp())
+        for name in geoip.GeoIPDatabases.databaseFiles:
+            self.geoIP._databases[name] = self.database
+
+    def test_lookup(self):
+        self.assertEqual(self.geoIP.lookup('8.8.8.8'),
+                         {'city': 'Rome', 'countrycode': 'IT',
+                          'asn': 'AS1234'})
+        self.assertEqual(self.geoIP.lookup('10.0.0.1'),
+                         {'city': None, 'countrycode': None, 'asn': None})
+
+    def test_lookup_many(self):
+        locations = self.geoIP.lookup_many(['8.8.8.8', '10.0.0.1', '8.8.8.8'],
+                                           fields=('asn',))
+        self.assertEqual(locations, {'8.8.8.8': {'asn': 'AS1234'},
+                                     '10.0.0.1': {'asn': None}})
+        self.assertEqual(self.database.lookups, 2)
+
+    def test_lookup_many_failure(self):
+        self.patch(geoip.log, 'err', lambda message: None)
+        locations = self.geoIP.lookup_many(['invalid', '8.8.8.8'],
+                                           fields=('asn',))
+        self.assertEqual(locations, {'invalid': {'asn': None},
+                                     '8.8.8.8': {'asn': 'AS1234'}})
+
+    def test_missing_data_files(self):
+        geo_ip = geoip.GeoIPDatabases(self.mktemp())
+        self.assertRaises(geoip.GeoIPDataFilesNotFound, geo_ip.lookup,
+                          '8.8.8.8')
+
+    def test_annotate_addresses(self):
+        self.patch(geoip, 'getGeoIP', lambda: self.geoIP)
+        self.patch(config.privacy, 'includeasn', True)
+        self.patch(config.privacy, 'includecountry', False)
+        hops = [{'address': '8.8.8.8'}, {'address': '10.0.0.1'}]
+        geoip.annotateAddresses(hops)
+        self.assertEqual(hops, [{'address': '8.8.8.8', 'asn': 'AS1234'},
+                                {'address': '10.0.0.1', 'asn': None}])
+
+    def test_annotate_addresses_lookup_failure(self):
+        self.patch(geoip, 'getGeoIP', lambda: self.geoIP)
+        self.patch(geoip.log, 'err', lambda message: None)
+        self.patch(config.privacy, 'includeasn', True)
+        self.patch(config.privacy, 'includecountry', False)
+        hops = [{'address': 'invalid'}, {'address': '8.8.8.8'}]
+        geoip.annotateAddresses(hops)
+        self.assertEqual(hops, [{'address': 'invalid', 'asn': None},
+                                {'address': '8.8.8.8', 'asn': 'AS1234'}])
+
+    def test_annotate_addresses_without_geoip(self):
+        self.patch(geoip, 'GeoIP', None)
+        self.patch(config.privacy, 'includeasn', True)
+        self.patch(config.privacy, 'includecountry', True)
+        hops = [{'address': '8.8.8.8'}]
+        geoip.annotateAddresses(hops)
+        self.assertEqual(hops, [{'address': '8.8.8.8', 'asn': None,
+                                 'countrycode': None}])
+
+    def test_lookup_without_geoip(self):
+        self.patch(geoip, 'GeoIP', None)
+        geo_ip = geoip.GeoIPDatabases(self.mktemp())
+        self.assertRaises(geoip.GeoIPNotAvailable, geo_ip.lookup, '8.8.8.8')
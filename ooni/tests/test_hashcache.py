@@ -0,0 +1,56 @@
+import os
+from hashlib import sha256
+
+from twisted.trial import unittest
+
+from ooni.utils import hashcache
+from ooni.utils.hashcache import HashCache, sha256File
+
+class TestHashCache(unittest.TestCase):
+    def setUp(self):
+        self.filename = self.mktemp()
+        with open(self.filename, 'w') as f:
+            f.write('http://example.com/\n' * 1000)
+        self.digest = sha256('http://example.com/\n' * 1000).hexdigest()
+        self.cachePath = self.mktemp()
+        self.hashCache = HashCache(self.cachePath)
+
+    def test_sha256_file(self):
+        self.assertEqual(sha256File(self.filename, chunk_size=7), self.digest)
+
+    def test_hash_is_cached(self):
+        self.assertEqual(self.hashCache.get(self.filename), None)
+        self.assertEqual(self.hashCache.hash(self.filename), self.digest)
+        self.assertEqual(self.hashCache.get(self.filename), self.digest)
+
+        # The cache persists across instances
+        self.assertEqual(HashCache(self.cachePath).get(self.filename),
+                         self.digest)
+
+    def test_modified_file_is_rehashed(self):
+        self.hashCache.hash(self.filename)
+        with open(self.filename, 'a') as f:
+            f.write('http://example.org/\n')
+        os.utime(self.filename, (0, 0))
+        self.assertEqual(self.hashCache.get(self.filename), None)
+        self.assertNotEqual(self.hashCache.hash(self.filename), self.digest)
+
+    def test_corrupted_cache(self):
+        with open(self.cachePath, 'w') as f:
+            f.write('{')
+        self.assertEqual(self.hashCache.hash(self.filename), self.digest)
+
+    def test_unwritable_cache_warns_once(self):
+        warnings = []
+        self.patch(hashcache.log, 'err', warnings.append)
+        hash_cache = HashCache(os.path.join(self.mktemp(), 'hashes.json'))
+        self.assertEqual(hash_cache.hash(self.filename), self.digest)
+        hash_cache.save()
+        self.assertEqual(len(warnings), 1)
+
+    def test_hash_in_threads(self):
+        d = self.hashCache.hashInThreads([self.filename, self.filename])
+        @d.addCallback
+        def cb(_):
+            self.assertEqual(self.hashCache.get(self.filename), self.digest)
+        return d
@@ -0,0 +1,102 @@
+import os
+
+from twisted.trial import unittest
+from twisted.internet import task
+
+from ooni.journal import Journal, findResumableReport, journalPath
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.path = self.mktemp()
+        self.clock = task.Clock()
+        self.syncs = []
+        self.journal = self.createJournal()
+
+    def createJournal(self):
+        return Journal(self.path, before_sync=lambda: self.syncs.append(1),
+                       clock=self.clock)
+
+    def test_record_and_load(self):
+        self.journal.record('TestCase', 0, 'http://a/', ['test_a', 'test_b'])
+        self.journal.record('TestCase', 2, 'http://c/', ['test_a', 'test_b'])
+        self.journal.close()
+
+        journal = self.createJournal()
+        journal.load()
+        self.assertTrue(journal.isDone('TestCase', 0, 'http://a/'))
+        self.assertFalse(journal.isDone('TestCase', 1, 'http://b/'))
+        self.assertTrue(journal.isDone('TestCase', 2, 'http://c/'))
+        self.assertFalse(journal.isDone('OtherTestCase', 0, 'http://a/'))
+
+    def test_changed_input_is_not_done(self):
+        self.journal.record('TestCase', 0, 'http://a/', ['test_a'])
+        self.journal.close()
+
+        journal = self.createJournal()
+        journal.load()
+        self.assertFalse(journal.isDone('TestCase', 0, 'http://b/'))
+
+    def test_truncated_line_is_ignored(self):
+        self.journal.record('TestCase', 0, 'http://a/', ['test_a'])
+        self.journal.close()
+        with open(self.path, 'a') as f:
+            f.write('TestCase 1 ab')
+
+        journal = self.createJournal()
+        journal.load()
+        self.assertTrue(journal.isDone('TestCase', 0, 'http://a/'))
+        self.assertEqual(len(journal.done['TestCase']), 1)
+
+    def test_batched_sync(self):
+        self.journal.syncEntries = 3
+        self.journal.record('TestCase', 0, 'a', ['test_a'])
+        self.journal.record('TestCase', 1, 'b', ['test_a'])
+        self.assertEqual(self.syncs, [])
+        self.journal.record('TestCase', 2, 'c', ['test_a'])
+        self.assertEqual(self.syncs, [1])
+
+        self.journal.record('TestCase', 3, 'd', ['test_a'])
+        self.clock.advance(self.journal.syncInterval)
+        self.assertEqual(self.syncs, [1, 1])
+        self.journal.close()
+        # Nothing left to sync
+        self.assertEqual(self.syncs, [1, 1])
+
+    def test_find_resumable_report(self):
+        destination = self.mktemp()
+        os.mkdir(destination)
+        for name in ('report-foo-2014-01-01T000000Z.yamloo',
+                     'report-foo-2014-01-02T000000Z.yamloo'):
+            open(os.path.join(destination, name), 'w').close()
+        self.assertEqual(findResumableReport('foo', destination), None)
+
+        report_path = os.path.join(destination,
+                                   'report-foo-2014-01-01T000000Z.yamloo')
+        open(journalPath(report_path), 'w').close()
+        self.assertEqual(findResumableReport('foo', destination),
+                         'report-foo-2014-01-01T000000Z.yamloo')
+
+    def test_lines_are_written_after_before_sync(self):
+        def before_sync():
+            self.assertFalse(os.path.exists(self.path) and
+                             open(self.path).read())
+            self.syncs.append(1)
+        self.journal.beforeSync = before_sync
+        self.journal.record('TestCase', 0, 'a', ['test_a'])
+        self.assertFalse(os.path.exists(self.path))
+        self.journal.sync()
+        self.assertEqual(self.syncs, [1])
+        with open(self.path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+    def test_find_resumable_jsonl_report(self):
+        destination = self.mktemp()
+        os.mkdir(destination)
+        report_path = os.path.join(destination,
+                                   'report-foo-2014-01-01T000000Z.jsonl')
+        open(report_path, 'w').close()
+        open(journalPath(report_path), 'w').close()
+        self.assertEqual(findResumableReport('foo', destination), None)
+        self.assertEqual(findResumableReport('foo', destination,
+                                             extension='jsonl'),
+                         'report-foo-2014-01-01T000000Z.jsonl')
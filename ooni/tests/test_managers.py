@@ -5,7 +5,9 @@ from twisted.python import failure
 from twisted.internet import defer, task
 
 from ooni.tasks import BaseTask, TaskWithTimeout, TaskTimedOut
-from ooni.managers import TaskManager, MeasurementManager
+from ooni.managers import TaskManager, MeasurementManager, RetryPolicy
+from ooni.managers import LinkedTaskManager, ReportEntryManager
+from ooni.ratelimiting import TimeoutRateLimiter, DestinationRateLimiter
 
 from ooni.tests.mocks import MockSuccessTask, MockFailTask, MockFailOnceTask, MockFailure
 from ooni.tests.mocks import MockSuccessTaskWithTimeout, MockFailTaskThatTimesOut
@@ -104,6 +106,26 @@ class TestTaskManager(unittest.TestCase):
 
         return mock_task.done
 
+    def test_schedule_failing_tasks_that_timesout_on_timing_wheel(self):
+        self.measurementManager.retries = 0
+
+        mock_task = MockFailTaskThatTimesOut()
+        mock_task.timeout = 5
+        mock_task.clock = self.clock
+        mock_task.useTimingWheel = True
+
+        self.measurementManager.schedule(mock_task)
+
+        self.clock.advance(4.9)
+        self.assertFalse(mock_task.done.called)
+        self.clock.advance(0.1)
+
+        @mock_task.done.addBoth
+        def done(res):
+            self.assertEqual(self.measurementManager.failures, 1)
+
+        return mock_task.done
+
     def test_schedule_time_out_once(self):
         task_type = MockTimeoutOnceTask
         task_timeout = 5
@@ -148,6 +170,25 @@ class TestTaskManager(unittest.TestCase):
     def test_schedule_failing_27_tasks(self):
         return self.schedule_failing_tasks(MockFailTask, number=27)
 
+    def test_schedule_many_synchronous_tasks(self):
+        # Scheduling the tasks one by one must neither nest the task queue
+        # nor recurse once per task.
+        return self.schedule_successful_tasks(MockSuccessTask, number=5000)
+
+    def test_retry_many_synchronous_tasks(self):
+        all_done = []
+        for x in range(2000):
+            mock_task = MockFailOnceTask()
+            all_done.append(mock_task.done)
+            self.measurementManager.schedule(mock_task)
+
+        d = defer.DeferredList(all_done)
+        @d.addCallback
+        def done(res):
+            self.assertEqual(self.measurementManager.failures, 2000)
+            self.assertEqual(len(self.measurementManager.successes), 2000)
+        return d
+
     def test_task_retry_and_succeed(self):
         mock_task = MockFailOnceTask()
         self.measurementManager.schedule(mock_task)
@@ -226,3 +267,216 @@ class TestMeasurementManager(unittest.TestCase):
             self.assertEqual(len(self.mockNetTest.successes), 0)
 
         return mock_task.done
+
+class TestTaskManagerWithRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.measurementManager = MockTaskManager()
+        self.measurementManager.rateLimiter = TimeoutRateLimiter(
+            concurrency=2, max_concurrency=4, window=4)
+        self.measurementManager.retries = 0
+        self.measurementManager.start()
+
+    def test_available_slots_from_rate_limiter(self):
+        self.assertEqual(self.measurementManager.availableSlots, 2)
+        self.measurementManager.rateLimiter._concurrency = 3
+        self.assertEqual(self.measurementManager.availableSlots, 3)
+
+    def test_timeouts_decrease_concurrency(self):
+        clock = task.Clock()
+        all_done = []
+        for _ in range(2):
+            mock_task = MockFailTaskThatTimesOut()
+            mock_task.clock = clock
+            mock_task.done.addErrback(lambda x: None)
+            all_done.append(mock_task.done)
+            self.measurementManager.schedule(mock_task)
+        clock.advance(mock_task.timeout)
+
+        d = defer.DeferredList(all_done)
+        @d.addCallback
+        def done(res):
+            self.assertEqual(self.measurementManager.rateLimiter.concurrency, 1)
+        return d
+
+class TestRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        self.retryPolicy = RetryPolicy(base_delay=1, multiplier=2,
+                                       max_delay=5, jitter=0)
+
+    def test_exponential_delay(self):
+        mock_task = MockFailTask()
+        delays = []
+        for failures in range(1, 6):
+            mock_task.failures = failures
+            delays.append(self.retryPolicy.delay(mock_task))
+        self.assertEqual(delays, [1, 2, 4, 5, 5])
+
+    def test_jitter(self):
+        self.retryPolicy.jitter = 0.5
+        mock_task = MockFailTask()
+        mock_task.failures = 3
+        for _ in range(100):
+            delay = self.retryPolicy.delay(mock_task)
+            self.assertTrue(2 <= delay <= 4)
+
+    def test_no_base_delay(self):
+        self.retryPolicy.baseDelay = 0
+        mock_task = MockFailTask()
+        mock_task.failures = 3
+        self.assertEqual(self.retryPolicy.delay(mock_task), 0)
+
+class TestTaskManagerWithRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.measurementManager = MockTaskManager()
+        self.measurementManager.clock = self.clock
+        self.measurementManager.retryPolicy = RetryPolicy(base_delay=1,
+                multiplier=2, max_delay=60, jitter=0)
+        self.measurementManager.retries = 2
+        self.measurementManager.start()
+
+    def test_retry_is_delayed(self):
+        mock_task = MockFailOnceTask()
+        self.measurementManager.schedule(mock_task)
+
+        self.assertEqual(self.measurementManager.failures, 1)
+        self.assertFalse(mock_task.done.called)
+        self.assertEqual(self.measurementManager.successes, [])
+
+        self.clock.advance(1)
+        self.assertTrue(mock_task.done.called)
+        self.assertEqual(self.measurementManager.successes, [(42, mock_task)])
+        return mock_task.done
+
+    def test_permanent_failure_after_backoff(self):
+        mock_task = MockFailTask()
+        self.measurementManager.schedule(mock_task)
+        self.assertFailure(mock_task.done, MockFailure)
+
+        self.clock.advance(1)
+        self.assertEqual(self.measurementManager.failures, 2)
+        self.assertFalse(mock_task.done.called)
+
+        self.clock.advance(2)
+        self.assertEqual(self.measurementManager.failures, 3)
+        self.assertTrue(mock_task.done.called)
+        return mock_task.done
+
+    def test_delayed_task_does_not_hold_a_slot(self):
+        self.measurementManager.concurrency = 1
+        failing_task = MockFailOnceTask()
+        self.measurementManager.schedule(failing_task)
+        other_task = MockSuccessTask()
+        self.measurementManager.schedule(other_task)
+        self.assertTrue(other_task.done.called)
+        self.clock.advance(1)
+        return defer.DeferredList([failing_task.done, other_task.done])
+
+class MockKeyedTask(MockSuccessTask):
+    def __init__(self, destination_key):
+        MockSuccessTask.__init__(self)
+        self.destinationKey = destination_key
+
+class TestTaskManagerWithDestinationRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.measurementManager = MockTaskManager()
+        self.measurementManager.clock = self.clock
+        self.measurementManager.destinationRateLimiter = \
+                DestinationRateLimiter(rate=1, burst=1, clock=self.clock)
+        self.measurementManager.start()
+
+    def test_throttled_destination_does_not_block_others(self):
+        tasks = [MockKeyedTask('a'), MockKeyedTask('a'), MockKeyedTask('a'),
+                 MockKeyedTask('b'), MockKeyedTask(None)]
+        self.measurementManager.schedule(tasks)
+
+        self.assertEqual([t.done.called for t in tasks],
+                         [True, False, False, True, True])
+        self.clock.advance(1)
+        self.assertEqual([t.done.called for t in tasks],
+                         [True, True, False, True, True])
+        self.clock.advance(1)
+        self.assertTrue(all(t.done.called for t in tasks))
+        return defer.DeferredList([t.done for t in tasks])
+
+    def test_max_throttled_tasks(self):
+        self.measurementManager.maxThrottledTasks = 2
+        tasks = [MockKeyedTask('a') for _ in range(4)] + [MockKeyedTask('b')]
+        self.measurementManager.schedule(tasks)
+        # We stop looking ahead once 2 tasks for a have been put aside
+        self.assertFalse(tasks[-1].done.called)
+        for _ in range(3):
+            self.clock.advance(1)
+        self.assertTrue(all(t.done.called for t in tasks))
+        return defer.DeferredList([t.done for t in tasks])
+
+class TestTaskManagerRoundRobin(unittest.TestCase):
+    def setUp(self):
+        self.measurementManager = MockTaskManager()
+        # Hold the tasks back until everything has been scheduled
+        self.measurementManager.concurrency = 0
+
+    def run_tasks(self):
+        self.measurementManager.concurrency = 1
+        self.measurementManager._fillSlots()
+        return [task.destinationKey
+                for _, task in self.measurementManager.successes]
+
+    def test_round_robin(self):
+        self.measurementManager.schedule([MockKeyedTask('a') for _ in range(4)])
+        self.measurementManager.schedule([MockKeyedTask('b') for _ in range(2)])
+        self.assertEqual(self.run_tasks(),
+                         ['a', 'b', 'a', 'b', 'a', 'a'])
+
+    def test_weights(self):
+        self.measurementManager.schedule([MockKeyedTask('a') for _ in range(6)],
+                                         weight=2)
+        self.measurementManager.schedule([MockKeyedTask('b') for _ in range(3)])
+        self.measurementManager.schedule([MockKeyedTask('c') for _ in range(2)],
+                                         weight=0.5)
+        self.assertEqual(self.run_tasks(),
+                         ['a', 'a', 'b', 'a', 'a', 'b', 'c',
+                          'a', 'a', 'b', 'c'])
+
+    def test_invalid_weight(self):
+        self.assertRaises(ValueError, self.measurementManager.schedule,
+                          MockSuccessTask(), 0)
+
+class MockLinkedTaskManager(LinkedTaskManager):
+    def failed(self, failure, task):
+        pass
+
+    def succeeded(self, result, task):
+        pass
+
+class TestReportBacklog(unittest.TestCase):
+    def setUp(self):
+        self.measurementManager = MockLinkedTaskManager()
+        self.reportEntryManager = ReportEntryManager()
+        self.reportEntryManager.maxBacklogEntries = 2
+        self.reportEntryManager.maxBacklogBytes = 100
+        self.measurementManager.child = self.reportEntryManager
+        self.reportEntryManager.parent = self.measurementManager
+
+    def test_pause_on_entries(self):
+        self.reportEntryManager.entryQueued(1)
+        self.reportEntryManager.entryQueued(1)
+        self.assertTrue(self.reportEntryManager.backlogFull)
+        self.assertEqual(self.measurementManager.availableSlots, 0)
+
+        mock_task = MockSuccessTask()
+        self.measurementManager.schedule(mock_task)
+        self.assertFalse(mock_task.done.called)
+
+        self.reportEntryManager.entryDone(1)
+        self.assertFalse(self.reportEntryManager.backlogFull)
+        self.assertTrue(mock_task.done.called)
+        return mock_task.done
+
+    def test_pause_on_bytes(self):
+        self.reportEntryManager.entryQueued(150)
+        self.assertTrue(self.reportEntryManager.backlogFull)
+        self.assertEqual(self.measurementManager.availableSlots, 0)
+        self.reportEntryManager.entryDone(150)
+        self.assertEqual(self.measurementManager.availableSlots, 10)
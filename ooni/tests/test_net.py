@@ -0,0 +1,90 @@
+from hashlib import sha256
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from ooni.utils.net import BodyReceiver, Simhash, simhashDistance
+
+class TestBodyReceiver(unittest.TestCase):
+    def receive(self, chunks, **kw):
+        finished = defer.Deferred()
+        receiver = BodyReceiver(finished, **kw)
+        for chunk in chunks:
+            receiver.dataReceived(chunk)
+        receiver.connectionLost(None)
+        return receiver, self.successResultOf(finished)
+
+    def test_collects_body(self):
+        receiver, body = self.receive(['foo', 'bar', 'baz'])
+        self.assertEqual(body, 'foobarbaz')
+        self.assertEqual(receiver.length, 9)
+        self.assertFalse(receiver.truncated)
+
+    def test_body_processor(self):
+        receiver, body = self.receive(['foo', 'bar'],
+                                      body_processor=lambda s: s.upper())
+        self.assertEqual(body, 'FOOBAR')
+
+    def test_truncates_body(self):
+        receiver, body = self.receive(['foo', 'bar', 'baz'], max_size=4)
+        self.assertEqual(body, 'foob')
+        self.assertTrue(receiver.truncated)
+        self.assertEqual(receiver.length, 9)
+
+    def test_body_of_max_size_is_not_truncated(self):
+        receiver, body = self.receive(['foo', 'bar'], max_size=6)
+        self.assertEqual(body, 'foobar')
+        self.assertFalse(receiver.truncated)
+
+    def test_digests_of_truncated_body(self):
+        chunks = ['hello wor', 'ld, this is ', 'a test']
+        receiver, body = self.receive(chunks, max_size=5, digests=True)
+        digests = receiver.digests()
+        self.assertEqual(digests['length'], len(''.join(chunks)))
+        self.assertEqual(digests['sha256'],
+                         sha256(''.join(chunks)).hexdigest())
+        simhash = Simhash()
+        simhash.update(''.join(chunks))
+        self.assertEqual(digests['simhash'], simhash.hexdigest())
+
+    def test_no_digests(self):
+        receiver, body = self.receive(['foo'])
+        self.assertEqual(receiver.digests(), {'length': 3, 'sha256': None,
+                                              'simhash': None})
+
+class TestSimhash(unittest.TestCase):
+    def simhash(self, *chunks):
+        simhash = Simhash()
+        for chunk in chunks:
+            simhash.update(chunk)
+        return simhash.digest()
+
+    def test_chunking_does_not_matter(self):
+        text = 'the quick brown fox jumps over the lazy dog'
+        self.assertEqual(self.simhash(text),
+                         self.simhash(text[:7], text[7:20], text[20:]))
+
+    def test_similar_texts_have_close_hashes(self):
+        words = ['word%d' % i for i in range(200)]
+        a = self.simhash(' '.join(words))
+        b = self.simhash(' '.join(words[:-1] + ['other']))
+        c = self.simhash(' '.join('other%d' % i for i in range(200)))
+        distance = lambda x, y: bin(x ^ y).count('1')
+        self.assertTrue(distance(a, b) < distance(a, c))
+
+    def test_empty(self):
+        self.assertEqual(self.simhash(''), 0)
+
+    def test_long_word(self):
+        text = 'a' * (4 * 1024 * 1024)
+        simhash = Simhash()
+        for i in range(0, len(text), 1000):
+            simhash.update(text[i:i + 1000])
+        self.assertTrue(len(simhash._tail) <= Simhash.maxWordLength)
+        self.assertEqual(simhash.digest(), self.simhash(text))
+
+    def test_distance(self):
+        self.assertEqual(simhashDistance('00000000000000ff',
+                                         '00000000000000ff'), 0)
+        self.assertEqual(simhashDistance('00000000000000ff',
+                                         '000000000000000f'), 4)
@@ -0,0 +1,98 @@
+import copy
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from ooni.nettest import NetTest, NetTestCase, TestDetails
+from ooni.reporter import safe_dump
+from ooni.settings import config
+
+class MockNetTestLoader(object):
+    shard = None
+    journal = None
+
+    def __init__(self, test_cases):
+        self.testCases = test_cases
+
+    def setupTestDetails(self):
+        return {}
+
+class DummyTestCase(NetTestCase):
+    inputs = ['a', 'b', 'c']
+    setUpClassCalls = 0
+
+    @classmethod
+    def setUpClass(cls):
+        cls.setUpClassCalls += 1
+        d = defer.Deferred()
+        d.callback(['shared'])
+        d.addCallback(lambda resources: setattr(cls, 'resources', resources))
+        return d
+
+    def test_a(self):
+        return self.resources
+
+class TestSetUpClass(unittest.TestCase):
+    @defer.inlineCallbacks
+    def test_set_up_class_runs_once(self):
+        net_test = NetTest(MockNetTestLoader([(DummyTestCase, ['test_a'])]),
+                           None)
+        yield net_test.initializeInputProcessor()
+        measurements = list(net_test.generateMeasurements())
+        self.assertEqual(len(measurements), 3)
+        self.assertEqual(DummyTestCase.setUpClassCalls, 1)
+        for measurement in measurements:
+            self.assertIs(measurement.testInstance.resources,
+                          DummyTestCase.resources)
+
+class FileInputTestCase(NetTestCase):
+    inputFile = ['file', 'f', None, 'The input file']
+    inputFileSpecified = True
+
+    def test_a(self):
+        pass
+
+class MockReport(object):
+    def __init__(self):
+        self.entries = []
+
+    def write(self, entry):
+        self.entries.append(entry)
+        return defer.succeed(None)
+
+class TestInputDedup(unittest.TestCase):
+    def setUp(self):
+        self.patch(config.advanced, 'input_dedup', True)
+        self.inputFile = self.mktemp()
+        with open(self.inputFile, 'w') as f:
+            f.write('a\nb\na\na\n')
+        self.patch(FileInputTestCase, 'localOptions',
+                   {'file': self.inputFile})
+
+    @defer.inlineCallbacks
+    def test_duplicates_in_file_input(self):
+        report = MockReport()
+        net_test = NetTest(MockNetTestLoader([(FileInputTestCase,
+                                               ['test_a'])]), report)
+        yield net_test.initializeInputProcessor()
+        measurements = list(net_test.generateMeasurements())
+        self.assertEqual([m.testInstance.input for m in measurements],
+                         ['a', 'b'])
+        self.assertEqual(net_test.duplicateInputs, 2)
+
+        yield net_test.writeTestSummary()
+        self.assertEqual(report.entries,
+                         [{'test_summary': {'duplicate_inputs': 2}}])
+
+class TestTestDetails(unittest.TestCase):
+    def test_frozen(self):
+        test_details = TestDetails({'test_name': 'foo'})
+        self.assertRaises(TypeError, test_details.__setitem__, 'a', 1)
+        self.assertRaises(TypeError, test_details.update, {'a': 1})
+        self.assertRaises(TypeError, test_details.pop, 'test_name')
+        self.assertEqual(test_details, {'test_name': 'foo'})
+        self.assertEqual(copy.deepcopy(test_details), test_details)
+
+    def test_serialized_like_a_dict(self):
+        test_details = TestDetails({'test_name': 'foo', 'input_hashes': []})
+        self.assertEqual(safe_dump(test_details), safe_dump(dict(test_details)))
@@ -0,0 +1,155 @@
+from twisted.trial import unittest
+from twisted.python import failure
+from twisted.internet import defer, task
+
+from ooni.tasks import TaskTimedOut
+from ooni.ratelimiting import TimeoutRateLimiter, BandwidthRateLimiter
+from ooni.ratelimiting import isTimeout
+from ooni.ratelimiting import TokenBucket, DestinationRateLimiter
+from ooni.ratelimiting import hostKey, resolverKey, subnetKey
+
+class MockMeasurement(object):
+    def __init__(self, runtime=0.1):
+        self.runtime = runtime
+
+class TestTimeoutRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.rateLimiter = TimeoutRateLimiter(concurrency=10,
+                                              max_concurrency=20,
+                                              timeout=10, window=10)
+
+    def test_additive_increase(self):
+        for _ in range(10):
+            self.rateLimiter.completed(MockMeasurement())
+        self.assertEqual(self.rateLimiter.concurrency, 10)
+        for _ in range(10):
+            self.rateLimiter.completed(MockMeasurement())
+        self.assertEqual(self.rateLimiter.concurrency, 11)
+
+    def test_no_increase_when_slow(self):
+        for _ in range(50):
+            self.rateLimiter.completed(MockMeasurement(runtime=8))
+        self.assertEqual(self.rateLimiter.concurrency, 10)
+
+    def test_max_concurrency(self):
+        for _ in range(1000):
+            self.rateLimiter.completed(MockMeasurement())
+        self.assertEqual(self.rateLimiter.concurrency, 20)
+
+    def test_multiplicative_decrease(self):
+        for _ in range(10):
+            self.rateLimiter.completed(MockMeasurement())
+        self.rateLimiter.timedOut(MockMeasurement())
+        self.assertEqual(self.rateLimiter.concurrency, 10)
+        self.rateLimiter.timedOut(MockMeasurement())
+        self.assertEqual(self.rateLimiter.concurrency, 5)
+
+    def test_decrease_once_per_epoch(self):
+        for _ in range(10):
+            self.rateLimiter.completed(MockMeasurement())
+        for _ in range(4):
+            self.rateLimiter.timedOut(MockMeasurement())
+        self.assertEqual(self.rateLimiter.concurrency, 5)
+
+    def test_min_concurrency(self):
+        for _ in range(100):
+            self.rateLimiter.timedOut(MockMeasurement())
+        self.assertEqual(self.rateLimiter.concurrency, 1)
+
+    def test_decrease_on_failure_ratio(self):
+        for _ in range(6):
+            self.rateLimiter.completed(MockMeasurement())
+        for _ in range(4):
+            self.rateLimiter.failed(MockMeasurement(), None)
+        self.assertEqual(self.rateLimiter.concurrency, 5)
+
+    def test_is_timeout(self):
+        self.assertTrue(isTimeout(failure.Failure(defer.CancelledError())))
+        self.assertTrue(isTimeout(failure.Failure(TaskTimedOut())))
+        self.assertFalse(isTimeout(failure.Failure(ValueError())))
+
+class TestBandwidthRateLimiter(unittest.TestCase):
+    def test_backoff_on_latency_inflation(self):
+        rate_limiter = BandwidthRateLimiter(concurrency=10, timeout=100,
+                                            window=10)
+        for _ in range(30):
+            rate_limiter.completed(MockMeasurement(runtime=1))
+        concurrency = rate_limiter.concurrency
+        self.assertTrue(concurrency > 10)
+        for _ in range(10):
+            rate_limiter.completed(MockMeasurement(runtime=10))
+        self.assertTrue(rate_limiter.concurrency < concurrency)
+
+class TestTokenBucket(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.bucket = TokenBucket(rate=2, burst=3, clock=self.clock)
+
+    def test_burst(self):
+        for _ in range(3):
+            self.assertTrue(self.bucket.consume())
+        self.assertFalse(self.bucket.consume())
+
+    def test_refill(self):
+        for _ in range(3):
+            self.bucket.consume()
+        self.assertEqual(self.bucket.wait(), 0.5)
+        self.clock.advance(0.5)
+        self.assertTrue(self.bucket.consume())
+        self.assertFalse(self.bucket.consume())
+
+    def test_never_more_than_burst(self):
+        self.clock.advance(100)
+        for _ in range(3):
+            self.assertTrue(self.bucket.consume())
+        self.assertFalse(self.bucket.consume())
+
+class TestDestinationRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.rateLimiter = DestinationRateLimiter(rate=1, burst=1,
+                                                  clock=self.clock)
+
+    def test_keys_are_independent(self):
+        self.assertTrue(self.rateLimiter.acquire('a'))
+        self.assertFalse(self.rateLimiter.acquire('a'))
+        self.assertTrue(self.rateLimiter.acquire('b'))
+
+    def test_multiple_keys(self):
+        self.assertTrue(self.rateLimiter.acquire('a'))
+        self.assertFalse(self.rateLimiter.acquire(('a', 'b')))
+        # b must not have been consumed
+        self.assertTrue(self.rateLimiter.acquire('b'))
+
+    def test_no_key(self):
+        for _ in range(10):
+            self.assertTrue(self.rateLimiter.acquire(None))
+
+class MockTestInstance(object):
+    def __init__(self, test_input):
+        self.input = test_input
+
+class MockKeyedMeasurement(object):
+    def __init__(self, test_input):
+        self.testInstance = MockTestInstance(test_input)
+
+class TestKeyExtractors(unittest.TestCase):
+    def test_host_key(self):
+        self.assertEqual(hostKey(MockKeyedMeasurement('http://Example.com/a')),
+                         'example.com')
+        self.assertEqual(hostKey(MockKeyedMeasurement('example.com:80')),
+                         'example.com')
+        self.assertEqual(hostKey(MockKeyedMeasurement('example.com')),
+                         'example.com')
+        self.assertEqual(hostKey(MockKeyedMeasurement(None)), None)
+
+    def test_resolver_key(self):
+        measurement = MockKeyedMeasurement('example.com')
+        measurement.testInstance.test_resolvers = ['8.8.8.8']
+        self.assertEqual(resolverKey(measurement), ('8.8.8.8',))
+
+    def test_subnet_key(self):
+        self.assertEqual(subnetKey(MockKeyedMeasurement('10.1.2.3:80')),
+                         '10.1.2.0/24')
+        self.assertEqual(subnetKey(MockKeyedMeasurement('http://a.com/')),
+                         'a.com')
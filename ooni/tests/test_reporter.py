@@ -0,0 +1,430 @@
+import os
+import json
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from ooni.managers import ReportEntryManager
+from ooni.reporter import Report, YAMLReporter, BodyStore, entrySize
+from ooni.reporter import JSONLReporter, readReport, safe_dump, jsonSafe
+from ooni.reporter import loadDocuments
+from ooni.reporter import SerializerPool, plainData, serializeFormats
+
+from ooni.tests.mocks import MockOReporter, MockOReporterThatFailsWrite
+from ooni.utils import log
+
+class MockSlowOReporter(MockOReporter):
+    def __init__(self):
+        MockOReporter.__init__(self)
+        self.written = []
+
+    def writeReportEntry(self, entry):
+        d = defer.Deferred()
+        self.written.append(d)
+        return d
+
+class TestReport(unittest.TestCase):
+    def setUp(self):
+        self.reportEntryManager = ReportEntryManager()
+        self.report = Report([MockOReporter(), MockOReporter()],
+                             self.reportEntryManager)
+
+    def test_entry_size(self):
+        entry = {'input': 'a' * 10, 'requests': [{'body': 'b' * 100}]}
+        self.assertTrue(entrySize(entry) >= 110)
+
+    def test_backlog_accounting(self):
+        entry = {'input': 'a' * 10}
+        d = self.report.write(entry)
+        self.assertEqual(self.reportEntryManager.backlogEntries, 0)
+        self.assertEqual(self.reportEntryManager.backlogBytes, 0)
+        return d
+
+    def test_backlog_until_written(self):
+        reporter = MockSlowOReporter()
+        report = Report([reporter], self.reportEntryManager)
+        d = report.write({'input': 'a' * 10})
+        self.assertEqual(self.reportEntryManager.backlogEntries, 1)
+        self.assertTrue(self.reportEntryManager.backlogBytes >= 10)
+
+        reporter.written[0].callback(None)
+        self.assertEqual(self.reportEntryManager.backlogEntries, 0)
+        self.assertEqual(self.reportEntryManager.backlogBytes, 0)
+        return d
+
+    def assertBacklogEmpty(self):
+        self.assertEqual(self.reportEntryManager.backlogEntries, 0)
+        self.assertEqual(self.reportEntryManager.backlogBytes, 0)
+
+    def test_backlog_when_write_raises(self):
+        self.patch(log, 'err', lambda message: None)
+        report = Report([MockOReporterThatFailsWrite()],
+                        self.reportEntryManager)
+        d = report.write({'input': 'a'})
+        self.assertBacklogEmpty()
+        self.failureResultOf(d)
+
+    def test_backlog_when_serialize_raises(self):
+        self.patch(log, 'err', lambda message: None)
+        self.patch(log, 'exception', lambda failure: None)
+        def serialize(measurement):
+            raise Exception("serialize")
+        self.patch(self.report, 'serialize', serialize)
+        d = self.report.write({'input': 'a'})
+        self.assertBacklogEmpty()
+        self.successResultOf(d)
+
+    def test_backlog_when_write_entries_raises(self):
+        self.patch(log, 'exception', lambda failure: None)
+        def writeEntries(measurement, serialized, all_written):
+            raise Exception("writeEntries")
+        self.patch(self.report, 'writeEntries', writeEntries)
+        d = self.report.write({'input': 'a'})
+        self.assertBacklogEmpty()
+        self.failureResultOf(d)
+
+class TestYAMLReporterResume(unittest.TestCase):
+    def setUp(self):
+        self.destination = self.mktemp()
+        os.mkdir(self.destination)
+        self.testDetails = {'test_name': 'foo', 'test_version': '0.1'}
+
+    def test_resume_appends(self):
+        reporter = YAMLReporter(self.testDetails, self.destination,
+                                report_filename='report.yamloo')
+        reporter.createReport()
+        reporter.writeReportEntry({'input': 'a'})
+        reporter.finish()
+
+        reporter = YAMLReporter(self.testDetails, self.destination,
+                                report_filename='report.yamloo', resume=True)
+        self.assertTrue(reporter.resume)
+        reporter.createReport()
+        reporter.writeReportEntry({'input': 'b'})
+        reporter.sync()
+        reporter.finish()
+
+        with open(os.path.join(self.destination, 'report.yamloo')) as f:
+            content = f.read()
+        self.assertEqual(content.count('# OONI Probe Report'), 1)
+        self.assertEqual(content.count('---\n'), 3)
+
+    def resumeAfterCrash(self, reporter_class, partial_entry):
+        report_filename = 'report.' + reporter_class.reportExtension
+        reporter = reporter_class(self.testDetails, self.destination,
+                                  report_filename=report_filename)
+        reporter.createReport()
+        reporter.writeReportEntry({'input': 'a'})
+        reporter.finish()
+        report_path = os.path.join(self.destination, report_filename)
+        with open(report_path, 'a') as f:
+            f.write(partial_entry)
+
+        reporter = reporter_class(self.testDetails, self.destination,
+                                  report_filename=report_filename, resume=True)
+        self.assertTrue(reporter.resume)
+        reporter.createReport()
+        reporter.writeReportEntry({'input': 'c'})
+        reporter.finish()
+        return list(loadDocuments(report_path))
+
+    def test_resume_truncates_partial_entry(self):
+        documents = self.resumeAfterCrash(YAMLReporter,
+                                          '---\ninput: b\nfoo: [1,\n')
+        self.assertEqual([d['input'] for d in documents[1:]], ['a', 'c'])
+
+    def test_resume_truncates_invalid_entry(self):
+        documents = self.resumeAfterCrash(YAMLReporter,
+                                          '---\ninput: [b\n...\n')
+        self.assertEqual([d['input'] for d in documents[1:]], ['a', 'c'])
+
+    def test_resume_truncates_partial_json_entry(self):
+        documents = self.resumeAfterCrash(JSONLReporter, '{"input": "b"')
+        self.assertEqual([d['input'] for d in documents[1:]], ['a', 'c'])
+
+    def test_resume_without_complete_entry(self):
+        report_path = os.path.join(self.destination, 'report.yamloo')
+        with open(report_path, 'w') as f:
+            f.write('# OONI Probe Report\n---\ntest_name: fo')
+        reporter = YAMLReporter(self.testDetails, self.destination,
+                                report_filename='report.yamloo', resume=True)
+        self.assertFalse(reporter.resume)
+
+class TestBodyDedup(unittest.TestCase):
+    def setUp(self):
+        self.destination = self.mktemp()
+        os.mkdir(self.destination)
+        self.testDetails = {'test_name': 'foo', 'test_version': '0.1'}
+        self.body = 'blocked ' * 100
+
+    def entry(self, test_input, body):
+        return {'input': test_input,
+                'requests': [{'request': {'url': test_input},
+                              'response': {'body': body, 'code': 200}}]}
+
+    def test_body_store(self):
+        body_store = BodyStore()
+        bodies, entry = body_store.extract(self.entry('a', self.body))
+        digest = entry['requests'][0]['response']['body_ref']
+        self.assertEqual(bodies, {'stored_bodies': {digest: self.body}})
+        self.assertNotIn('body', entry['requests'][0]['response'])
+
+        bodies, entry = body_store.extract(self.entry('b', self.body))
+        self.assertEqual(bodies, None)
+        self.assertEqual(entry['requests'][0]['response']['body_ref'], digest)
+
+    def test_short_bodies_are_kept(self):
+        original = self.entry('a', 'short')
+        bodies, entry = BodyStore().extract(original)
+        self.assertEqual(bodies, None)
+        self.assertEqual(entry, original)
+
+    def test_entry_is_not_modified(self):
+        original = self.entry('a', self.body)
+        BodyStore().extract(original)
+        self.assertEqual(original['requests'][0]['response']['body'],
+                         self.body)
+
+    def test_yaml_report_roundtrip(self):
+        reporter = YAMLReporter(self.testDetails, self.destination,
+                                report_filename='report.yamloo')
+        reporter.createReport()
+        report = Report([reporter], ReportEntryManager())
+        report.bodyStore = BodyStore()
+        entries = [self.entry('a', self.body), self.entry('b', 'short'),
+                   self.entry('c', self.body)]
+        d = defer.DeferredList([report.write(entry) for entry in entries])
+
+        @d.addCallback
+        def check(_):
+            reporter.finish()
+            report_path = os.path.join(self.destination, 'report.yamloo')
+            with open(report_path) as f:
+                content = f.read()
+            self.assertEqual(content.count('stored_bodies'), 1)
+            self.assertEqual(content.count('body_ref'), 2)
+            self.assertEqual(list(readReport(report_path)),
+                             [self.testDetails] + entries)
+        return d
+
+    def test_reference_before_body(self):
+        body_store = BodyStore()
+        bodies, first = body_store.extract(self.entry('a', self.body))
+        _, second = body_store.extract(self.entry('b', self.body))
+        report_path = self.mktemp()
+        with open(report_path, 'w') as f:
+            f.write(safe_dump(self.testDetails))
+            for document in (second, bodies, first):
+                f.write('---\n' + safe_dump(document) + '...\n')
+        self.assertEqual(list(readReport(report_path)),
+                         [self.testDetails, self.entry('b', self.body),
+                          self.entry('a', self.body)])
+
+class MockSerializedOReporter(MockOReporter):
+    serializationFormat = 'yaml'
+
+    def __init__(self):
+        MockOReporter.__init__(self)
+        self.entries = []
+
+    def writeReportEntry(self, entry):
+        self.entries.append(entry)
+        return defer.succeed(None)
+
+class MockRawOReporter(MockSerializedOReporter):
+    serializationFormat = None
+
+class TestSerializeOnce(unittest.TestCase):
+    def test_entry_is_serialized_once(self):
+        reporters = [MockSerializedOReporter(), MockSerializedOReporter(),
+                     MockRawOReporter()]
+        report = Report(reporters, ReportEntryManager())
+        entry = {'input': 'a'}
+        d = report.write(entry)
+
+        @d.addCallback
+        def check(_):
+            serialized = reporters[0].entries[0]
+            self.assertEqual(serialized, safe_dump(entry))
+            self.assertIs(reporters[1].entries[0], serialized)
+            self.assertIs(reporters[2].entries[0], entry)
+        return d
+
+    def test_raw_reporters_only(self):
+        reporter = MockRawOReporter()
+        report = Report([reporter], ReportEntryManager())
+        entry = {'input': 'a'}
+        d = report.write(entry)
+        d.addCallback(lambda _: self.assertIs(reporter.entries[0], entry))
+        return d
+
+class TestYAMLReporterBuffering(unittest.TestCase):
+    def setUp(self):
+        self.destination = self.mktemp()
+        os.mkdir(self.destination)
+        self.testDetails = {'test_name': 'foo', 'test_version': '0.1'}
+        self.clock = task.Clock()
+
+    def createReporter(self, filename='report.yamloo', **kw):
+        reporter = YAMLReporter(self.testDetails, self.destination,
+                                report_filename=filename, clock=self.clock)
+        for key, value in kw.items():
+            setattr(reporter, key, value)
+        reporter.createReport()
+        return reporter
+
+    def content(self, filename='report.yamloo'):
+        with open(os.path.join(self.destination, filename)) as f:
+            return f.read()
+
+    def test_flush_every_entries(self):
+        reporter = self.createReporter(flushEntries=3)
+        header = self.content()
+        reporter.writeReportEntry({'input': 'a'})
+        reporter.writeReportEntry({'input': 'b'})
+        self.assertEqual(self.content(), header)
+        reporter.writeReportEntry({'input': 'c'})
+        self.assertEqual(self.content().count('---\n'), 4)
+        reporter.finish()
+
+    def test_flush_interval(self):
+        reporter = self.createReporter(flushEntries=100, flushInterval=5)
+        header = self.content()
+        reporter.writeReportEntry({'input': 'a'})
+        self.clock.advance(4)
+        self.assertEqual(self.content(), header)
+        self.clock.advance(1)
+        self.assertEqual(self.content().count('---\n'), 2)
+        reporter.finish()
+
+    def test_flush_on_close_and_sync(self):
+        reporter = self.createReporter(flushEntries=100)
+        reporter.writeReportEntry({'input': 'a'})
+        reporter.sync()
+        self.assertEqual(self.content().count('---\n'), 2)
+        reporter.writeReportEntry({'input': 'b'})
+        reporter.finish()
+        self.assertEqual(self.content().count('---\n'), 3)
+
+    def test_format_is_unchanged(self):
+        entries = [{'input': 'a'}, {'input': 'b', 'requests': []}]
+        for filename, flush_entries in (('a.yamloo', 1), ('b.yamloo', 100)):
+            reporter = self.createReporter(filename, flushEntries=flush_entries)
+            for entry in entries:
+                reporter.writeReportEntry(entry)
+            reporter.finish()
+        self.assertEqual(self.content('a.yamloo').split('\n')[4:],
+                         self.content('b.yamloo').split('\n')[4:])
+
+class TestJSONLReporter(unittest.TestCase):
+    def setUp(self):
+        self.destination = self.mktemp()
+        os.mkdir(self.destination)
+        self.testDetails = {'test_name': 'foo', 'test_version': '0.1'}
+
+    def test_json_safe(self):
+        from scapy.all import IP
+        self.assertEqual(jsonSafe({'a': ('b', set(['c'])), 1: 1+2j}),
+                         {'a': ['b', ['c']], '1': u'1.0+2.0j'})
+        self.assertEqual(jsonSafe('\xff\x00'),
+                         {'format': 'base64', 'data': '/wA='})
+        self.assertEqual(jsonSafe(u'caf\xe9'), u'caf\xe9')
+        packet = jsonSafe(IP(dst='127.0.0.1'))
+        self.assertEqual(packet[0]['summary'], str(IP(dst='127.0.0.1').summary()))
+        self.assertEqual(packet[0]['raw_packet']['format'], 'base64')
+
+    def test_report(self):
+        reporter = JSONLReporter(self.testDetails, self.destination)
+        self.assertTrue(reporter.report_path.endswith('.jsonl'))
+        reporter.createReport()
+        entries = [{'input': 'a', 'requests': [{'response': {'body': 'x'}}]},
+                   {'input': u'caf\xe9', 'runtime': 0.5}]
+        for entry in entries:
+            reporter.writeReportEntry(entry)
+        reporter.finish()
+
+        with open(reporter.report_path) as f:
+            lines = f.readlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0]), self.testDetails)
+        self.assertEqual(list(readReport(reporter.report_path)),
+                         [self.testDetails] + entries)
+
+    def test_serialized_once_per_format(self):
+        yaml_reporter = MockSerializedOReporter()
+        json_reporter = MockSerializedOReporter()
+        json_reporter.serializationFormat = 'json'
+        report = Report([yaml_reporter, json_reporter], ReportEntryManager())
+        entry = {'input': 'a'}
+        d = report.write(entry)
+
+        @d.addCallback
+        def check(_):
+            self.assertEqual(yaml_reporter.entries, [safe_dump(entry)])
+            self.assertEqual(json_reporter.entries, [json.dumps(entry)])
+        return d
+
+class MockSerializerPool(object):
+    def __init__(self):
+        self.queueDepth = 0
+        self.pending = []
+
+    def serialize(self, documents, formats):
+        d = defer.Deferred()
+        self.pending.append((d, documents, formats))
+        return d
+
+    def fire(self, index):
+        d, documents, formats = self.pending[index]
+        d.callback(serializeFormats(documents, formats))
+
+class TestSerializerPool(unittest.TestCase):
+    def test_plain_data(self):
+        from scapy.all import IP
+        packet = IP(dst='127.0.0.1')
+        data = plainData({'a': [packet], 'b': ('c', set(['d']))})
+        self.assertEqual(data['a'][0][0]['summary'], str(packet.summary()))
+        self.assertEqual(data['b'], ('c', set(['d'])))
+        self.assertEqual(safe_dump(data['a']), safe_dump([packet]))
+
+    def test_serialize(self):
+        pool = SerializerPool(2)
+        self.addCleanup(pool.threadpool.stop)
+        entry = {'input': 'a'}
+        d = pool.serialize([entry], ['yaml', 'json'])
+        self.assertEqual(pool.queueDepth, 1)
+
+        @d.addCallback
+        def check(serialized):
+            self.assertEqual(serialized, {'yaml': safe_dump(entry),
+                                          'json': json.dumps(entry)})
+            self.assertEqual(pool.queueDepth, 0)
+        return d
+
+    def test_entries_are_written_in_order(self):
+        reporter = MockSerializedOReporter()
+        report = Report([reporter], ReportEntryManager())
+        report.serializerPool = MockSerializerPool()
+        entries = [{'input': 'a'}, {'input': 'b'}, {'input': 'c'}]
+        dl = [report.write(entry) for entry in entries]
+
+        report.serializerPool.fire(1)
+        report.serializerPool.fire(2)
+        self.assertEqual(reporter.entries, [])
+        report.serializerPool.fire(0)
+        self.assertEqual(reporter.entries,
+                         [safe_dump(entry) for entry in entries])
+        return defer.gatherResults(dl)
+
+    def test_serialization_failure(self):
+        reporter = MockSerializedOReporter()
+        report = Report([reporter], ReportEntryManager())
+        report.serializerPool = MockSerializerPool()
+        entries = [{'input': 'a'}, {'input': 'b'}]
+        dl = [report.write(entry) for entry in entries]
+
+        report.serializerPool.pending[0][0].errback(ValueError())
+        report.serializerPool.fire(1)
+        self.assertEqual(reporter.entries, [entries[0], safe_dump(entries[1])])
+        self.flushLoggedErrors(ValueError)
+        return defer.gatherResults(dl)
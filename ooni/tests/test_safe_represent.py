@@ -2,13 +2,84 @@ import yaml
 
 from twisted.trial import unittest
 
-from ooni.reporter import OSafeDumper
+from ooni.reporter import OSafeDumper, OSafeCDumper
 
-from scapy.all import IP, UDP
+from scapy.all import IP, UDP, TCP
 
 class TestScapyRepresent(unittest.TestCase):
     def test_represent_scapy(self):
         data = IP()/UDP()
         yaml.dump_all([data], Dumper=OSafeDumper)
 
+class TestCDumper(unittest.TestCase):
+    if OSafeCDumper is None:
+        skip = "PyYAML is not built with libyaml"
 
+    def assertSameOutput(self, data):
+        self.assertEqual(yaml.dump_all([data], Dumper=OSafeCDumper),
+                         yaml.dump_all([data], Dumper=OSafeDumper))
+
+    def test_http_entry(self):
+        body = '<html>\n<head><title>Blocked</title></head>\n' + \
+               '<body>%s</body>\n</html>\n' % ('lorem ipsum dolor ' * 500)
+        self.assertSameOutput({
+            'input': 'http://example.com/',
+            'test_name': 'http_requests',
+            'test_runtime': 0.4263930320739746,
+            'control_failure': None,
+            'body_proportion': 1.0,
+            'headers_diff': set(['Date']),
+            'requests': [{
+                'request': {'url': 'http://example.com/', 'method': 'GET',
+                            'headers': [('User-Agent', ['Mozilla/5.0'])],
+                            'body': None, 'tor': False},
+                'response': {'code': 200, 'body': body,
+                             'headers': [('Content-Type',
+                                          ['text/html; charset=utf-8'])]}
+            }]
+        })
+
+    def test_traceroute_entry(self):
+        packets = [IP(dst='8.8.8.8', ttl=ttl)/TCP(dport=80)
+                   for ttl in range(1, 5)]
+        self.assertSameOutput({
+            'input': None,
+            'test_tcp_traceroute': [('8.8.8.8', 80, 1, None)],
+            'sent_packets': packets,
+            'answered_packets': [[packets[0]]],
+            'complex': [1+2j, 3j, -1-1j, 2+0j]
+        })
+
+    def test_report_fixtures(self):
+        body = 'lorem ipsum dolor ' * 100
+        self.assertSameOutput({'test_name': 'http_requests',
+                               'test_version': '0.2.5',
+                               'software_name': 'ooniprobe',
+                               'input_hashes': ['a' * 64],
+                               'options': ['-f', 'urls.txt'],
+                               'probe_asn': 'AS0', 'probe_cc': None,
+                               'start_time': 1388534400.0})
+        self.assertSameOutput({'stored_bodies': {'b' * 64: body}})
+        self.assertSameOutput({'input': 'http://example.com/',
+                               'requests': [{'response': {
+                                   'body_ref': 'b' * 64,
+                                   'body_sha256': 'b' * 64,
+                                   'body_simhash': '00000000000000ff'}}]})
+
+    def test_double_quoted_folding(self):
+        text = u'caf\xe9 ' * 40
+        self.assertSameOutput({'body': text, 'list': [text, [text]],
+                               'spaces': u'\xe9' + ' ' * 100 + 'x ' * 50,
+                               'escapes': '\t\x00' * 50 + ' a'})
+
+    def test_keys(self):
+        self.assertSameOutput({'': 1, 'a' * 128: 2, 'b' * 129: 3,
+                               u'\u5927' * 50: 4, 'a\rb': 5})
+
+    def test_unicode_and_binary(self):
+        self.assertSameOutput({
+            'unicode': u'caf\xe9 \u5927',
+            'binary': '\x00\x01\xff',
+            'multiline': 'a\nb\n  c\n',
+            'long': 'x' * 200
+        })
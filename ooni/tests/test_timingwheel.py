@@ -0,0 +1,85 @@
+from twisted.trial import unittest
+from twisted.internet import task, error
+
+from ooni.utils.timingwheel import TimingWheel, getTimingWheel
+
+class TestTimingWheel(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.wheel = TimingWheel(tick=0.5, slots=8, clock=self.clock)
+        self.fired = []
+
+    def callback(self, value):
+        self.fired.append(value)
+
+    def test_fires_after_delay(self):
+        self.wheel.callLater(2, self.callback, 'a')
+        self.clock.advance(1.5)
+        self.assertEqual(self.fired, [])
+        self.clock.advance(0.5)
+        self.assertEqual(self.fired, ['a'])
+        self.assertEqual(len(self.wheel), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_fires_at_tick_granularity(self):
+        self.wheel.callLater(0.7, self.callback, 'a')
+        self.clock.advance(0.7)
+        self.assertEqual(self.fired, [])
+        self.clock.advance(0.3)
+        self.assertEqual(self.fired, ['a'])
+
+    def test_multiple_rounds(self):
+        # 8 slots of 0.5 seconds make a revolution of 4 seconds
+        self.wheel.callLater(10, self.callback, 'a')
+        self.wheel.callLater(1, self.callback, 'b')
+        self.clock.pump([1] * 9)
+        self.assertEqual(self.fired, ['b'])
+        self.clock.advance(1)
+        self.assertEqual(self.fired, ['b', 'a'])
+
+    def test_cancel_from_expiring_callback(self):
+        timeouts = []
+        def cancelOthers():
+            self.fired.append('cancel')
+            for timeout in timeouts:
+                if timeout.active():
+                    timeout.cancel()
+        for i in range(3):
+            timeouts.append(self.wheel.callLater(1, cancelOthers))
+        self.clock.advance(1)
+        self.assertEqual(self.fired, ['cancel'])
+        self.assertEqual(len(self.wheel), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_cancel(self):
+        timeout = self.wheel.callLater(1, self.callback, 'a')
+        self.assertTrue(timeout.active())
+        timeout.cancel()
+        self.assertFalse(timeout.active())
+        self.assertRaises(error.AlreadyCancelled, timeout.cancel)
+        # No ticks are left scheduled once the wheel is empty
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.clock.advance(2)
+        self.assertEqual(self.fired, [])
+
+    def test_single_delayed_call(self):
+        for i in range(100):
+            self.wheel.callLater(i % 7 + 1, self.callback, i)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.pump([0.5] * 16)
+        self.assertEqual(sorted(self.fired), range(100))
+
+    def test_schedule_from_timeout(self):
+        def reschedule(value):
+            self.callback(value)
+            if value < 3:
+                self.wheel.callLater(1, reschedule, value + 1)
+        self.wheel.callLater(1, reschedule, 0)
+        self.clock.pump([0.5] * 8)
+        self.assertEqual(self.fired, [0, 1, 2, 3])
+
+    def test_shared_per_clock(self):
+        self.assertIdentical(getTimingWheel(self.clock),
+                             getTimingWheel(self.clock))
+        self.assertNotIdentical(getTimingWheel(self.clock),
+                                getTimingWheel(task.Clock()))
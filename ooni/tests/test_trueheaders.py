@@ -1,6 +1,10 @@
 from twisted.trial import unittest
+from twisted.internet import defer, reactor
+from twisted.web import client, resource, server
+from twisted.web._newclient import Request
 
-from ooni.utils.trueheaders import TrueHeaders
+from ooni.utils.trueheaders import TrueHeaders, TrueHeadersAgent
+from ooni.utils.trueheaders import HTTPClientParser
 
 dummy_headers_dict = {
         'Header1': ['Value1', 'Value2'],
@@ -39,3 +43,61 @@ class TestTrueHeaders(unittest.TestCase):
 
 
 
+
+class HelloResource(resource.Resource):
+    isLeaf = True
+
+    def render_GET(self, request):
+        return 'hello'
+
+class TestPersistentTrueHeadersAgent(unittest.TestCase):
+    def setUp(self):
+        self.port = reactor.listenTCP(0, server.Site(HelloResource()),
+                                      interface='127.0.0.1')
+        self.url = 'http://127.0.0.1:%d/' % self.port.getHost().port
+
+    def tearDown(self):
+        return self.port.stopListening()
+
+    @defer.inlineCallbacks
+    def request(self, agent):
+        response = yield agent.request('GET', self.url)
+        d = client.readBody(response)
+        # Without keep-alive the body is read until the connection is closed
+        d.addErrback(lambda failure: failure.trap(client.PartialDownloadError))
+        yield d
+        defer.returnValue(response)
+
+    @defer.inlineCallbacks
+    def test_connection_reused(self):
+        agent = TrueHeadersAgent(reactor, persistent=True)
+        first = yield self.request(agent)
+        second = yield self.request(agent)
+        yield agent._pool.closeCachedConnections()
+        self.assertFalse(first.connectionReused)
+        self.assertTrue(second.connectionReused)
+        self.assertIsInstance(second.headers, TrueHeaders)
+
+    @defer.inlineCallbacks
+    def test_not_persistent(self):
+        agent = TrueHeadersAgent(reactor)
+        yield self.request(agent)
+        second = yield self.request(agent)
+        self.assertFalse(second.connectionReused)
+
+    def test_connection_headers_of_non_persistent_responses(self):
+        request = Request('GET', '/', TrueHeaders(), None)
+        parser = HTTPClientParser(request, None)
+        parser.connectionMade()
+        parser.headerReceived('Content-Length', '5')
+        self.assertEqual(parser.headers.getRawHeaders('content-length'), ['5'])
+        self.assertEqual(parser.connHeaders.getRawHeaders('content-length'),
+                         None)
+
+        parser = HTTPClientParser(request, None)
+        parser.keepAlive = True
+        parser.connectionMade()
+        parser.headerReceived('Content-Length', '5')
+        self.assertEqual(parser.headers.getRawHeaders('content-length'), ['5'])
+        self.assertEqual(parser.connHeaders.getRawHeaders('content-length'),
+                         ['5'])
@@ -0,0 +1,138 @@
+import os
+
+from twisted.internet import defer, error
+from twisted.python import failure
+from twisted.trial import unittest
+
+from ooni.errors import MalformedWorkerEntry
+from ooni.managers import ReportEntryManager
+from ooni.utils import log
+from ooni.reporter import Report, safe_dump
+from ooni.workers import encodeEntry, WorkerReporter, WorkerProcessProtocol, ENTRIES_FD
+
+from ooni.tests.mocks import MockOReporter
+
+class MockEntriesOReporter(MockOReporter):
+    def __init__(self):
+        MockOReporter.__init__(self)
+        self.entries = []
+
+    def writeReportEntry(self, entry):
+        self.entries.append(entry)
+
+class SlowEntriesOReporter(MockEntriesOReporter):
+    def __init__(self):
+        MockEntriesOReporter.__init__(self)
+        self.pending = []
+
+    def writeReportEntry(self, entry):
+        MockEntriesOReporter.writeReportEntry(self, entry)
+        d = defer.Deferred()
+        self.pending.append(d)
+        return d
+
+class MockProcessTransport(object):
+    def __init__(self):
+        self.paused = 0
+        self.signals = []
+
+    def signalProcess(self, signal):
+        self.signals.append(signal)
+
+    def pauseProducing(self):
+        self.paused += 1
+
+    def resumeProducing(self):
+        self.paused -= 1
+
+class TestWorkerProcessProtocol(unittest.TestCase):
+    def setUp(self):
+        self.reporter = MockEntriesOReporter()
+        self.report = Report([self.reporter], ReportEntryManager())
+        self.protocol = WorkerProcessProtocol(0, self.report,
+                                              self.report.reportEntryManager)
+
+    def test_entries_split_across_reads(self):
+        data = encodeEntry(safe_dump({'input': 'a'}))
+        data += encodeEntry(safe_dump({'input': 'b:c,'}))
+        for i in range(0, len(data), 3):
+            self.protocol.childDataReceived(ENTRIES_FD, data[i:i + 3])
+        self.assertEqual(self.reporter.entries,
+                         [safe_dump({'input': 'a'}),
+                          safe_dump({'input': 'b:c,'})])
+        self.assertEqual(self.protocol._buffer, '')
+
+    @defer.inlineCallbacks
+    def test_worker_reporter(self):
+        read_fd, write_fd = os.pipe()
+        reporter = WorkerReporter(write_fd)
+        reporter.createReport()
+        yield defer.maybeDeferred(reporter.writeReportEntry, {'input': 'a'})
+        yield reporter.finish()
+        data = os.read(read_fd, 4096)
+        os.close(read_fd)
+        self.protocol.childDataReceived(ENTRIES_FD, data)
+        self.assertEqual(self.reporter.entries, [safe_dump({'input': 'a'})])
+
+    def test_worker_reporter_waits_when_paused(self):
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        reporter = WorkerReporter(write_fd)
+        reporter.createReport()
+        self.addCleanup(reporter.finish)
+        reporter.pauseProducing()
+        d = reporter.writeReportEntry({'input': 'a'})
+        self.assertNoResult(d)
+        reporter.resumeProducing()
+        self.successResultOf(d)
+
+    def test_pause_is_balanced(self):
+        reporter = SlowEntriesOReporter()
+        report_entry_manager = ReportEntryManager()
+        report_entry_manager.maxBacklogEntries = 1
+        report = Report([reporter], report_entry_manager)
+        protocol = WorkerProcessProtocol(0, report, report_entry_manager)
+        protocol.transport = MockProcessTransport()
+        data = encodeEntry(safe_dump({'input': 'a'}))
+        data += encodeEntry(safe_dump({'input': 'b'}))
+        protocol.childDataReceived(ENTRIES_FD, data)
+        self.assertEqual(protocol.transport.paused, 1)
+        reporter.pending[0].callback(None)
+        self.assertEqual(protocol.transport.paused, 1)
+        reporter.pending[1].callback(None)
+        self.assertEqual(protocol.transport.paused, 0)
+        self.assertFalse(protocol.paused)
+
+    def endProcess(self, exit_code=0):
+        self.protocol.processEnded(failure.Failure(
+            error.ProcessTerminated(exitCode=exit_code)))
+
+    def test_malformed_length(self):
+        self.patch(log, 'err', lambda message: None)
+        self.protocol.transport = MockProcessTransport()
+        self.protocol.childDataReceived(ENTRIES_FD, 'abc:def,')
+        self.assertEqual(self.protocol.transport.signals, ['TERM'])
+        self.endProcess(1)
+        self.failureResultOf(self.protocol.done, MalformedWorkerEntry)
+
+    def test_missing_comma(self):
+        self.patch(log, 'err', lambda message: None)
+        self.protocol.transport = MockProcessTransport()
+        self.protocol.childDataReceived(ENTRIES_FD, '3:abc;')
+        self.endProcess(1)
+        self.failureResultOf(self.protocol.done, MalformedWorkerEntry)
+        self.assertEqual(self.reporter.entries, [])
+
+    def test_truncated_entry(self):
+        messages = []
+        self.patch(log, 'err', messages.append)
+        self.protocol.childDataReceived(ENTRIES_FD, '10:abc')
+        self.endProcess()
+        self.failureResultOf(self.protocol.done, MalformedWorkerEntry)
+        self.assertEqual(len(messages), 1)
+
+    def test_done(self):
+        self.protocol.childDataReceived(ENTRIES_FD,
+                                        encodeEntry(safe_dump({'input': 'a'})))
+        self.endProcess()
+        self.assertEqual(self.successResultOf(self.protocol.done), 0)
@@ -0,0 +1,134 @@
+import os
+import json
+import errno
+from hashlib import sha256
+from collections import OrderedDict
+
+from twisted.internet import reactor
+
+from ooni.utils import log
+from ooni.settings import config
+
+def controlKey(url, headers):
+    """
+    Returns the cache key of a control request for url with the request
+    headers headers (a dict of header names to lists of values).
+    """
+    headers = sorted((name.lower(), list(values))
+                     for name, values in headers.items())
+    return sha256(json.dumps([url, headers])).hexdigest()
+
+class ControlCache(object):
+    """
+    A persistent cache of the results of control measurements.
+
+    Results are kept for ttl seconds. When there are more than max_entries
+    of them the least recently used ones are evicted. The cache is stored as
+    JSON in path, saveInterval seconds after it has been changed.
+    """
+    saveInterval = 5.0
+
+    def __init__(self, path, ttl=3600, max_entries=10000, clock=reactor):
+        self.path = path
+        self.ttl = ttl
+        self.maxEntries = max_entries
+        self.clock = clock
+        self._entries = None
+        self._saveCall = None
+        self._warned = False
+
+    def warn(self, message):
+        """
+        Logs message the first time the cache can not be read or written.
+        """
+        if not self._warned:
+            self._warned = True
+            log.err(message)
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = OrderedDict()
+            try:
+                with open(self.path) as f:
+                    entries = json.load(f)
+            except IOError as exc:
+                if exc.errno != errno.ENOENT:
+                    self.warn("Could not read the control cache %s: %s" %
+                              (self.path, exc))
+                entries = []
+            except ValueError:
+                log.err("Ignoring the corrupted control cache %s" % self.path)
+                entries = []
+            now = self.clock.seconds()
+            # The entries are stored from the least to the most recently used
+            for key, timestamp, result in entries:
+                if now - timestamp < self.ttl:
+                    self._entries[key] = (timestamp, result)
+        return self._entries
+
+    def get(self, key):
+        """
+        Returns the cached result for key and its age in seconds, or None if
+        there is no result for key younger than the TTL.
+        """
+        try:
+            timestamp, result = self.entries.pop(key)
+        except KeyError:
+            return None
+        age = self.clock.seconds() - timestamp
+        if age >= self.ttl:
+            self.changed()
+            return None
+        self.entries[key] = (timestamp, result)
+        return result, age
+
+    def set(self, key, result):
+        """
+        Stores result (that must be JSON serializable) as the result for key.
+        """
+        self.entries.pop(key, None)
+        self.entries[key] = (self.clock.seconds(), result)
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+        self.changed()
+
+    def changed(self):
+        if not self._saveCall:
+            self._saveCall = self.clock.callLater(self.saveInterval,
+                                                  self.save)
+
+    def save(self):
+        if self._saveCall and self._saveCall.active():
+            self._saveCall.cancel()
+        self._saveCall = None
+        if self._entries is None:
+            return
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump([[key, timestamp, result] for key, (timestamp, result)
+                           in self._entries.items()], f)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as exc:
+            self.warn("Could not write the control cache %s: %s" %
+                      (self.path, exc))
+
+_controlCache = None
+
+def getControlCache():
+    """
+    Returns the control cache stored in the ooni home directory, or None if
+    the control_cache option is not enabled.
+    """
+    global _controlCache
+    if not config.advanced.control_cache:
+        return None
+    if _controlCache is None:
+        _controlCache = ControlCache(
+            os.path.join(config.ooni_home, 'controls.json'),
+            ttl=config.advanced.control_cache_ttl or 3600,
+            max_entries=config.advanced.control_cache_size or 10000)
+        reactor.addSystemEventTrigger('before', 'shutdown',
+                                      _controlCache.save)
+    return _controlCache
@@ -0,0 +1,148 @@
+import math
+import struct
+from hashlib import md5
+from urlparse import urlsplit, urlunsplit
+
+from ooni.ratelimiting import inputHost
+
+class BloomFilter(object):
+    """
+    A Bloom filter sized to hold capacity items with a false positive rate of
+    at most error_rate.
+
+    The bit positions of an item are obtained by double hashing a single MD5
+    digest of the item.
+    """
+    def __init__(self, capacity, error_rate=0.0001):
+        self.capacity = capacity
+        self.errorRate = error_rate
+        size = -capacity * math.log(error_rate) / math.log(2) ** 2
+        self.size = max(int(math.ceil(size)), 8)
+        self.hashes = max(int(round(self.size / float(capacity) *
+                                    math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _positions(self, item):
+        h1, h2 = struct.unpack('<QQ', md5(item).digest())
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def __contains__(self, item):
+        bits = self.bits
+        for position in self._positions(item):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, item):
+        """
+        Adds item to the filter.
+
+        Returns:
+            True if the item was (probably) already in the filter.
+        """
+        bits = self.bits
+        present = True
+        for position in self._positions(item):
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                present = False
+                bits[position >> 3] |= mask
+        if not present:
+            self.count += 1
+        return present
+
+class InputDeduplicator(object):
+    """
+    Filters the duplicates out of a stream of inputs.
+
+    Inputs are compared by the key returned by normalize. The keys are kept
+    in a set until there are more than exactLimit of them, after which they
+    are moved to a :class:BloomFilter sized for expected_inputs keys. From
+    then on a small fraction (error_rate) of the inputs may wrongly be
+    considered duplicates, in exchange for a bounded memory usage.
+    """
+    exactLimit = 10000
+
+    def __init__(self, normalize=None, expected_inputs=1000000,
+                 error_rate=0.0001):
+        self.normalize = normalize or normalizeExact
+        self.expectedInputs = max(expected_inputs, 2 * self.exactLimit)
+        self.errorRate = error_rate
+        self.seen = set()
+        self.duplicates = 0
+
+    def isDuplicate(self, test_input):
+        key = self.normalize(test_input)
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        elif not isinstance(key, str):
+            key = repr(key)
+
+        if isinstance(self.seen, set):
+            if key in self.seen:
+                return True
+            self.seen.add(key)
+            if len(self.seen) > self.exactLimit:
+                bloom_filter = BloomFilter(self.expectedInputs,
+                                           self.errorRate)
+                for seen_key in self.seen:
+                    bloom_filter.add(seen_key)
+                self.seen = bloom_filter
+            return False
+        return self.seen.add(key)
+
+    def filter(self, inputs):
+        """
+        Yields the inputs that are not duplicates of previous ones, counting
+        the ones that are in self.duplicates.
+        """
+        for test_input in inputs:
+            if self.isDuplicate(test_input):
+                self.duplicates += 1
+                continue
+            yield test_input
+
+def normalizeExact(test_input):
+    """
+    Inputs are duplicates when they are equal, ignoring surrounding
+    whitespace.
+    """
+    if isinstance(test_input, basestring):
+        return test_input.strip()
+    return test_input
+
+def normalizeURL(test_input):
+    """
+    Inputs are duplicates when they are the same URL, ignoring the case of
+    the scheme and of the host, the default port and the fragment.
+    """
+    if not isinstance(test_input, basestring):
+        return test_input
+    url = test_input.strip()
+    try:
+        scheme, netloc, path, query, _ = urlsplit(url)
+    except ValueError:
+        return url
+    scheme = scheme.lower()
+    netloc = netloc.lower()
+    if (scheme, netloc[-3:]) == ('http', ':80') or \
+            (scheme, netloc[-4:]) == ('https', ':443'):
+        netloc = netloc.rsplit(':', 1)[0]
+    return urlunsplit((scheme, netloc, path or '/', query, ''))
+
+def normalizeHost(test_input):
+    """
+    Inputs are duplicates when they refer to the same host.
+    """
+    return inputHost(test_input) or test_input
+
+inputNormalizers = {
+    'exact': normalizeExact,
+    'url': normalizeURL,
+    'host': normalizeHost
+}
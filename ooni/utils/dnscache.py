@@ -0,0 +1,115 @@
+from zope.interface import implements
+from twisted.internet import defer, reactor
+from twisted.internet.interfaces import IResolverSimple
+from twisted.names import client, dns
+
+from ooni.utils import log
+
+class CachingResolver(object):
+    """
+    A resolver that caches the addresses of the hostnames it resolves for as
+    long as the TTL of their DNS records.
+
+    Names are resolved asynchronously with twisted.names, using the system
+    DNS configuration (and hosts file). Concurrent lookups of the same name
+    share a single query. If twisted.names fails to resolve a name, it is
+    resolved by the fallback resolver (the system one) and not cached.
+
+    The tests that measure DNS get the fallback resolver from
+    :func:getResolver, so that their lookups skip the cache.
+    """
+    implements(IResolverSimple)
+
+    maxTTL = 3600
+
+    def __init__(self, fallback, resolver=None, clock=reactor):
+        self.fallback = fallback
+        self._resolver = resolver
+        self.clock = clock
+        # Maps a name to its address and the time at which it expires
+        self.cache = {}
+        self.pending = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @property
+    def resolver(self):
+        if self._resolver is None:
+            self._resolver = client.createResolver()
+        return self._resolver
+
+    def getHostByName(self, name, timeout=(1, 3, 11, 45)):
+        key = name.lower()
+        try:
+            address, expires = self.cache[key]
+        except KeyError:
+            pass
+        else:
+            if self.clock.seconds() < expires:
+                self.hits += 1
+                return defer.succeed(address)
+            del self.cache[key]
+
+        d = defer.Deferred()
+        if key in self.pending:
+            self.coalesced += 1
+            self.pending[key].append(d)
+            return d
+
+        self.misses += 1
+        self.pending[key] = [d]
+        lookup = self.resolver.lookupAddress(name, timeout)
+        lookup.addCallback(self._gotAnswers, key)
+        lookup.addErrback(self._lookupFailed, name, timeout)
+        lookup.addBoth(self._fire, key)
+        return d
+
+    def _gotAnswers(self, result, key):
+        answers = result[0]
+        addresses = [answer.payload.dottedQuad() for answer in answers
+                     if answer.type == dns.A]
+        if not addresses:
+            raise ValueError("No A records")
+        ttl = min([answer.ttl for answer in answers] + [self.maxTTL])
+        if ttl > 0:
+            self.cache[key] = (addresses[0], self.clock.seconds() + ttl)
+        return addresses[0]
+
+    def _lookupFailed(self, failure, name, timeout):
+        log.debug("Resolving %s with the system resolver (%s)" %
+                  (name, failure.getErrorMessage()))
+        return self.fallback.getHostByName(name, timeout)
+
+    def _fire(self, result, key):
+        for d in self.pending.pop(key):
+            d.callback(result)
+
+_cachingResolver = None
+
+def installCachingResolver(reactor=reactor):
+    """
+    Installs a :class:CachingResolver on reactor, if it has not been
+    installed already, and returns it.
+    """
+    global _cachingResolver
+    if _cachingResolver is None:
+        _cachingResolver = CachingResolver(reactor.resolver)
+        reactor.installResolver(_cachingResolver)
+    return _cachingResolver
+
+def getCachingResolver():
+    """
+    Returns the installed caching resolver, or None.
+    """
+    return _cachingResolver
+
+def getResolver(bypass_cache=False, reactor=reactor):
+    """
+    Returns the resolver of reactor, or the one the caching resolver falls
+    back to if bypass_cache is True.
+    """
+    if bypass_cache and _cachingResolver:
+        return _cachingResolver.fallback
+    return reactor.resolver
@@ -0,0 +1,144 @@
+import os
+import json
+import errno
+from hashlib import sha256
+
+from twisted.internet import defer, threads
+
+from ooni.utils import log
+from ooni.settings import config
+
+def sha256File(filename, chunk_size=1 << 20):
+    """
+    Returns the hex encoded sha256 digest of the content of filename.
+    """
+    h = sha256()
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+class HashCache(object):
+    """
+    A persistent cache of the sha256 digests of files.
+
+    Digests are keyed by the real path of the file and are only used while
+    the size and modification time (in nanoseconds) of the file are the ones
+    it had when it was hashed. The cache is stored as JSON in path.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._entries = None
+        self._warned = False
+
+    def warn(self, message):
+        """
+        Logs message the first time the cache can not be read or written.
+        """
+        if not self._warned:
+            self._warned = True
+            log.err(message)
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = {}
+            try:
+                with open(self.path) as f:
+                    self._entries = json.load(f)
+            except IOError as exc:
+                if exc.errno != errno.ENOENT:
+                    self.warn("Could not read the hash cache %s: %s" %
+                              (self.path, exc))
+            except ValueError:
+                log.err("Ignoring the corrupted hash cache %s" % self.path)
+        return self._entries
+
+    def _stat(self, filename):
+        path = os.path.realpath(filename)
+        st = os.stat(path)
+        return path, st.st_size, int(round(st.st_mtime * 1e9))
+
+    def get(self, filename):
+        """
+        Returns the cached digest of filename or None if it is not cached
+        (or the file has changed since it was hashed).
+        """
+        path, size, mtime_ns = self._stat(filename)
+        try:
+            cached_size, cached_mtime_ns, digest = self.entries[path]
+        except KeyError:
+            return None
+        if (cached_size, cached_mtime_ns) != (size, mtime_ns):
+            return None
+        return str(digest)
+
+    def set(self, filename, stat, digest):
+        """
+        Stores digest as the digest of filename, as it was when stat was
+        obtained with _stat.
+        """
+        path, size, mtime_ns = stat
+        self.entries[path] = [size, mtime_ns, digest]
+        self.save()
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as exc:
+            self.warn("Could not write the hash cache %s: %s" % (self.path,
+                                                                 exc))
+
+    def hash(self, filename):
+        """
+        Returns the sha256 digest of filename, hashing it if it is not
+        cached.
+        """
+        digest = self.get(filename)
+        if digest is None:
+            stat = self._stat(filename)
+            digest = sha256File(filename)
+            self.set(filename, stat, digest)
+        return digest
+
+    def hashInThreads(self, filenames):
+        """
+        Hashes the files of filenames that are not cached in the reactor
+        thread pool.
+
+        Returns:
+            a deferred that fires once all the files are in the cache.
+        """
+        dl = []
+        for filename in set(filenames):
+            if self.get(filename) is not None:
+                continue
+            stat = self._stat(filename)
+            d = threads.deferToThread(sha256File, filename)
+            d.addCallback(lambda digest, filename=filename, stat=stat:
+                          self.set(filename, stat, digest))
+            dl.append(d)
+        return defer.DeferredList(dl, fireOnOneErrback=True, consumeErrors=True)
+
+_hashCaches = {}
+
+def getHashCache():
+    """
+    Returns the hash cache stored in the ooni home directory.
+    """
+    path = os.path.join(config.ooni_home, 'hashes.json')
+    if path not in _hashCaches:
+        _hashCaches[path] = HashCache(path)
+    return _hashCaches[path]
+
+def fileHash(filename):
+    """
+    Returns the sha256 digest of filename, using the hash cache.
+    """
+    return getHashCache().hash(filename)
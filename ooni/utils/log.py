@@ -61,6 +61,8 @@ def exception(error):
     Error can either be an error message to print to stdout and to the logfile
     or it can be a twisted.python.failure.Failure instance.
     """
+    if not config.logging:
+        return
     if isinstance(error, Failure):
         error.printTraceback()
     else:
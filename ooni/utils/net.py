@@ -1,5 +1,7 @@
+import re
 import sys
 import socket
+from hashlib import md5, sha256
 from random import randint
 
 from zope.interface import implements
@@ -61,26 +63,130 @@ class StringProducer(object):
     def stopProducing(self):
         pass
 
+class Simhash(object):
+    """
+    Computes the 64 bit simhash of a text incrementally.
+
+    The features of the text are its words, weighted by how many times they
+    appear. Words longer than maxWordLength are split in words of at most
+    maxWordLength characters. Words that span two calls to update are handled
+    correctly.
+
+    The words are not kept: the 64 bit hash of every word is added to a fixed
+    table of counts, one per byte of the hash and value of that byte, as it
+    arrives. Time is linear in the length of the text and memory is constant.
+    """
+    maxWordLength = 64
+    wordRegexp = re.compile(r'\w{1,%d}' % maxWordLength)
+
+    def __init__(self):
+        self.weights = [[0] * 256 for _ in range(8)]
+        self._tail = ''
+
+    def _add(self, word, weights):
+        for i, byte in enumerate(bytearray(md5(word).digest()[:8])):
+            weights[i][byte] += 1
+
+    def update(self, data):
+        data = self._tail + data
+        words = self.wordRegexp.findall(data)
+        # The last word may continue in the next chunk
+        if words and data.endswith(words[-1]):
+            self._tail = words.pop()
+        else:
+            self._tail = ''
+        weights = self.weights
+        for word in words:
+            self._add(word, weights)
+
+    def digest(self):
+        """
+        Returns the simhash of the text seen so far as an integer.
+        """
+        weights = self.weights
+        if self._tail:
+            weights = [list(counts) for counts in weights]
+            self._add(self._tail, weights)
+        value = 0
+        for i, counts in enumerate(weights):
+            for bit in range(8):
+                weight = 0
+                for byte, count in enumerate(counts):
+                    if count:
+                        weight += count if byte & (1 << bit) else -count
+                if weight > 0:
+                    value |= 1 << (i * 8 + bit)
+        return value
+
+    def hexdigest(self):
+        return '%016x' % self.digest()
+
+def simhashDistance(a, b):
+    """
+    Returns the number of bits that differ between the hex encoded simhashes
+    a and b (0 for identical texts, 64 at most).
+    """
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
 class BodyReceiver(protocol.Protocol):
-    def __init__(self, finished, content_length=None, body_processor=None):
+    """
+    Collects the body of a response and fires finished with it.
+
+    At most max_size bytes of the body are kept (all of it if max_size is
+    None). If the body is longer it is truncated and self.truncated is set.
+    When digests is True the length, the sha256 digest and the simhash of the
+    whole body are computed as it is received, so they are exact even when
+    the body has been truncated.
+    """
+    def __init__(self, finished, body_processor=None, max_size=None,
+                 digests=False):
         self.finished = finished
-        self.data = ""
-        self.bytes_remaining = content_length
         self.body_processor = body_processor
+        self.maxSize = max_size
+        self.chunks = []
+        self.length = 0
+        self.storedLength = 0
+        self.truncated = False
+        self.sha256 = None
+        self.simhash = None
+        if digests:
+            self.sha256 = sha256()
+            self.simhash = Simhash()
 
     def dataReceived(self, b):
-        self.data += b
-        if self.bytes_remaining:
-            if self.bytes_remaining == 0:
-                self.connectionLost(None)
-            else:
-                self.bytes_remaining -= len(b)
+        self.length += len(b)
+        if self.sha256:
+            self.sha256.update(b)
+            self.simhash.update(b)
+        if self.maxSize is not None and \
+                self.storedLength + len(b) > self.maxSize:
+            b = b[:self.maxSize - self.storedLength]
+            self.truncated = True
+        if b:
+            self.chunks.append(b)
+            self.storedLength += len(b)
+
+    @property
+    def data(self):
+        return ''.join(self.chunks)
+
+    def digests(self):
+        """
+        Returns the length, sha256 digest and simhash of the body.
+        """
+        return {
+            'length': self.length,
+            'sha256': self.sha256.hexdigest() if self.sha256 else None,
+            'simhash': self.simhash.hexdigest() if self.simhash else None
+        }
 
     def connectionLost(self, reason):
         try:
+            data = self.data
+            self.chunks = [data]
             if self.body_processor:
-                self.data = self.body_processor(self.data)
-            self.finished.callback(self.data)
+                data = self.body_processor(data)
+            self.finished.callback(data)
         except Exception as exc:
             self.finished.errback(exc)
 
@@ -0,0 +1,155 @@
+import math
+import weakref
+
+from twisted.internet import reactor, error
+
+from ooni.utils import log
+from ooni.settings import config
+
+class WheelTimeout(object):
+    """
+    A timeout scheduled on a :class:TimingWheel.
+
+    It supports the subset of the IDelayedCall interface we use for task
+    timeouts (active, cancel and getTime), so it can be used in place of the
+    return value of callLater.
+    """
+    __slots__ = ('wheel', 'time', 'slot', 'rounds', 'f', 'args', 'kw',
+                 'called', 'cancelled')
+
+    def __init__(self, wheel, time, slot, rounds, f, args, kw):
+        self.wheel = wheel
+        self.time = time
+        self.slot = slot
+        self.rounds = rounds
+        self.f = f
+        self.args = args
+        self.kw = kw
+        self.called = False
+        self.cancelled = False
+
+    def getTime(self):
+        return self.time
+
+    def active(self):
+        return not (self.called or self.cancelled)
+
+    def cancel(self):
+        if self.cancelled:
+            raise error.AlreadyCancelled
+        if self.called:
+            raise error.AlreadyCalled
+        self.cancelled = True
+        self.wheel._remove(self)
+
+class TimingWheel(object):
+    """
+    A hashed timing wheel.
+
+    All the timeouts scheduled on the wheel share a single delayed call on
+    the clock, that fires once every tick seconds while there are timeouts
+    pending. Scheduling and cancelling a timeout are O(1), at the cost of
+    timeouts firing up to tick seconds late.
+
+    The timeouts are hashed into len(slots) slots by the tick at which they
+    expire. Timeouts that expire more than a full revolution of the wheel
+    in the future keep a count of the revolutions (rounds) still to go.
+    """
+    def __init__(self, tick=0.1, slots=512, clock=reactor):
+        self.tick = float(tick)
+        self.clock = clock
+        self.slots = [set() for _ in range(slots)]
+        self._size = slots
+        # The index of the slot that was processed last
+        self._position = 0
+        # The time at which the last slot was processed
+        self._lastTick = None
+        self._ticker = None
+        self._ticking = False
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def callLater(self, delay, f, *args, **kw):
+        """
+        Schedules f to be called with args and kw in (at least) delay seconds.
+
+        Returns:
+            a :class:WheelTimeout
+        """
+        now = self.clock.seconds()
+        idle = self._ticker is None and not self._ticking
+        if idle:
+            self._lastTick = now
+        ticks = int(math.ceil((now - self._lastTick + delay) / self.tick))
+        ticks = max(ticks, 1)
+        slot = (self._position + ticks) % self._size
+        rounds = (ticks - 1) // self._size
+
+        timeout = WheelTimeout(self, now + delay, slot, rounds, f, args, kw)
+        self.slots[slot].add(timeout)
+        self._count += 1
+        if idle:
+            self._ticker = self.clock.callLater(self.tick, self._tick)
+        return timeout
+
+    def _remove(self, timeout):
+        self.slots[timeout.slot].discard(timeout)
+        self._count -= 1
+        if self._count == 0 and self._ticker is not None:
+            if self._ticker.active():
+                self._ticker.cancel()
+            self._ticker = None
+
+    def _expire(self, slot):
+        for timeout in list(self.slots[slot]):
+            # A callback may have cancelled the timeouts that follow it
+            if timeout.cancelled:
+                continue
+            if timeout.rounds > 0:
+                timeout.rounds -= 1
+                continue
+            self.slots[slot].discard(timeout)
+            self._count -= 1
+            timeout.called = True
+            try:
+                timeout.f(*timeout.args, **timeout.kw)
+            except Exception as exc:
+                log.err("Error in running timeout %s" % timeout.f)
+                log.exception(exc)
+
+    def _tick(self):
+        self._ticker = None
+        self._ticking = True
+        now = self.clock.seconds()
+        # Allow for some floating point error in the clock
+        elapsed = int((now - self._lastTick) / self.tick + 1e-9)
+        try:
+            for _ in range(elapsed):
+                self._position = (self._position + 1) % self._size
+                self._lastTick += self.tick
+                self._expire(self._position)
+        finally:
+            self._ticking = False
+
+        if self._count > 0:
+            delay = max(self._lastTick + self.tick - now, 0)
+            self._ticker = self.clock.callLater(delay, self._tick)
+
+_timingWheels = weakref.WeakKeyDictionary()
+
+def getTimingWheel(clock=reactor):
+    """
+    Returns the timing wheel shared by all the tasks that use clock.
+
+    The granularity of the wheel is given by the timeout_granularity option
+    of ooniprobe.conf.
+    """
+    try:
+        return _timingWheels[clock]
+    except KeyError:
+        tick = config.advanced.timeout_granularity or 0.1
+        wheel = TimingWheel(tick=tick, clock=clock)
+        _timingWheels[clock] = wheel
+        return wheel
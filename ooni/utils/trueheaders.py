@@ -22,6 +22,7 @@ from txsocksx.client import SOCKS5ClientFactory
 SOCKS5ClientFactory.noisy = False
 
 from ooni.utils import log
+from ooni.settings import config
 
 class TrueHeaders(http_headers.Headers):
     def __init__(self, rawHeaders=None):
@@ -89,6 +90,9 @@ class TrueHeaders(http_headers.Headers):
         return default
 
 class HTTPClientParser(_newclient.HTTPClientParser):
+    # Set when the connection is kept alive after the response
+    keepAlive = False
+
     def logPrefix(self):
         return 'HTTPClientParser'
 
@@ -99,6 +103,16 @@ class HTTPClientParser(_newclient.HTTPClientParser):
         self._partialHeader = None
 
     def headerReceived(self, name, value):
+        if self.keepAlive:
+            # The connection control headers (Content-Length, Connection,
+            # etc.) are needed to find the end of the response, which is
+            # required to reuse the connection. We also keep them in the
+            # response headers, so that they are reported as they were
+            # received.
+            if self.isConnectionControlHeader(name.lower()):
+                self.connHeaders.addRawHeader(name.lower(), value)
+            self.headers.addRawHeader(name, value)
+            return
         if self.isConnectionControlHeader(name):
             headers = self.connHeaders
         else:
@@ -106,10 +120,18 @@ class HTTPClientParser(_newclient.HTTPClientParser):
         headers.addRawHeader(name, value)
 
 class HTTP11ClientProtocol(_newclient.HTTP11ClientProtocol):
+    # The number of requests that have been sent over this connection
+    requestCount = 0
+    # Set when the connection is kept alive between requests
+    keepAlive = False
+
     def request(self, request):
         if self._state != 'QUIESCENT':
             return fail(RequestNotSent())
 
+        reused = self.requestCount > 0
+        self.requestCount += 1
+
         self._state = 'TRANSMITTING'
         _requestDeferred = maybeDeferred(request.writeTo, self.transport)
         self._finishedRequest = Deferred()
@@ -118,6 +140,7 @@ class HTTP11ClientProtocol(_newclient.HTTP11ClientProtocol):
 
         self._transportProxy = TransportProxyProducer(self.transport)
         self._parser = HTTPClientParser(request, self._finishResponse)
+        self._parser.keepAlive = self.keepAlive
         self._parser.makeConnection(self._transportProxy)
         self._responseDeferred = self._parser._responseDeferred
 
@@ -138,22 +161,63 @@ class HTTP11ClientProtocol(_newclient.HTTP11ClientProtocol):
 
         _requestDeferred.addCallbacks(cbRequestWrotten, ebRequestWriting)
 
+        def cbResponse(response):
+            response.connectionReused = reused
+            return response
+        self._finishedRequest.addCallback(cbResponse)
+
         return self._finishedRequest
 
 class _HTTP11ClientFactory(client._HTTP11ClientFactory):
     noisy = False
+    keepAlive = False
+
     def buildProtocol(self, addr):
-        return HTTP11ClientProtocol(self._quiescentCallback)
+        protocol = HTTP11ClientProtocol(self._quiescentCallback)
+        protocol.keepAlive = self.keepAlive
+        return protocol
+
+class _PersistentHTTP11ClientFactory(_HTTP11ClientFactory):
+    keepAlive = True
 
 class HTTPConnectionPool(client.HTTPConnectionPool):
     _factory = _HTTP11ClientFactory
 
+class PersistentHTTPConnectionPool(HTTPConnectionPool):
+    _factory = _PersistentHTTP11ClientFactory
+
+def createConnectionPool(persistent=False):
+    """
+    Returns a pool of connections that preserve the true headers.
+
+    When persistent is True connections are kept alive between requests. At
+    most http_max_idle_connections_per_host idle connections are kept per
+    host, and they are closed after being idle for http_idle_timeout seconds.
+    This does not limit the number of concurrent connections to a host, which
+    is done by the rate limiting of the measurements.
+
+    When persistent is False the responses are parsed as they always have
+    been: the connection control headers are only kept in the reported
+    headers and the body is read until the connection is closed.
+    """
+    if not persistent:
+        return HTTPConnectionPool(reactor, False)
+    pool = PersistentHTTPConnectionPool(reactor, True)
+    if config.advanced.http_max_idle_connections_per_host:
+        pool.maxPersistentPerHost = \
+            config.advanced.http_max_idle_connections_per_host
+    if config.advanced.http_idle_timeout:
+        pool.cachedConnectionTimeout = config.advanced.http_idle_timeout
+    return pool
+
 class TrueHeadersAgent(client.Agent):
     def __init__(self, *args, **kw):
+        persistent = kw.pop('persistent', False)
         super(TrueHeadersAgent, self).__init__(*args, **kw)
-        self._pool = HTTPConnectionPool(reactor, False)
+        self._pool = createConnectionPool(persistent)
 
 class TrueHeadersSOCKS5Agent(SOCKS5Agent):
     def __init__(self, *args, **kw):
+        persistent = kw.pop('persistent', False)
         super(TrueHeadersSOCKS5Agent, self).__init__(*args, **kw)
-        self._pool = HTTPConnectionPool(reactor, False)
+        self._pool = createConnectionPool(persistent)
@@ -0,0 +1,294 @@
+"""
+Support for running a NetTest in several worker processes.
+
+The parent process starts Tor, looks up the probe IP address, computes the
+test details (the geoip data and the hashes of the inputs included) and
+creates the reports. It then spawns one worker process per shard of the input. Every
+worker runs its own Director on the inputs whose index modulo the number of
+workers is equal to its shard number and sends back the serialized report
+entries, that the parent writes to its reporters.
+"""
+import os
+import sys
+import json
+
+from twisted.internet import defer, process, protocol, reactor
+
+from ooni.settings import config
+from ooni.utils import log
+from ooni.errors import MalformedWorkerEntry
+from ooni.reporter import OReporter, Report, serializeEntry
+
+# The file descriptor on which the workers write their report entries. stdout
+# and stderr are used for logging.
+ENTRIES_FD = 3
+
+def encodeEntry(entry):
+    """
+    Returns the netstring of a serialized report entry.
+    """
+    return "%d:%s," % (len(entry), entry)
+
+class WorkerReporter(OReporter):
+    """
+    The reporter used by the workers. It writes every report entry, serialized
+    as a YAML document, to the parent process.
+
+    The entries are written without blocking the reactor. While the parent is
+    not keeping up with reading them, the deferreds returned by
+    writeReportEntry only fire once it has caught up.
+    """
+    serializationFormat = 'yaml'
+
+    def __init__(self, fd=ENTRIES_FD, reactor=reactor):
+        self.fd = fd
+        self.reactor = reactor
+        self.writer = None
+        self.paused = False
+        self.waiting = []
+        self.closed = defer.Deferred()
+        OReporter.__init__(self, {})
+
+    def createReport(self):
+        self.writer = process.ProcessWriter(self.reactor, self, 'entries',
+                                            self.fd)
+        self.writer.registerProducer(self, True)
+
+    def writeReportEntry(self, entry):
+        self.writer.write(encodeEntry(serializeEntry(entry)))
+        if self.paused:
+            d = defer.Deferred()
+            self.waiting.append(d)
+            return d
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        waiting, self.waiting = self.waiting, []
+        for d in waiting:
+            d.callback(None)
+
+    def stopProducing(self):
+        self.resumeProducing()
+
+    def childConnectionLost(self, name, reason):
+        self.resumeProducing()
+        self.closed.callback(None)
+
+    def finish(self):
+        self.writer.unregisterProducer()
+        self.writer.loseConnection()
+        return self.closed
+
+class WorkerProcessProtocol(protocol.ProcessProtocol):
+    """
+    Receives the report entries of a worker and writes them to the report.
+    """
+    def __init__(self, shard, report, report_entry_manager):
+        self.shard = shard
+        self.report = report
+        self.reportEntryManager = report_entry_manager
+        self.done = defer.Deferred()
+        self.written = []
+        self.paused = False
+        self.failure = None
+        self._buffer = ''
+
+    def childDataReceived(self, childFD, data):
+        if childFD == ENTRIES_FD:
+            if self.failure:
+                return
+            self._buffer += data
+            try:
+                self._parseEntries()
+            except MalformedWorkerEntry as exc:
+                log.err("Worker %d sent a malformed report entry: %s" %
+                        (self.shard, exc))
+                self.failure = exc
+                self._buffer = ''
+                self.transport.signalProcess('TERM')
+        else:
+            for line in data.splitlines():
+                log.msg("[worker %d] %s" % (self.shard, line))
+
+    def _parseEntries(self):
+        while True:
+            length, sep, rest = self._buffer.partition(':')
+            if not sep:
+                if not self._buffer.isdigit() and self._buffer:
+                    raise MalformedWorkerEntry("bad length %r" %
+                                               self._buffer[:20])
+                return
+            if not length.isdigit():
+                raise MalformedWorkerEntry("bad length %r" % length[:20])
+            length = int(length)
+            if len(rest) < length + 1:
+                return
+            if rest[length] != ',':
+                raise MalformedWorkerEntry("missing ',' after %d bytes" %
+                                           length)
+            entry = rest[:length]
+            self._buffer = rest[length + 1:]
+            self.writeEntry(entry)
+
+    def writeEntry(self, entry):
+        d = self.report.write(entry)
+        self.written.append(d)
+        if self.reportEntryManager.backlogFull and not self.paused:
+            # Stop reading from the worker until the backlog has drained.
+            # The worker will then stop writing to us.
+            self.paused = True
+            self.transport.pauseProducing()
+            self.reportEntryManager.whenBacklogDrained().addCallback(
+                self._resume)
+
+    def _resume(self, result):
+        self.paused = False
+        self.transport.resumeProducing()
+
+    def processEnded(self, reason):
+        if reason.value.exitCode and not self.failure:
+            log.err("Worker %d exited with code %s" % (self.shard,
+                                                       reason.value.exitCode))
+        if self._buffer:
+            log.err("Worker %d exited in the middle of a report entry, "
+                    "%d bytes were lost" % (self.shard, len(self._buffer)))
+            self.failure = MalformedWorkerEntry("truncated entry")
+        d = defer.DeferredList(self.written)
+        d.addBoth(self._finished)
+
+    def _finished(self, result):
+        if self.failure:
+            self.done.errback(self.failure)
+        else:
+            self.done.callback(self.shard)
+
+def workerArguments(net_test_loader, shard, shards):
+    """
+    Returns the JSON encoded arguments of the worker for shard out of shards.
+
+    We pass the options of the test classes as they are after the deck has
+    been set up, since the test helpers and the paths of the inputs may have
+    been changed by it.
+    """
+    local_options = {}
+    for test_class, _ in net_test_loader.testCases:
+        local_options.update(dict(test_class.localOptions))
+
+    return json.dumps({
+        'shard': shard,
+        'shards': shards,
+        'test_file': net_test_loader.testFile,
+        'options': net_test_loader.options,
+        'local_options': local_options,
+        'probe_ip': config.probe_ip.address,
+        'test_details': dict(net_test_loader.setupTestDetails()),
+        'socks_port': config.tor.socks_port,
+        'control_port': config.tor.control_port,
+        'configfile': config.global_options.get('configfile'),
+        'datadir': config.global_options.get('datadir')
+    })
+
+def spawnWorker(net_test_loader, shard, shards, report, report_entry_manager):
+    process_protocol = WorkerProcessProtocol(shard, report,
+                                             report_entry_manager)
+    args = [sys.executable, '-m', 'ooni.workers',
+            workerArguments(net_test_loader, shard, shards)]
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(sys.path)
+    reactor.spawnProcess(process_protocol, sys.executable, args, env=env,
+                         childFDs={0: 'w', 1: 'r', 2: 'r', ENTRIES_FD: 'r'})
+    return process_protocol
+
+@defer.inlineCallbacks
+def runShardedNetTest(net_test_loader, reporters, report_entry_manager,
+                      shards):
+    """
+    Runs the NetTest of net_test_loader in shards worker processes and writes
+    the report entries of all of them to reporters.
+    """
+    report = Report(reporters, report_entry_manager)
+    yield report.open()
+
+    workers = []
+    for shard in range(shards):
+        log.msg("Starting worker %d of %d" % (shard + 1, shards))
+        workers.append(spawnWorker(net_test_loader, shard, shards, report,
+                                   report_entry_manager))
+
+    results = yield defer.DeferredList([worker.done for worker in workers],
+                                       consumeErrors=True)
+    for shard, (success, result) in enumerate(results):
+        if not success:
+            log.err("Worker %d failed, its report entries are incomplete: %s"
+                    % (shard, result.getErrorMessage()))
+    yield report.close()
+
+class StaticProbeIP(object):
+    """
+    The probe IP address as it has been looked up by the parent process.
+    """
+    strategy = 'parent_process'
+
+    def __init__(self, address):
+        self.address = address
+
+    def lookup(self):
+        return defer.succeed(self.address)
+
+def runWorker(arguments):
+    """
+    The entry point of a worker process.
+    """
+    from ooni.director import Director
+    from ooni.nettest import NetTestLoader
+
+    arguments = json.loads(arguments)
+
+    config.global_options = {'configfile': arguments['configfile'],
+                             'datadir': arguments['datadir']}
+    config.set_paths()
+    config.read_config_file()
+
+    # Tor, the probe IP lookup, the test details and the packet capture are
+    # taken care of by the parent process.
+    config.advanced.start_tor = False
+    config.privacy.includepcap = False
+    config.tor.socks_port = arguments['socks_port']
+    config.tor.control_port = arguments['control_port']
+    config.probe_ip = StaticProbeIP(arguments['probe_ip'])
+
+    net_test_loader = NetTestLoader(arguments['options'],
+                                    test_file=arguments['test_file'])
+    net_test_loader.checkOptions()
+    for test_class, _ in net_test_loader.testCases:
+        for key, value in arguments['local_options'].items():
+            if key in test_class.localOptions:
+                test_class.localOptions[key] = value
+    net_test_loader.shard = (arguments['shard'], arguments['shards'])
+    net_test_loader.setupTestDetails(arguments['test_details'])
+
+    director = Director()
+
+    def shutdown(result):
+        try:
+            reactor.stop()
+        except Exception:
+            pass
+
+    def start():
+        d = director.startNetTest(net_test_loader, [WorkerReporter()])
+        d.addErrback(log.exception)
+        d.addBoth(shutdown)
+
+    reactor.callWhenRunning(start)
+    reactor.run()
+
+if __name__ == "__main__":
+    import copy_reg
+    from ooni.utils.hacks import patched_reduce_ex
+    copy_reg._reduce_ex = patched_reduce_ex
+
+    runWorker(sys.argv[1])
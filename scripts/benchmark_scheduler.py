@@ -0,0 +1,76 @@
+# Benchmark for the TaskManager scheduler.
+#
+# Schedules a large number of synthetic tasks, a fraction of which fail once
+# and get retried, and prints the time spent per task for every batch. The
+# per task overhead should stay roughly constant as the run progresses.
+#
+# Usage: python scripts/benchmark_scheduler.py [number of tasks] [retry rate]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from twisted.internet import defer
+
+from ooni.settings import config
+from ooni.tasks import BaseTask
+from ooni.managers import TaskManager
+
+config.logging = False
+
+class SyntheticTask(BaseTask):
+    def __init__(self, fail_once):
+        BaseTask.__init__(self)
+        self.failOnce = fail_once
+
+    def run(self):
+        if self.failOnce and self.failures == 0:
+            return defer.fail(Exception("synthetic failure"))
+        return defer.succeed(None)
+
+class BenchmarkTaskManager(TaskManager):
+    def __init__(self, batch_size):
+        TaskManager.__init__(self)
+        self.batchSize = batch_size
+        self.completed = 0
+        self.batchStart = time.time()
+        self.batchTimes = []
+
+    def succeeded(self, result, task):
+        self.completed += 1
+        if self.completed % self.batchSize == 0:
+            now = time.time()
+            self.batchTimes.append(now - self.batchStart)
+            self.batchStart = now
+
+    def failed(self, failure, task):
+        pass
+
+def generateTasks(number, retry_rate):
+    retry_every = int(1 / retry_rate) if retry_rate else 0
+    for i in xrange(number):
+        yield SyntheticTask(retry_every and i % retry_every == 0)
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    retry_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    batch_size = max(number / 10, 1)
+
+    manager = BenchmarkTaskManager(batch_size)
+    manager.concurrency = 10
+    manager.retries = 2
+
+    start = time.time()
+    manager.schedule(generateTasks(number, retry_rate))
+    total = time.time() - start
+
+    print "Scheduled %d tasks (%d%% retried) in %.2f seconds" % (
+        number, retry_rate * 100, total)
+    print "Failures: %d" % manager.failures
+    for i, batch_time in enumerate(manager.batchTimes):
+        print "batch %2d: %.2f us/task" % (i, batch_time * 1e6 / batch_size)
+
+if __name__ == "__main__":
+    main()
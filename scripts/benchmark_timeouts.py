@@ -0,0 +1,65 @@
+# Benchmark comparing a callLater per task with the shared timing wheel for
+# task timeouts.
+#
+# We simulate a steady state with a number of measurements in flight, each of
+# them holding a timeout. On every reactor iteration a batch of measurements
+# completes (cancelling its timeout) and is replaced by new ones (scheduling
+# a new timeout). This accounts both for the cost of scheduling and
+# cancelling and for the cost of the reactor maintaining its heap of delayed
+# calls.
+#
+# Usage: python scripts/benchmark_timeouts.py [measurements] [in flight]
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from twisted.internet import reactor
+
+from ooni.settings import config
+from ooni.utils.timingwheel import TimingWheel
+
+config.logging = False
+
+def timedOut():
+    pass
+
+def run(schedule, number, in_flight, batch=500, timeout=60):
+    """
+    Returns the number of seconds it took to run number measurements keeping
+    in_flight timeouts pending.
+    """
+    rng = random.Random(0)
+    timers = [schedule(timeout, timedOut) for _ in xrange(in_flight)]
+    start = time.time()
+    for _ in range(number / batch):
+        for _ in range(batch):
+            i = rng.randrange(in_flight)
+            timers[i].cancel()
+            timers[i] = schedule(timeout, timedOut)
+        reactor.runUntilCurrent()
+    elapsed = time.time() - start
+    for timer in timers:
+        timer.cancel()
+    reactor.runUntilCurrent()
+    return elapsed
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    in_flight = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    wheel = TimingWheel(tick=0.1, clock=reactor)
+
+    print "%d measurements, %d in flight" % (number, in_flight)
+    results = [('callLater', run(reactor.callLater, number, in_flight)),
+               ('timing wheel', run(wheel.callLater, number, in_flight))]
+
+    for name, elapsed in results:
+        print "%-12s: %.2f s (%.2f us/measurement)" % (name, elapsed,
+                                                      elapsed * 1e6 / number)
+    print "speedup: %.1fx" % (results[0][1] / results[1][1])
+
+if __name__ == "__main__":
+    main()
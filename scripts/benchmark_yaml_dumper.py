@@ -0,0 +1,80 @@
+# Benchmark comparing the pure Python YAML dumper of the reports with the one
+# backed by libyaml.
+#
+# We serialize report entries like the ones of http_requests (two requests
+# with HTML bodies) and traceroute (lists of scapy packets).
+#
+# Usage: python scripts/benchmark_yaml_dumper.py [entries] [body size]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import yaml
+from scapy.all import IP, TCP, ICMP
+
+from ooni.settings import config
+from ooni.reporter import OSafeDumper, OSafeCDumper
+
+config.logging = False
+
+def httpRequestsEntry(body_size):
+    body = '<html>\n<head><title>Example</title></head>\n<body>\n'
+    while len(body) < body_size:
+        body += '<p>Lorem ipsum dolor sit amet, consectetur adipiscing.</p>\n'
+    body += '</body>\n</html>\n'
+    requests = []
+    for tor in (False, True):
+        requests.append({
+            'request': {'url': 'http://example.com/', 'method': 'GET',
+                        'headers': [('User-Agent', ['Mozilla/5.0 (Windows; '
+                                                    'U; Windows NT 6.1)'])],
+                        'body': None, 'tor': tor},
+            'response': {'code': 200, 'body': body,
+                         'headers': [('Content-Type', ['text/html']),
+                                     ('Server', ['nginx']),
+                                     ('Date', ['Mon, 01 Jan 2014 00:00:00'])]}
+        })
+    return {'input': 'http://example.com/', 'test_name': 'http_requests',
+            'test_runtime': 0.5, 'control_failure': None,
+            'experiment_failure': None, 'body_length_match': True,
+            'body_proportion': 1.0, 'factor': 0.8, 'headers_match': False,
+            'headers_diff': ['Date'], 'requests': requests}
+
+def tracerouteEntry(hops=30):
+    sent = [IP(dst='8.8.8.8', ttl=ttl)/TCP(dport=80) for ttl in range(1, hops)]
+    answered = [[packet, IP(src='10.0.0.%d' % i)/ICMP(type=11)]
+                for i, packet in enumerate(sent)]
+    return {'input': None, 'test_name': 'traceroute', 'test_runtime': 20.0,
+            'sent_packets': sent, 'answered_packets': answered,
+            'hops_80': [('10.0.0.%d' % i, i) for i in range(1, hops)]}
+
+def run(dumper, entries):
+    start = time.time()
+    for entry in entries:
+        yaml.dump_all([entry], Dumper=dumper)
+    return time.time() - start
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    body_size = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+
+    for name, entry in (('http_requests', httpRequestsEntry(body_size)),
+                        ('traceroute', tracerouteEntry())):
+        entries = [entry] * number
+        print "%d %s entries" % (number, name)
+        python_time = run(OSafeDumper, entries)
+        print "  python : %.2f s (%.2f ms/entry)" % (python_time,
+                                                    python_time * 1e3 / number)
+        if OSafeCDumper is None:
+            print "  libyaml: not available (PyYAML is not built with it)"
+            continue
+        c_time = run(OSafeCDumper, entries)
+        print "  libyaml: %.2f s (%.2f ms/entry)" % (c_time,
+                                                    c_time * 1e3 / number)
+        print "  speedup: %.1fx" % (python_time / c_time)
+
+if __name__ == "__main__":
+    main()